@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""Measure the memory used to serve a listjobs.json response.
+
+Usage: python extras/bench_json.py [entries ...]
+
+Schedules the given numbers of pending jobs (10k, 100k and 1M by default) in
+the SQLite queue of a project, and requests listjobs.json over HTTP from a
+Scrapyd website listening on localhost, with a client counting and dropping
+the bytes received. The response is served once built in memory, and once
+streamed by JsonProducer through the transport, reading the pending jobs of
+the queue a page at a time. The peak memory allocated during the request,
+measured with tracemalloc, includes the queue rows read and the job dicts.
+Needs Python 3 for tracemalloc.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from twisted.internet import defer, protocol, reactor
+from twisted.web import server
+
+from scrapyd.app import application
+from scrapyd.config import Config
+from scrapyd.webservice import ListJobs
+from scrapyd.website import Root
+
+
+class BufferedListJobs(ListJobs):
+    """listjobs.json built in memory, as in previous versions"""
+
+    streaming = False
+
+    def render_GET(self, txrequest):
+        r = ListJobs.render_GET(self, txrequest)
+        r['pending'] = list(r['pending'])
+        return r
+
+
+class DropClient(protocol.Protocol):
+    """Client sending a request and counting the bytes of the response"""
+
+    def __init__(self, path):
+        self.path = path
+        self.received = 0
+        self.done = defer.Deferred()
+
+    def connectionMade(self):
+        self.transport.write(b'GET ' + self.path + b' HTTP/1.1\r\n'
+                             b'Host: localhost\r\nConnection: close\r\n\r\n')
+
+    def dataReceived(self, data):
+        self.received += len(data)
+
+    def connectionLost(self, reason):
+        self.done.callback(self.received)
+
+
+@defer.inlineCallbacks
+def fetch(port, path):
+    client = DropClient(path)
+    yield protocol.ClientCreator(reactor, lambda: client).connectTCP(
+        '127.0.0.1', port.getHost().port)
+    received = yield client.done
+    return received
+
+
+@defer.inlineCallbacks
+def bench(port, path):
+    tracemalloc.start()
+    start = time.time()
+    received = yield fetch(port, path + b'?project=p1')
+    elapsed = time.time() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak, elapsed, received
+
+
+def make_root(entries):
+    d = tempfile.mkdtemp(prefix='bench_json')
+    os.makedirs(os.path.join(d, 'eggs', 'p1'))
+    config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                            'dbs_dir': os.path.join(d, 'dbs'),
+                            'logs_dir': '', 'items_dir': '',
+                            'runner': 'scrapyd.runner'})
+    root = Root(config, application(config))
+    root.putChild(b'listjobs.json', ListJobs(root))
+    root.putChild(b'buffered.json', BufferedListJobs(root))
+    batch = 10000
+    for i in range(0, entries, batch):
+        root.scheduler.schedule_many('p1', [
+            ('spider%d' % (j % 10), 0, {'_job': '%032x' % j, 'arg': 'value'})
+            for j in range(i, min(entries, i + batch))])
+    return d, root
+
+
+@defer.inlineCallbacks
+def main():
+    sizes = [int(x) for x in sys.argv[1:]] or [10000, 100000, 1000000]
+    print("%10s %12s %12s %10s %10s %12s" % (
+        "entries", "buffered MB", "streamed MB", "buffered s", "streamed s",
+        "response MB"))
+    try:
+        for entries in sizes:
+            d, root = make_root(entries)
+            port = reactor.listenTCP(0, server.Site(root),
+                                     interface='127.0.0.1')
+            try:
+                bpeak, btime, _ = yield bench(port, b'/buffered.json')
+                speak, stime, size = yield bench(port, b'/listjobs.json')
+            finally:
+                yield port.stopListening()
+                shutil.rmtree(d)
+            print("%10d %12.1f %12.1f %10.2f %10.2f %12.1f" % (
+                entries, bpeak / 2.0 ** 20, speak / 2.0 ** 20, btime, stime,
+                size / 2.0 ** 20))
+    finally:
+        reactor.stop()
+
+
+if __name__ == '__main__':
+    reactor.callWhenRunning(main)
+    reactor.run()
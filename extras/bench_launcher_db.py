@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+"""Measure the launcher.db bookkeeping throughput of job spawns and finishes.
+
+Usage: python extras/bench_launcher_db.py [jobs]
+
+Replays what Launcher does to its database when a job finishes and the next
+one is spawned in the same reactor turn, with the default SQLite settings,
+with WAL and synchronous=NORMAL, and with group commit on top of that.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from twisted.internet.task import Clock
+
+from scrapyd.sqlite import JsonSqliteDict, JsonSqliteList
+
+PROCESS = {'project': 'project', 'spider': 'spider', 'job': '0' * 32,
+           'pid': 1234, 'slot': 0, 'priority': '0.0',
+           'start_time': '2020-01-01 00:00:00', 'end_time': None,
+           'msg': {'_project': 'project', '_spider': 'spider'}, 'env': {}}
+
+
+def bench(tmpdir, name, jobs, pragmas=None, group_commit=False):
+    dbpath = os.path.join(tmpdir, '%s.db' % name)
+    processes = JsonSqliteDict(dbpath, 'processes', pragmas, group_commit)
+    finished = JsonSqliteList(dbpath, 'finished_job', pragmas, group_commit)
+    clock = Clock()
+    if group_commit:
+        processes.commit.clock = clock
+    start = time.time()
+    for i in range(jobs):
+        slot = i % 16
+        processes[slot] = PROCESS  # spawn
+        processes.pop(slot)        # finish
+        finished.append(PROCESS)
+        clock.advance(0)           # end of the reactor turn
+    return jobs / (time.time() - start)
+
+
+def main(jobs=2000):
+    tmpdir = tempfile.mkdtemp()
+    wal = {'journal_mode': 'wal', 'synchronous': 'normal'}
+    try:
+        print("%-28s %10s" % ("settings", "jobs/s"))
+        print("%-28s %10.0f" % ("default (rollback journal)",
+                                bench(tmpdir, 'default', jobs)))
+        print("%-28s %10.0f" % ("wal, synchronous=normal",
+                                bench(tmpdir, 'wal', jobs, wal)))
+        print("%-28s %10.0f" % ("wal + group commit",
+                                bench(tmpdir, 'group', jobs, wal, True)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""Measure the latency of the logstats chart queries.
+
+Usage: python extras/bench_logstats.py [rows] [spiders] [queries]
+
+Fills a temporary logstats database with the given number of job stats (10M
+by default) spread over a year and the given number of spiders (500 by
+default), then runs the given number of queries (100 by default) of 90 day
+charts of 100 points, for all the spiders and for a random one, reading
+either the raw stats or the rollups. The charts of all the spiders read the
+rollups summed over every spider. Prints the median and 99th percentile
+latencies in milliseconds.
+"""
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+from scrapyd.sqlite import LogStatsSqliteData
+
+DAY = 86400000
+
+
+def fill(database, rows, spiders):
+    """Insert the raw stats with a single statement, the rollups are then
+    computed when LogStatsSqliteData creates them"""
+    data = LogStatsSqliteData(database)
+    for name, _ in data.rollups:
+        for suffix, _ in data.levels:
+            data.conn.execute("drop table %s_%s%s" % (data.table, name, suffix))
+    step = 365 * DAY // rows
+    q = "with recursive n(i) as (select 0 union all select i + 1 from n " \
+        "where i < ?) insert into log_stats (project, spider, job, " \
+        "create_time, log_count, items, pages, errors, warnings) " \
+        "select 'p' || (i % 10), 's' || (i % ?), 'j' || i, ? + i * ?, " \
+        "100, i % 1000, i % 500, i % 3, i % 7 from n"
+    data.conn.execute(q, (rows - 1, spiders, 1000 * DAY, step))
+    data.conn.commit()
+    return LogStatsSqliteData(database)
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return (latencies[len(latencies) // 2] * 1000,
+            latencies[int(len(latencies) * 0.99)] * 1000)
+
+
+def bench(data, queries, spiders, use_rollups, spider):
+    latencies = []
+    for _ in range(queries):
+        st = 1000 * DAY + random.randrange(0, 275) * DAY
+        kwargs = {'spider': 's%d' % random.randrange(spiders)} if spider else {}
+        start = time.time()
+        data.get_stats(st, st + 90 * DAY, points=100, use_rollups=use_rollups,
+                       **kwargs)
+        latencies.append(time.time() - start)
+    return percentiles(latencies)
+
+
+def main():
+    args = [int(x) for x in sys.argv[1:]]
+    rows, spiders, queries = args + [10000000, 500, 100][len(args):]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        data = fill(os.path.join(tmpdir, 'logstats.db'), rows, spiders)
+        print("filled %d rows and rollups in %.1fs" % (rows, time.time() - start))
+        print("%-12s %-8s %10s %10s" % ("source", "spider", "p50 ms", "p99 ms"))
+        for use_rollups in (False, True):
+            for spider in (False, True):
+                p50, p99 = bench(data, queries, spiders, use_rollups, spider)
+                print("%-12s %-8s %10.1f %10.1f" % (
+                    "rollups" if use_rollups else "raw",
+                    "one" if spider else "all", p50, p99))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
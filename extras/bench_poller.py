@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Measure how fast scheduled jobs reach the launcher slots.
+
+Usage: python extras/bench_poller.py [max_proc [jobs [projects]]]
+
+A burst of jobs is scheduled through SpiderScheduler while max_proc slots are
+waiting on QueuePoller.next(), the same way Launcher waits on them. Reports
+the schedule-to-spawn latency of the jobs that got a slot and the time it
+took to saturate every slot. Without the scheduler notification each slot
+would have waited for a poll_interval tick.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from scrapyd.config import Config
+from scrapyd.poller import QueuePoller
+from scrapyd.scheduler import SpiderScheduler
+
+
+def main(max_proc=32, jobs=200, projects=1):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        eggs_dir = os.path.join(tmpdir, 'eggs')
+        dbs_dir = os.path.join(tmpdir, 'dbs')
+        for i in range(projects):
+            os.makedirs(os.path.join(eggs_dir, 'project%d' % i))
+        config = Config(values={'eggs_dir': eggs_dir, 'dbs_dir': dbs_dir})
+        poller = QueuePoller(config)
+        scheduler = SpiderScheduler(config)
+        scheduler.add_listener(poller.notify)
+
+        spawned = []
+        for slot in range(max_proc):
+            poller.next().addCallback(
+                lambda msg: spawned.append((msg, time.time())))
+
+        start = time.time()
+        latencies = []
+        for i in range(jobs):
+            scheduled = time.time()
+            scheduler.schedule('project%d' % (i % projects), 'spider',
+                               _job=str(i))
+            latencies.extend(t - scheduled for msg, t in spawned
+                             if msg['_job'] == str(i))
+        saturated = spawned[-1][1] - start
+
+        latencies.sort()
+        print("slots filled:           %d/%d" % (len(spawned), max_proc))
+        print("schedule-to-spawn p50:  %.3f ms"
+              % (latencies[len(latencies) // 2] * 1000))
+        print("schedule-to-spawn max:  %.3f ms" % (latencies[-1] * 1000))
+        print("time to saturate slots: %.3f ms" % (saturated * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main(*[int(x) for x in sys.argv[1:]])
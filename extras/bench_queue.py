@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+"""Measure JsonSqlitePriorityQueue.pop() latency as the queue grows.
+
+Usage: python extras/bench_queue.py [size ...]
+
+Each queue is filled with the given number of messages spread over a few
+priorities, then the average pop() latency is measured while keeping the
+queue size constant. With the (priority, id) index the latency should stay
+flat regardless of the queue size.
+
+The last columns measure finding the next message while those of the queue
+belong to a spider at its limit of running jobs, except for one of another
+spider: with the query reading the queue in priority order past the blocked
+messages, and with the index searched once per spider by _head().
+"""
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from scrapyd.sqlite import JsonSqlitePriorityQueue
+
+SIZES = [100, 1000, 10000, 100000, 1000000]
+POPS = 1000
+
+
+def fill(q, size):
+    msg = q.encode({'name': 'spider', '_job': '0' * 32})
+    q.conn.executemany("insert into %s (priority, message) values (?,?)"
+                       % q.table, ((i % 10, msg) for i in range(size)))
+    q.conn.commit()
+
+
+def bench(size, tmpdir):
+    q = JsonSqlitePriorityQueue(os.path.join(tmpdir, '%d.db' % size))
+    fill(q, size)
+
+    def pop_put():
+        q.put(q.pop(), priority=5)
+
+    return timeit.timeit(pop_put, number=POPS) / POPS
+
+
+def bench_blocked(size, tmpdir):
+    q = JsonSqlitePriorityQueue(os.path.join(tmpdir, 'blocked%d.db' % size))
+    q.put_many([('blocked', i % 10, 'blocked') for i in range(size)] +
+               [('free', 0, 'free')])
+    running = {'blocked': (1, 1)}
+
+    def scan():
+        cte, query, args = q._next('priority', running)
+        q.conn.execute(cte + query, args).fetchone()
+
+    def seek():
+        q._head(running)
+
+    pops = max(1, min(POPS, 10000000 // size))
+    return (timeit.timeit(scan, number=pops) / pops,
+            timeit.timeit(seek, number=POPS) / POPS)
+
+
+def main(sizes):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print("%10s %14s %14s %14s" % ("messages", "pop+put (ms)",
+                                       "blocked scan", "blocked seek"))
+        for size in sizes:
+            scan, seek = bench_blocked(size, tmpdir)
+            print("%10d %14.3f %14.3f %14.3f" % (
+                size, bench(size, tmpdir) * 1000, scan * 1000, seek * 1000))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or SIZES)
@@ -0,0 +1,88 @@
+import os
+
+from twisted.python import log
+
+
+def read_meminfo(path='/proc/meminfo'):
+    """Return the total and available memory in bytes, or None if unknown"""
+    try:
+        with open(path) as f:
+            info = dict(line.split(':', 1) for line in f)
+        return (int(info['MemTotal'].split()[0]) * 1024,
+                int(info['MemAvailable'].split()[0]) * 1024)
+    except (IOError, KeyError, ValueError):
+        return None
+
+
+def read_loadavg(path='/proc/loadavg'):
+    """Return the 1 minute load average, or None if unknown"""
+    try:
+        with open(path) as f:
+            return float(f.read().split()[0])
+    except (IOError, IndexError, ValueError):
+        return None
+
+
+def read_rss(pid):
+    """Return the resident set size of a process in bytes, or None if
+    unknown"""
+    try:
+        with open('/proc/%d/statm' % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, IndexError, ValueError, OSError):
+        return None
+
+
+class AdmissionController(object):
+    """Decide how many jobs the launcher runs at once, between `min_proc` and
+    `max_proc`, from the load, the available memory and the memory used by
+    the running jobs.
+
+    The capacity is counted in job weights, 1 unless declared otherwise when
+    the job was scheduled. It grows by a quarter at every sample while the
+    system has room, and shrinks by a quarter when the load per cpu exceeds
+    ``max_load_per_cpu`` or the available memory drops below
+    ``min_free_memory`` percent. The memory used by the running jobs per unit
+    of weight also caps it to what the available memory can hold.
+    """
+
+    meminfo = staticmethod(read_meminfo)
+    loadavg = staticmethod(read_loadavg)
+    rss = staticmethod(read_rss)
+
+    def __init__(self, config, min_proc, max_proc, cpus):
+        self.min_proc = min_proc
+        self.max_proc = max_proc
+        self.cpus = cpus
+        self.max_load = config.getfloat('max_load_per_cpu', 1.5)
+        self.min_free = config.getfloat('min_free_memory', 10) / 100.0
+        self.capacity = float(min_proc)
+
+    def admit(self, count, weight):
+        """Return whether another job can be started while `count` jobs of a
+        total weight of `weight` are running or about to"""
+        return count < self.min_proc or weight + 1 <= self.capacity
+
+    def sample(self, pids, weight):
+        """Adjust the capacity, given the pids and the total weight of the
+        running jobs"""
+        capacity = self.capacity
+        mem, load = self.meminfo(), self.loadavg()
+        reserve = mem[0] * self.min_free if mem else 0
+        if (mem and mem[1] < reserve) or \
+                (load is not None and load > self.max_load * self.cpus):
+            capacity = min(capacity, weight) * 0.75
+        else:
+            target = self.max_proc
+            rss = [r for r in map(self.rss, pids) if r is not None]
+            if mem and rss and weight > 0:
+                per_weight = float(sum(rss)) / weight
+                target = min(target, weight + (mem[1] - reserve) / per_weight)
+            capacity = min(target, capacity + max(1.0, capacity / 4))
+        capacity = max(self.min_proc, min(self.max_proc, capacity))
+        if int(capacity) != int(self.capacity):
+            log.msg(format="Capacity changed to %(capacity).1f: load=%(load)r "
+                    "memory=%(mem)r running weight=%(weight)r",
+                    capacity=capacity, load=load, mem=mem, weight=weight,
+                    system='Launcher')
+        self.capacity = capacity
@@ -10,12 +10,13 @@ from twisted.web.guard import HTTPAuthSessionWrapper, BasicCredentialFactory
 from scrapy.utils.misc import load_object
 
 from .interfaces import IEggStorage, IPoller, ISpiderScheduler, IEnvironment
-from .eggstorage import FilesystemEggStorage
 from .scheduler import SpiderScheduler
-from .poller import QueuePoller
+from .poller import QueuePoller, QueueWatcher
 from .environ import Environment
+from .janitor import Janitor
 from .config import Config
 from .basicauth import PublicHTMLRealm, StringCredentialsChecker
+from .multipart import StreamingRequest
 
 def application(config):
     app = Application("Scrapyd")
@@ -24,9 +25,16 @@ def application(config):
     poll_interval = config.getfloat('poll_interval', 5)
 
     poller = QueuePoller(config)
-    eggstorage = FilesystemEggStorage(config)
-    scheduler = SpiderScheduler(config)
-    environment = Environment(config)
+    eggstorage = load_object(config.get(
+        'eggstorage', 'scrapyd.eggstorage.FilesystemEggStorage'))(config)
+    scheduler = SpiderScheduler(config, events=poller.events)
+    janitor = Janitor(config)
+    environment = Environment(config, janitor=janitor)
+
+    # wake the poller up as soon as something is scheduled, or when other
+    # processes write the queues, the timer below is only a fallback
+    scheduler.add_listener(poller.notify)
+    watcher = QueueWatcher(poller, config.get('dbs_dir', 'dbs'))
 
     app.setComponent(IPoller, poller)
     app.setComponent(IEggStorage, eggstorage)
@@ -56,12 +64,16 @@ def application(config):
     else:
         resource = webcls(config, app)
         log.msg("Basic authentication disabled as either `username` or `password` is unset")
-    webservice = TCPServer(http_port, server.Site(resource), interface=bind_address)
+    site = server.Site(resource)
+    site.requestFactory = StreamingRequest
+    webservice = TCPServer(http_port, site, interface=bind_address)
     log.msg(format="Scrapyd web console available at http://%(bind_address)s:%(http_port)s/",
             bind_address=bind_address, http_port=http_port)
 
+    janitor.setServiceParent(app)
     launcher.setServiceParent(app)
     timer.setServiceParent(app)
+    watcher.setServiceParent(app)
     webservice.setServiceParent(app)
 
     return app
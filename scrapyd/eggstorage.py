@@ -1,7 +1,11 @@
+import hashlib
+import json
+import os
 import re
+import time
 from glob import glob
 from os import path, makedirs, remove
-from shutil import copyfileobj, rmtree
+from shutil import copyfile, copyfileobj, rmtree
 from distutils.version import LooseVersion
 
 from zope.interface import implementer
@@ -10,41 +14,229 @@ from .interfaces import IEggStorage
 
 @implementer(IEggStorage)
 class FilesystemEggStorage(object):
+    """Egg storage keeping the eggs of each project in a directory.
+
+    The sorted versions of each project are cached in memory, and in a
+    ``.<project>.versions`` manifest next to the project directory, which is
+    what the runner processes read instead of listing the directory. Both
+    are validated by the modification time of the project directory, so
+    versions added or removed by another process are noticed.
+    """
+
+    # modification times more recent than this (in seconds) are not trusted,
+    # as another change within the resolution of the filesystem clock would
+    # not change them
+    racy_delay = 2
 
     def __init__(self, config):
         self.basedir = config.get('eggs_dir', 'eggs')
+        self.versions = {}  # project -> (mtime, sorted versions)
 
     def put(self, eggfile, project, version):
         eggpath = self._eggpath(project, version)
         eggdir = path.dirname(eggpath)
         if not path.exists(eggdir):
             makedirs(eggdir)
-        with open(eggpath, 'wb') as f:
-            copyfileobj(eggfile, f)
+        versions = self.list(project)
+        self._write(eggfile, eggpath)
+        name = path.splitext(path.basename(eggpath))[0]
+        if name not in versions:
+            self._index(project, versions + [name])
 
     def get(self, project, version=None):
         if version is None:
             try:
-                version = self.list(project)[-1]
+                version = self._versions(project)[-1]
             except IndexError:
                 return None, None
         return version, open(self._eggpath(project, version), 'rb')
 
     def list(self, project):
+        return list(self._versions(project))
+
+    def _versions(self, project):
+        """Return the cached sorted versions of the project, after checking
+        the directory mtime"""
         eggdir = path.join(self.basedir, project)
-        versions = [path.splitext(path.basename(x))[0] \
-            for x in glob("%s/*.egg" % eggdir)]
-        return sorted(versions, key=LooseVersion)
+        try:
+            mtime = os.stat(eggdir).st_mtime
+        except OSError:
+            self.versions.pop(project, None)
+            return []
+        cached = self.versions.get(project)
+        if cached is None or cached[0] != mtime:
+            cached = self._read_manifest(project)
+            if cached is None or cached[0] != mtime:
+                versions = [path.splitext(path.basename(x))[0] \
+                    for x in glob("%s/*.egg" % eggdir)]
+                cached = self._index(project, versions, mtime)
+            self.versions[project] = cached
+        return cached[1]
 
     def delete(self, project, version=None):
         if version is None:
             rmtree(path.join(self.basedir, project))
+            self.versions.pop(project, None)
+            try:
+                remove(self._manifest(project))
+            except OSError:
+                pass
         else:
-            remove(self._eggpath(project, version))
-            if not self.list(project): # remove project if no versions left
+            eggpath = self._eggpath(project, version)
+            versions = self.list(project)
+            remove(eggpath)
+            name = path.splitext(path.basename(eggpath))[0]
+            versions = [v for v in versions if v != name]
+            if not versions: # remove project if no versions left
                 self.delete(project)
+            else:
+                self._index(project, versions)
+
+    def _write(self, eggfile, eggpath):
+        """Write the egg to a temporary file renamed into place, so that a
+        runner never sees it half written"""
+        tmp = '%s.%d.tmp' % (eggpath, os.getpid())
+        with open(tmp, 'wb') as f:
+            copyfileobj(eggfile, f)
+        _replace(tmp, eggpath)
+
+    def _index(self, project, versions, mtime=None):
+        """Cache the versions of the project and write its manifest. The
+        directory mtime is only recorded if it can be trusted."""
+        if mtime is None:
+            mtime = os.stat(path.join(self.basedir, project)).st_mtime
+        if time.time() - mtime < self.racy_delay:
+            mtime = None
+        cached = mtime, sorted(versions, key=LooseVersion)
+        self.versions[project] = cached
+        manifest = self._manifest(project)
+        tmp = '%s.%d.tmp' % (manifest, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'mtime': cached[0], 'versions': cached[1]}, f)
+            _replace(tmp, manifest)
+        except (IOError, OSError):
+            pass  # read-only eggs_dir, the directory is listed every time
+        return cached
+
+    def _read_manifest(self, project):
+        try:
+            with open(self._manifest(project)) as f:
+                manifest = json.load(f)
+            return manifest['mtime'], manifest['versions']
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _manifest(self, project):
+        return path.join(self.basedir, '.%s.versions' % project)
 
     def _eggpath(self, project, version):
         sanitized_version = re.sub(r'[^a-zA-Z0-9_-]', '_', version)
         x = path.join(self.basedir, project, "%s.egg" % sanitized_version)
         return x
+
+
+class ContentAddressedEggStorage(FilesystemEggStorage):
+    """Egg storage keeping each distinct egg once, named after its SHA-256
+    hash, in the ``.blobs`` directory of ``eggs_dir``. The versions are hard
+    links to the blobs, so the layout of the project directories is the same
+    as FilesystemEggStorage's. Adding a version with an egg already stored
+    only reads it to compute its hash.
+
+    The blobs are removed once no version links to them. Eggs are copied
+    instead of linked on filesystems without hard links.
+    """
+
+    chunk_size = 65536
+
+    def __init__(self, config):
+        super(ContentAddressedEggStorage, self).__init__(config)
+        self.blobdir = path.join(self.basedir, '.blobs')
+        self.digests = {}  # egg path -> SHA-256 of the eggs put
+
+    def digest(self, project, version):
+        """Return the SHA-256 of the egg of the given project version if it
+        was put by this process, or None"""
+        eggpath = self._eggpath(project, version)
+        digest = self.digests.get(eggpath)
+        if digest is not None and path.exists(eggpath):
+            return digest
+
+    def delete(self, project, version=None):
+        super(ContentAddressedEggStorage, self).delete(project, version)
+        for eggpath in list(self.digests):
+            if not path.exists(eggpath):
+                del self.digests[eggpath]
+        self._remove_unused_blobs()
+
+    def _write(self, eggfile, eggpath):
+        blob = self._store_blob(eggfile)
+        self.digests[eggpath] = path.splitext(path.basename(blob))[0]
+        try:
+            replaced = os.stat(eggpath)
+        except OSError:
+            replaced = None
+        tmp = '%s.%d.tmp' % (eggpath, os.getpid())
+        try:
+            os.link(blob, tmp)
+        except (AttributeError, OSError):
+            copyfile(blob, tmp)
+        _replace(tmp, eggpath)
+        if replaced is not None:
+            st = os.stat(blob)
+            if (replaced.st_dev, replaced.st_ino) != (st.st_dev, st.st_ino):
+                # the blob of the replaced egg may no longer be used
+                self._remove_unused_blobs()
+
+    def _store_blob(self, eggfile):
+        """Store the egg unless there is a blob with the same hash already,
+        and return the path of the blob"""
+        if not path.exists(self.blobdir):
+            makedirs(self.blobdir)
+        try:
+            start = eggfile.tell()
+            sha256 = hashlib.sha256()
+            for chunk in iter(lambda: eggfile.read(self.chunk_size), b''):
+                sha256.update(chunk)
+            blob = self._blobpath(sha256.hexdigest())
+            if path.exists(blob):
+                return blob
+            eggfile.seek(start)
+        except (AttributeError, IOError, OSError):
+            pass  # not seekable, hash it while writing it
+        sha256 = hashlib.sha256()
+        tmp = path.join(self.blobdir, 'upload.%d.tmp' % os.getpid())
+        with open(tmp, 'wb') as f:
+            for chunk in iter(lambda: eggfile.read(self.chunk_size), b''):
+                sha256.update(chunk)
+                f.write(chunk)
+        blob = self._blobpath(sha256.hexdigest())
+        if path.exists(blob):
+            remove(tmp)
+        else:
+            _replace(tmp, blob)
+        return blob
+
+    def _remove_unused_blobs(self):
+        if not path.isdir(self.blobdir):
+            return
+        for name in os.listdir(self.blobdir):
+            blob = path.join(self.blobdir, name)
+            try:
+                if name.endswith('.egg') and os.stat(blob).st_nlink == 1:
+                    remove(blob)
+            except OSError:
+                pass
+
+    def _blobpath(self, sha256):
+        return path.join(self.blobdir, '%s.egg' % sha256)
+
+
+def _replace(src, dst):
+    """Rename src to dst, replacing it atomically where supported"""
+    if hasattr(os, 'replace'):
+        os.replace(src, dst)
+    else:
+        if os.name == 'nt' and path.exists(dst):
+            remove(dst)
+        os.rename(src, dst)
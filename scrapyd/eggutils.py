@@ -1,4 +1,19 @@
-import os, pkg_resources
+import errno
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from glob import glob
+
+import pkg_resources
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
 
 def activate_egg(eggpath):
     """Activate a Scrapy egg file. This is meant to be used from egg runners
@@ -12,3 +27,185 @@ def activate_egg(eggpath):
     d.activate()
     settings_module = d.get_entry_info('scrapy', 'settings').module_name
     os.environ.setdefault('SCRAPY_SETTINGS_MODULE', settings_module)
+
+
+class EggCache(object):
+    """Cache of extracted eggs, shared by the runner processes.
+
+    Every egg is extracted once into a read-only ``<project>/<sha256>.egg``
+    directory, which is created atomically so concurrent runners can't see it
+    half-written. The SHA-256 of an egg file is remembered by its inode, size
+    and modification time, so a warm cache doesn't read the egg at all. When
+    an egg extracted by get() makes the cache grow above `maxsize` bytes, the
+    least recently used eggs are removed, along with their references.
+
+    The eggs returned by get() are in use until this process exits: it holds
+    a shared lock on their directory, and the eviction skips the directories
+    it can't lock exclusively. Without file locks (on Windows), the eggs
+    used in the last `min_age` seconds are not removed instead.
+    """
+
+    min_age = 7 * 24 * 3600
+
+    def __init__(self, basedir, maxsize=None):
+        self.basedir = basedir
+        self.maxsize = maxsize
+        self.locks = {}  # path -> file descriptor holding its shared lock
+
+    def get(self, project, eggfile):
+        """Return the path of the extracted egg read from `eggfile`, locked
+        until this process exits"""
+        projdir = os.path.join(self.basedir, project)
+        if not os.path.exists(projdir):
+            try:
+                os.makedirs(projdir)
+            except OSError:  # created by another runner
+                pass
+        path = os.path.join(projdir, self._digest(projdir, eggfile) + '.egg')
+        extracted = False
+        while not self._lock(path):  # evicted since found, or not extracted
+            extracted = self._extract(projdir, eggfile, path) or extracted
+        os.utime(path, None)  # for the LRU eviction
+        if extracted and self.maxsize:
+            self.evict(keep=path)
+        return path
+
+    def _extract(self, projdir, eggfile, path):
+        """Extract the egg to `path`, and return whether this process did"""
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=projdir)
+        eggfile.seek(0)
+        zipfile.ZipFile(eggfile).extractall(tmpdir)
+        for root, dirs, files in os.walk(tmpdir):
+            for name in files:
+                os.chmod(os.path.join(root, name), 0o444)
+        try:
+            os.rename(tmpdir, path)
+        except OSError:  # extracted by another runner in the meantime
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            return False
+        return True
+
+    def _lock(self, path):
+        """Take a shared lock on the egg directory, and return whether it
+        still exists once locked"""
+        if path in self.locks:
+            return True
+        if fcntl is None:
+            self.locks[path] = None
+            return os.path.isdir(path)
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return False
+        fcntl.flock(fd, fcntl.LOCK_SH)  # waits for a running eviction
+        try:
+            if os.stat(path).st_ino != os.fstat(fd).st_ino:
+                raise OSError(errno.ENOENT, "evicted", path)
+        except OSError:
+            os.close(fd)
+            return False
+        self.locks[path] = fd
+        return True
+
+    def release(self):
+        """Release the eggs returned by get(), which is otherwise done when
+        the process exits"""
+        for fd in self.locks.values():
+            if fd is not None:
+                os.close(fd)
+        self.locks.clear()
+
+    def evict(self, keep=None):
+        """Remove the least recently used eggs not in use, except `keep`,
+        until the cache is no larger than `maxsize`"""
+        entries = []
+        for path in glob(os.path.join(self.basedir, '*', '*.egg')):
+            try:
+                entries.append((os.path.getmtime(path), _dirsize(path), path))
+            except OSError:  # removed by another runner
+                pass
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.maxsize:
+                break
+            if path != keep and path not in self.locks and \
+                    self._remove(path, mtime):
+                total -= size
+
+    def _remove(self, path, mtime):
+        """Remove the egg directory if no process uses it"""
+        if fcntl is None:
+            if time.time() - mtime < self.min_age:
+                return False
+            shutil.rmtree(path, ignore_errors=True)
+            self._remove_refs(path)
+            return True
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:  # removed by another runner
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):  # in use
+            os.close(fd)
+            return False
+        try:
+            shutil.rmtree(path, ignore_errors=True)
+        finally:
+            os.close(fd)
+        self._remove_refs(path)
+        return True
+
+    def _remove_refs(self, path):
+        """Remove the references to the removed egg directory"""
+        projdir, name = os.path.split(path)
+        digest = name[:-len('.egg')]
+        for ref in glob(os.path.join(projdir, '.*.ref')):
+            try:
+                with open(ref) as f:
+                    if f.read() == digest:
+                        os.remove(ref)
+            except (IOError, OSError):  # removed by another runner
+                pass
+
+    def _digest(self, projdir, eggfile):
+        try:
+            st = os.fstat(eggfile.fileno())
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return _sha256(eggfile)
+        ref = os.path.join(projdir, '.%d-%d-%d-%r.ref'
+                           % (st.st_dev, st.st_ino, st.st_size, st.st_mtime))
+        try:
+            with open(ref) as f:
+                return f.read()
+        except IOError:
+            pass
+        digest = _sha256(eggfile)
+        fd, tmp = tempfile.mkstemp(prefix='.tmp-', dir=projdir)
+        with os.fdopen(fd, 'w') as f:
+            f.write(digest)
+        os.rename(tmp, ref)
+        # the file of the other references to this inode was replaced
+        for old in glob(os.path.join(projdir, '.%d-%d-*.ref'
+                                     % (st.st_dev, st.st_ino))):
+            if old != ref:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+        return digest
+
+
+def _sha256(eggfile):
+    h = hashlib.sha256()
+    eggfile.seek(0)
+    for chunk in iter(lambda: eggfile.read(2 ** 16), b''):
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def _dirsize(path):
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, dirs, files in os.walk(path) for name in files)
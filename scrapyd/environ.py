@@ -9,16 +9,16 @@ from .interfaces import IEnvironment
 @implementer(IEnvironment)
 class Environment(object):
 
-    def __init__(self, config, initenv=os.environ):
+    def __init__(self, config, initenv=os.environ, janitor=None):
         self.dbs_dir = config.get('dbs_dir', 'dbs')
         self.logs_dir = config.get('logs_dir', 'logs')
         self.items_dir = config.get('items_dir', '')
-        self.jobs_to_keep = config.getint('jobs_to_keep', 5)
         if config.cp.has_section('settings'):
             self.settings = dict(config.cp.items('settings'))
         else:
             self.settings = {}
         self.initenv = initenv
+        self.janitor = janitor
 
     def get_environment(self, message, slot):
         project = message['_project']
@@ -52,12 +52,10 @@ class Environment(object):
                            url.fragment))
 
     def _get_file(self, message, dir, ext):
-        logsdir = os.path.join(dir, message['_project'], \
-            message['_spider'])
-        if not os.path.exists(logsdir):
-            os.makedirs(logsdir)
-        to_delete = sorted((os.path.join(logsdir, x) for x in \
-            os.listdir(logsdir)), key=os.path.getmtime)[:-self.jobs_to_keep]
-        for x in to_delete:
-            os.remove(x)
-        return os.path.join(logsdir, "%s.%s" % (message['_job'], ext))
+        # the directory is created by the runner, and the old files removed
+        # by the janitor, to spawn the job without touching the disk
+        path = os.path.join(dir, message['_project'], message['_spider'],
+                            "%s.%s" % (message['_job'], ext))
+        if self.janitor is not None:
+            self.janitor.add(path)
+        return path
@@ -54,22 +54,47 @@ class ISpiderQueue(Interface):
 
         This method can return a deferred. """
 
-    def pop():
+    def add_many(messages):
+        """Add several spiders to the queue at once. `messages` is an iterable
+        of (name, priority, spider_args) tuples, where spider_args is a dict.
+
+        This method can return a deferred. """
+
+    def pop(running=None):
         """Pop the next mesasge from the queue. The messages is a dict
         conaining a key 'name' with the spider name and other keys as spider
         attributes.
 
+        `running` is an optional dict mapping spider names to a (running,
+        limit) tuple: the messages of the spiders which have as many running
+        jobs as their '_max_running' argument, or else `limit`, are skipped
+        and left in the queue.
+
+        The message can have a '_scheduled' key with the time, in seconds
+        since the epoch, when it was added to the queue. It is not a spider
+        argument.
+
         This method can return a deferred. """
 
-    def list():
+    def peek_priority(running=None):
+        """Return the priority of the message that pop(running) would return,
+        or None if there is none.
+
+        This method can return a deferred. """
+
+    def list(offset=0, limit=None, spider=None):
         """Return a list with the messages in the queue. Each message is a dict
         which must have a 'name' key (with the spider name), and other optional
         keys that will be used as spider arguments, to create the spider.
 
+        The messages are in the order they would be popped, starting at
+        `offset`, at most `limit` of them, and only those of `spider` if
+        given.
+
         This method can return a deferred. """
 
-    def count():
-        """Return the number of spiders in the queue.
+    def count(spider=None):
+        """Return the number of spiders in the queue, or of the given spider.
 
         This method can return a deferred. """
 
@@ -90,6 +115,10 @@ class ISpiderScheduler(Interface):
     def schedule(project, spider_name, priority, **spider_args):
         """Schedule a spider for the given project"""
 
+    def schedule_many(project, jobs):
+        """Schedule several spiders for the given project at once. `jobs` is
+        an iterable of (spider_name, priority, spider_args) tuples"""
+
     def list_projects():
         """Return the list of available projects"""
 
@@ -98,6 +127,32 @@ class ISpiderScheduler(Interface):
         projects"""
 
 
+class IJobStorage(Interface):
+    """A component storing the history of finished jobs"""
+
+    def add(job):
+        """Add a finished job. `job` is a dict with (at least) the 'project',
+        'spider', 'job', 'start_time' and 'end_time' keys."""
+
+    def list(project=None, spider=None, since=None, until=None, cursor=None,
+             limit=None, offset=None, reverse=False):
+        """Return the finished jobs (as dicts with an 'id' key) matching the
+        given filters, in the order they finished, or the reverse order if
+        `reverse` is true. `since` and `until` are datetimes filtering on the
+        job end time, `cursor` is the 'id' of the last job of the previous
+        page and `limit` the page size. `offset` skips the given number of
+        jobs instead of using a cursor."""
+
+    def count(project=None, spider=None):
+        """Return the number of finished jobs of the project and spider"""
+
+    def __len__():
+        """Return the number of finished jobs"""
+
+    def __iter__():
+        """Iterate over all the finished jobs"""
+
+
 class IEnvironment(Interface):
     """A component to generate the environment of crawler processes"""
 
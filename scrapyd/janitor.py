@@ -0,0 +1,117 @@
+import os
+import time
+
+from twisted.application.service import Service
+from twisted.internet import threads
+from twisted.python import log
+
+from .jobfiles import compress_file
+
+
+class Janitor(Service):
+    """Service removing the old log and item files of the spiders in a
+    thread, so that spawning a job never waits for the disk.
+
+    Each spider directory is listed once, the first time one of its jobs
+    runs, and its files and their modification times are then kept in an
+    index updated as jobs are added. Only the files of the last
+    `jobs_to_keep` jobs are kept, besides those of the jobs added since the
+    last cleanup of the directory.
+
+    The files of the finished jobs are also compressed in the same thread if
+    `compress_files` is set, so a file is never compressed and removed at
+    the same time.
+    """
+
+    def __init__(self, config):
+        self.jobs_to_keep = config.getint('jobs_to_keep', 5)
+        self.compression = config.get('compress_files', '')
+        if self.compression not in ('', 'gzip'):
+            raise ValueError("Unsupported compress_files: %r (use gzip)"
+                             % self.compression)
+        self.index = {}  # directory -> {path: mtime}
+        self.added = {}  # directory -> paths added since its last cleanup
+        self.finished = []  # files of the finished jobs to compress
+        self.cleaning = None  # Deferred of the running cleanup or compression
+
+    def startService(self):
+        Service.startService(self)
+        self._schedule()
+
+    def stopService(self):
+        Service.stopService(self)
+        return self.cleaning
+
+    def add(self, path):
+        """Record the file of a job about to run, and clean its directory"""
+        self.added.setdefault(os.path.dirname(path), []).append(path)
+        self._schedule()
+
+    def compress(self, paths):
+        """Compress the files of a finished job, if compress_files is set"""
+        if self.compression:
+            self.finished.extend(paths)
+            self._schedule()
+
+    def _schedule(self):
+        if self.cleaning is not None or not self.running:
+            return
+        if not self.added:
+            if self.finished:
+                path = self.finished.pop(0)
+                self.cleaning = threads.deferToThread(compress_file, path)
+                self.cleaning.addCallback(self._compressed, path)
+                self.cleaning.addErrback(log.err, "Failed to compress %s" % path)
+                self.cleaning.addBoth(self._next)
+            return
+        dir, added = self.added.popitem()
+        files = self.index.get(dir)
+        if files is not None:
+            files = dict(files)  # the thread doesn't touch the index
+        self.cleaning = threads.deferToThread(self._clean, dir, files, added)
+        self.cleaning.addCallback(self._cleaned, dir)
+        self.cleaning.addErrback(log.err, "Failed to clean %s" % dir)
+        self.cleaning.addBoth(self._next)
+
+    def _clean(self, dir, files, added):
+        """Remove the oldest files of the directory beyond jobs_to_keep,
+        other than the `added` ones, listing it if `files` is None. Return
+        the files left."""
+        if files is None:
+            files = {}
+            try:
+                names = os.listdir(dir)
+            except OSError:
+                names = []
+            for name in names:
+                path = os.path.join(dir, name)
+                try:
+                    files[path] = os.path.getmtime(path)
+                except OSError:
+                    pass
+        for path in added:
+            files.pop(path, None)
+        for path in sorted(files, key=files.get)[:-self.jobs_to_keep]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                if os.path.exists(path):
+                    log.msg("Failed to remove %s: %s" % (path, e))
+                    continue
+            del files[path]
+        now = time.time()
+        for path in added:
+            files[path] = now
+        return files
+
+    def _cleaned(self, files, dir):
+        self.index[dir] = files
+
+    def _compressed(self, gzpath, path):
+        files = self.index.get(os.path.dirname(path), {})
+        if gzpath is not None and path in files:
+            files[gzpath] = files.pop(path)
+
+    def _next(self, _):
+        self.cleaning = None
+        self._schedule()
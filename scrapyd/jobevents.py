@@ -0,0 +1,84 @@
+from collections import deque
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, succeed
+
+SECTIONS = ('pending', 'running', 'finished')
+
+
+class JobEvents(object):
+    """Log of the last changes of the pending, running and finished jobs.
+
+    Every change has a sequence number, and `versions` holds the number of
+    the last change of each section, so the jobs page can tell whether the
+    rows it rendered are still current. Dashboards wait for the changes
+    after the last one they got with wait(), instead of fetching every job
+    again.
+    """
+
+    def __init__(self, maxlen=1000, clock=reactor):
+        self.seq = 0
+        self.events = deque(maxlen=maxlen)
+        self.versions = dict((s, 0) for s in SECTIONS)
+        self.waiting = []
+        self.clock = clock
+
+    def publish(self, section, action, job):
+        """Record that the `job` dict was added to or removed from the
+        section, `action` being 'add' or 'remove'"""
+        self.seq += 1
+        self.versions[section] = self.seq
+        self.events.append({'seq': self.seq, 'section': section,
+                            'action': action, 'job': job})
+        waiting, self.waiting = self.waiting, []
+        for d in waiting:
+            d.callback(self.seq)
+
+    def since(self, seq):
+        """Return the changes after `seq`, or None if some of them are no
+        longer kept"""
+        if seq >= self.seq:
+            return []
+        if not self.events or self.events[0]['seq'] > seq + 1:
+            return None
+        return [e for e in self.events if e['seq'] > seq]
+
+    def wait(self, seq, timeout):
+        """Return a Deferred firing with the changes after `seq`, as soon as
+        there are some, or with an empty list after `timeout` seconds"""
+        events = self.since(seq)
+        if events != []:
+            return succeed(events)
+        d = Deferred(self.waiting.remove)
+        self.waiting.append(d)
+        call = self.clock.callLater(timeout, d.cancel)
+        d.addCallback(lambda _: self.since(seq))
+        d.addErrback(lambda _: [])
+        d.addBoth(_cancel_timeout, call)
+        return d
+
+
+def _cancel_timeout(result, call):
+    if call.active():
+        call.cancel()
+    return result
+
+
+def pending_job(project, message):
+    return {"project": project, "spider": message["name"],
+            "id": message.get("_job")}
+
+
+def running_job(process):
+    return {"project": process.project, "spider": process.spider,
+            "id": process.job, "pid": process.pid,
+            "start_time": str(process.start_time)}
+
+
+def finished_job(job):
+    return {"project": job['project'], "spider": job['spider'],
+            "id": job['job'], "start_time": str(job['start_time']),
+            "end_time": str(job['end_time']),
+            "exit_status": job.get('exit_status'),
+            "startup_time": job.get('startup_time'),
+            "usage": job.get('usage')}
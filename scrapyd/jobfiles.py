@@ -0,0 +1,171 @@
+"""Compression and reading of the log and items files of the jobs.
+
+The files of the finished jobs are compressed to gzip files made of
+independent blocks of at most 64KB of data, each with its compressed size in
+the header, like the BGZF format. Any gzip reader decompresses them, and the
+content at any offset is read by decompressing a single block, so ranges of
+the files are served without reading them from the start.
+"""
+import bisect
+import errno
+import gzip
+import os
+import struct
+import zlib
+
+BLOCK_SIZE = 0xff00  # the compressed blocks must fit in 64KB
+_HEADER = b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+
+
+def compress_file(path, level=6):
+    """Compress the file to `path`.gz, with the modification time of the
+    file, and remove it. Return the path of the compressed file, or None if
+    the file doesn't exist."""
+    gzpath = path + '.gz'
+    tmp = '%s.%d.tmp' % (gzpath, os.getpid())
+    try:
+        src = open(path, 'rb')
+    except (IOError, OSError) as e:
+        if e.errno == errno.ENOENT:
+            return None
+        raise
+    with src:
+        with open(tmp, 'wb') as dst:
+            for data in iter(lambda: src.read(BLOCK_SIZE), b''):
+                dst.write(_compress_block(data, level))
+        st = os.fstat(src.fileno())
+    os.utime(tmp, (st.st_atime, st.st_mtime))
+    os.rename(tmp, gzpath)
+    os.remove(path)
+    return gzpath
+
+
+def _compress_block(data, level):
+    c = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    deflated = c.compress(data) + c.flush()
+    size = len(_HEADER) + 2 + len(deflated) + 8
+    return b''.join([_HEADER, struct.pack('<H', size - 1), deflated,
+                     struct.pack('<II', zlib.crc32(data) & 0xffffffff,
+                                 len(data))])
+
+
+def open_compressed(path):
+    """Return a read-only file object over the decompressed content of the
+    gzip file, with its decompressed `size`. Only the files written by
+    compress_file() are read in blocks, others are decompressed from the
+    start when seeking backwards."""
+    f = open(path, 'rb')
+    try:
+        index = _read_index(f)
+    except Exception:
+        f.close()
+        raise
+    if index is not None:
+        return BlockGzipFile(f, *index)
+    f.close()
+    f = gzip.GzipFile(path, 'rb')
+    f.size = sum(len(x) for x in iter(lambda: f.read(65536), b''))
+    f.seek(0)
+    return f
+
+
+def _read_index(f):
+    """Return the (offset, compressed offset, compressed size) of the
+    non-empty blocks of the file and its decompressed size, reading only the
+    headers and sizes of the blocks, or None if it is not made of blocks"""
+    blocks = []
+    offset = pos = 0
+    while True:
+        f.seek(pos)
+        header = f.read(len(_HEADER) + 2)
+        if not header:
+            return blocks, offset
+        if not header.startswith(_HEADER):
+            return None
+        size = struct.unpack('<H', header[-2:])[0] + 1
+        f.seek(pos + size - 4)
+        trailer = f.read(4)
+        if len(trailer) < 4:
+            raise IOError("Truncated gzip block in %s" % f.name)
+        isize = struct.unpack('<I', trailer)[0]
+        if isize:
+            blocks.append((offset, pos, size))
+        offset += isize
+        pos += size
+
+
+class BlockGzipFile(object):
+    """Seekable file object over the content of a file written by
+    compress_file(), decompressing only the blocks read"""
+
+    def __init__(self, fileobj, blocks, size):
+        self.fileobj = fileobj
+        self.blocks = blocks
+        self.offsets = [b[0] for b in blocks]
+        self.size = size
+        self.pos = 0
+        self._cached = None, b''  # index and content of the last block read
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.size - self.pos
+        chunks = []
+        while size > 0 and self.pos < self.size:
+            i = bisect.bisect_right(self.offsets, self.pos) - 1
+            data = self._block(i)
+            start = self.pos - self.offsets[i]
+            chunk = data[start:start + size]
+            chunks.append(chunk)
+            self.pos += len(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def seek(self, offset, whence=0):
+        base = [0, self.pos, self.size][whence]
+        self.pos = max(0, base + offset)
+        return self.pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _block(self, i):
+        if self._cached[0] != i:
+            _, pos, size = self.blocks[i]
+            self.fileobj.seek(pos + len(_HEADER) + 2)
+            data = self.fileobj.read(size - len(_HEADER) - 2 - 8)
+            self._cached = i, zlib.decompress(data, -zlib.MAX_WBITS)
+        return self._cached[1]
+
+
+def tail_offset(fileobj, size, lines, chunk_size=65536):
+    """Return the offset of the last `lines` lines of the file of `size`
+    bytes, reading it backwards a chunk at a time"""
+    if lines <= 0:
+        return size
+    count = 0
+    pos = size
+    while pos > 0:
+        start = max(0, pos - chunk_size)
+        fileobj.seek(start)
+        data = fileobj.read(pos - start)
+        i = len(data)
+        if pos == size and data.endswith(b'\n'):
+            i -= 1  # the newline ending the last line
+        while True:
+            i = data.rfind(b'\n', 0, i)
+            if i < 0:
+                break
+            count += 1
+            if count == lines:
+                return start + i + 1
+        pos = start
+    return 0
@@ -0,0 +1,166 @@
+from datetime import datetime
+
+from zope.interface import implementer
+
+from .interfaces import IJobStorage
+from .sqlite import (JsonSqliteList, get_connection, get_group_commit,
+                     encode, decode)
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+@implementer(IJobStorage)
+class SqliteJobStorage(object):
+    """Finished jobs history stored in SQLite, with a column per job field
+    and indexes for the filters of listjobs.json.
+
+    If `maxlen` is given, only the last `maxlen` finished jobs are kept, and
+    if `max_age` (a timedelta) is given, only the jobs that finished in that
+    period. The jobs of the `finished_job` table of older versions are copied
+    to the table the first time it is created.
+
+    The number of jobs is counted once, and then kept up to date by add(),
+    so len() doesn't count the whole history: the table is only written by
+    this storage.
+    """
+
+    columns = ['project', 'spider', 'job', 'pid', 'slot', 'priority',
+               'start_time', 'end_time', 'exit_status', 'msg', 'startup_time',
+               'usage']
+
+    # columns added after the table was first released, with their types
+    added_columns = [('startup_time', 'real'), ('usage', 'blob')]
+
+    old_table = 'finished_job'
+
+    def __init__(self, database=None, table='job_history', maxlen=None,
+                 max_age=None, pragmas=None, group_commit=False):
+        self.database = database or ':memory:'
+        self.table = table
+        self.maxlen = maxlen
+        self.max_age = max_age
+        self.conn = get_connection(self.database, pragmas)
+        q = "create table if not exists %s (" \
+            "id integer primary key autoincrement, " \
+            "project text not null, spider text not null, job text not null, " \
+            "pid integer, slot integer, priority real, " \
+            "start_time text, end_time text, exit_status integer, " \
+            "msg blob, startup_time real, usage blob)" % table
+        self.conn.execute(q)
+        self._add_columns()
+        for name, columns in [('project', 'project, id'),
+                              ('project_spider', 'project, spider, id'),
+                              ('spider', 'spider, id'),
+                              ('job', 'job'),
+                              ('end_time', 'end_time')]:
+            q = "create index if not exists %s_%s on %s (%s)" \
+                % (table, name, table, columns)
+            self.conn.execute(q)
+        self.conn.commit()
+        self._copy_old_jobs()
+        q = "select count(*) from %s" % table
+        self.length = self.conn.execute(q).fetchone()[0]
+        if group_commit:
+            self.commit = get_group_commit(self.conn)
+        else:
+            self.commit = self.conn.commit
+
+    def _add_columns(self):
+        """Add the columns missing from a table created by older versions"""
+        q = "pragma table_info(%s)" % self.table
+        existing = set(c[1] for c in self.conn.execute(q))
+        for name, type in self.added_columns:
+            if name not in existing:
+                q = "alter table %s add column %s %s" % (self.table, name, type)
+                self.conn.execute(q)
+
+    def _copy_old_jobs(self):
+        """Copy the jobs of the list of finished jobs of older versions, and
+        drop it"""
+        q = "select name from sqlite_master where type='table' and name=?"
+        if self.table == self.old_table or \
+                self.conn.execute(q, (self.old_table,)).fetchone() is None:
+            return
+        # which converts the keys of the tables of even older versions
+        for job in JsonSqliteList(self.database, self.old_table):
+            self._insert(job)
+        self.conn.execute("drop table %s" % self.old_table)
+        self.conn.commit()
+
+    def add(self, job):
+        c = self._insert(job)
+        self.length += 1
+        if self.maxlen:
+            q = "delete from %s where id<=?" % self.table
+            c = self.conn.execute(q, (c.lastrowid - self.maxlen,))
+            self.length -= c.rowcount
+        if self.max_age:
+            q = "delete from %s where end_time<?" % self.table
+            oldest = datetime.now() - self.max_age
+            c = self.conn.execute(q, (oldest.strftime(TIME_FORMAT),))
+            self.length -= c.rowcount
+        self.commit()
+
+    def _insert(self, job):
+        row = dict(job)
+        row['msg'] = encode(row.get('msg'))
+        if row.get('usage') is not None:
+            row['usage'] = encode(row['usage'])
+        for k in ('start_time', 'end_time'):
+            if row.get(k) is not None:
+                row[k] = row[k].strftime(TIME_FORMAT)
+        q = "insert into %s (%s) values (%s)" % (self.table,
+            ', '.join(self.columns), ', '.join('?' * len(self.columns)))
+        return self.conn.execute(q, [row.get(k) for k in self.columns])
+
+    def list(self, project=None, spider=None, since=None, until=None,
+             cursor=None, limit=None, offset=None, reverse=False):
+        where, args = self._where(project=project, spider=spider, since=since,
+                                  until=until, cursor=cursor, reverse=reverse)
+        q = "select id, %s from %s%s order by id%s" % (
+            ', '.join(self.columns), self.table, where,
+            ' desc' if reverse else '')
+        if limit is not None or offset is not None:
+            q += " limit ? offset ?"
+            args += [-1 if limit is None else limit, offset or 0]
+        return [self._job(row) for row in self.conn.execute(q, args)]
+
+    def count(self, project=None, spider=None):
+        if project is None and spider is None:
+            return self.length
+        where, args = self._where(project=project, spider=spider)
+        q = "select count(*) from %s%s" % (self.table, where)
+        return self.conn.execute(q, args).fetchone()[0]
+
+    def _where(self, project=None, spider=None, since=None, until=None,
+               cursor=None, reverse=False):
+        where, args = [], []
+        for column, op, value in [('project', '=', project),
+                                  ('spider', '=', spider),
+                                  ('end_time', '>=', since),
+                                  ('end_time', '<', until),
+                                  ('id', '<' if reverse else '>', cursor)]:
+            if value is not None:
+                if column == 'end_time':
+                    value = value.strftime(TIME_FORMAT)
+                where.append('%s%s?' % (column, op))
+                args.append(value)
+        if not where:
+            return '', args
+        return " where " + " and ".join(where), args
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.list())
+
+    def _job(self, row):
+        job = dict(zip(['id'] + self.columns, row))
+        job['msg'] = decode(job['msg'])
+        if job['usage'] is not None:
+            job['usage'] = decode(job['usage'])
+        for k in ('start_time', 'end_time'):
+            if job[k] is not None:
+                job[k] = datetime.strptime(job[k], TIME_FORMAT)
+        return job
@@ -1,17 +1,29 @@
 import sys
 import os
-from datetime import datetime
+import json
+import time
+from datetime import datetime, timedelta
 from multiprocessing import cpu_count
 
-from twisted.internet import reactor, defer, protocol, error
+from twisted.internet import reactor, defer, protocol, error, task, threads
 from twisted.application.service import Service
 from twisted.python import log
+from scrapy.utils.misc import load_object
+from six.moves.urllib.parse import urlparse
+from w3lib.url import file_uri_to_path
 
-from scrapyd.utils import get_crawl_args, native_stringify_dict
+from scrapyd.utils import get_crawl_args, get_sqlite_pragmas, native_stringify_dict
 from scrapyd import __version__
 from .interfaces import IPoller, IEnvironment, ISpiderScheduler
 import uuid
-from scrapyd.sqlite import JsonSqliteList, JsonSqliteDict
+from scrapyd.sqlite import JsonSqliteDict, LogStatsSqliteData
+from scrapyd.jobstorage import SqliteJobStorage
+from scrapyd.runnerpool import RunnerPool, STATUS_FD, get_child_fds
+from scrapyd.admission import AdmissionController
+from scrapyd.usage import read_proc_usage, merge_usage
+from scrapyd.logstats import read_log_stats, log_stats_row
+from scrapyd.jobevents import running_job, finished_job
+from scrapyd.metrics import SCHEDULE_DELAY_SECONDS, SPAWN_SECONDS, now
 
 class Launcher(Service):
 
@@ -22,13 +34,45 @@ class Launcher(Service):
         if not os.path.exists(dbdir):
             os.makedirs(dbdir)
         dbpath = os.path.join(dbdir, 'launcher.db')
+        pragmas = get_sqlite_pragmas(config)
+        group_commit = config.getboolean('sqlite_group_commit', False)
         self.processes = {} 
-        self.processes_dict = JsonSqliteDict(database=dbpath, table='processes')
-        self.finished = JsonSqliteList(database=dbpath, table="finished_job")
-        self.finished_to_keep = config.getint('finished_to_keep', 100)
+        self.processes_dict = JsonSqliteDict(database=dbpath, table='processes',
+            pragmas=pragmas, group_commit=group_commit)
+        self.finished_to_keep = config.getint('finished_to_keep', 0)
+        days = config.getfloat('finished_days_to_keep', 90)
+        self.finished = SqliteJobStorage(database=dbpath, table="job_history",
+            maxlen=self.finished_to_keep,
+            max_age=timedelta(days=days) if days else None,
+            pragmas=pragmas, group_commit=group_commit)
+        self.logstats = LogStatsSqliteData(os.path.join(dbdir, 'logstats.db'),
+            pragmas=pragmas, group_commit=group_commit)
         self.max_proc = self._get_max_proc(config)
+        self.min_proc = min(config.getint('min_proc', 0), self.max_proc)
+        self.admission = None
+        if self.min_proc:
+            self.admission = AdmissionController(config, self.min_proc,
+                                                 self.max_proc, self._get_cpus())
+            self.admission_interval = config.getfloat('admission_interval', 5)
+        self.waiting = set()  # slots waiting for a job
+        self.parked = []  # free slots not admitted to run a job
         self.runner = config.get('runner', 'scrapyd.runner')
         self.app = app
+        # running jobs per project and spider, limited by the poller
+        self.limits = getattr(app.getComponent(IPoller), 'limits', None)
+        # changes of the running and finished jobs, for the jobs page
+        self.events = getattr(app.getComponent(IPoller), 'events', None)
+        # compresses the files of the finished jobs
+        self.janitor = getattr(app.getComponent(IEnvironment), 'janitor', None)
+        pool_size = config.getint('runner_pool_size', 0)
+        self.pool = RunnerPool(config, app, pool_size) if pool_size else None
+        # number of jobs and total time from spawn to first request
+        self.startup_times = {'cold': [0, 0.0], 'warm': [0, 0.0]}
+        self.usage_interval = config.getfloat('job_usage_interval', 0)
+        self.output = load_object(config.get('job_output',
+                                             'scrapyd.output.FileOutput'))
+        self.config = config
+        self.busy_time = 0.0  # seconds the finished jobs ran, for /metrics
 
     def startService(self):
 
@@ -36,20 +80,70 @@ class Launcher(Service):
             if slot in self.processes_dict:
                 p = self.processes_dict.pop(slot)
                 msg = p['msg']
+                if self.limits is not None:
+                    self.limits.started(msg['_project'], msg['_spider'])
                 self._spawn_process(msg, slot)
             else:
-                self._wait_for_project(slot)
+                self._slot_free(slot)
+        if self.admission is not None:
+            self.admission_loop = task.LoopingCall(self._admission_sample)
+            self.admission_loop.start(self.admission_interval, now=False)
+        if self.usage_interval:
+            self.usage_loop = task.LoopingCall(self._sample_usage)
+            self.usage_loop.start(self.usage_interval, now=False)
 
         log.msg(format='Scrapyd %(version)s started: max_proc=%(max_proc)r, runner=%(runner)r',
                 version=__version__, max_proc=self.max_proc,
                 runner=self.runner, system='Launcher')
 
+    def stopService(self):
+        Service.stopService(self)
+        if self.admission is not None and self.admission_loop.running:
+            self.admission_loop.stop()
+        if self.usage_interval and self.usage_loop.running:
+            self.usage_loop.stop()
+        if self.pool is not None:
+            return self.pool.stop()
+
+    def _slot_free(self, slot):
+        if self.admission is None or \
+                self.admission.admit(*self._running_weight()):
+            self._wait_for_project(slot)
+        else:
+            self.parked.append(slot)
+
+    def _admission_sample(self):
+        pids = [p.pid for p in self.processes.values() if p.pid]
+        weight = sum(p.weight for p in self.processes.values())
+        self.admission.sample(pids, weight)
+        while self.parked and self.admission.admit(*self._running_weight()):
+            self._wait_for_project(self.parked.pop())
+
+    def _sample_usage(self):
+        for p in self.processes.values():
+            usage = read_proc_usage(p.pid) if p.pid else None
+            if usage is not None:
+                merge_usage(p.usage, usage)
+
+    def _running_weight(self):
+        """Return the number and total weight of the running jobs and of the
+        slots waiting for one, which count with a weight of 1"""
+        count = len(self.processes) + len(self.waiting)
+        weight = sum(p.weight for p in self.processes.values())
+        return count, weight + len(self.waiting)
+
     def _wait_for_project(self, slot):
         poller = self.app.getComponent(IPoller)
+        self.waiting.add(slot)
         poller.next().addCallback(self._spawn_process, slot)
 
     def _spawn_process(self, message, slot):
+        start = now()
+        self.waiting.discard(slot)
         msg = native_stringify_dict(message, keys_only=False)
+        scheduled = msg.pop('_scheduled', None)
+        if scheduled is not None:
+            SCHEDULE_DELAY_SECONDS.observe(max(0, time.time() - float(scheduled)))
         project = msg['_project']
         spider = msg['_spider']
         priority = msg['_priority']
@@ -60,10 +154,20 @@ class Launcher(Service):
         env = native_stringify_dict(env, keys_only=False)
         pp = ScrapyProcessProtocol(slot, project, spider, priority, \
             msg['_job'], env, msg=msg)
+        pp.weight = float(msg.get('_weight', 1))
+        pp.output = self.output(self.config, pp)
         pp.deferred.addBoth(self._process_finished, slot)
-        reactor.spawnProcess(pp, sys.executable, args=args, env=env)
+        if self.pool is not None and self.pool.run(pp, args[3:], env):
+            pp.warm = True
+        else:
+            childFDs = get_child_fds(env)
+            reactor.spawnProcess(pp, sys.executable, args=args, env=env,
+                                 childFDs=childFDs)
         self.processes[slot] = pp 
         self.processes_dict[slot] = self._get_process_dict(pp)
+        if self.events is not None:
+            self.events.publish('running', 'add', running_job(pp))
+        SPAWN_SECONDS.time(start)
 
     def _get_process_dict(self, p):
         return {'project': p.project, 
@@ -82,10 +186,27 @@ class Launcher(Service):
         self.processes_dict.pop(slot)
         process = self.processes.pop(slot)
         process.end_time = datetime.now()
-        process_dict = self._get_process_dict(process)        
-        self.finished.append(process_dict)
-
-        del self.finished[:-self.finished_to_keep] # keep last 100 finished jobs
+        self.busy_time += time.time() - process.spawn_time
+        process_dict = self._get_process_dict(process)
+        process_dict['exit_status'] = process.exit_status
+        process_dict['startup_time'] = process.startup_time
+        if process.output is not None:
+            process.usage.update(process.output.stats())
+        process_dict['usage'] = process.usage or None
+        if process.startup_time is not None:
+            stats = self.startup_times['warm' if process.warm else 'cold']
+            stats[0] += 1
+            stats[1] += process.startup_time
+        self.finished.add(process_dict)
+        if self.events is not None:
+            self.events.publish('running', 'remove', running_job(process))
+            self.events.publish('finished', 'add', finished_job(process_dict))
+        done = [process.output_closed]
+        if process.logfile:
+            done.append(self._add_log_stats(process.logfile, process_dict))
+        if self.janitor is not None:
+            defer.DeferredList(done).addCallback(
+                lambda _: self.janitor.compress(self._job_files(process)))
         msg = process.msg.copy()
         log.msg(format="process finished: %(msg)r", msg=msg)
         count = int(msg.get('count', 0))
@@ -94,18 +215,43 @@ class Launcher(Service):
             msg['count'] = str(count)
             msg['_job'] = uuid.uuid1().hex
             scheduler.schedule(msg.pop('_project'), msg.pop('_spider'), priority=float(msg.pop('_priority')), **msg)
-        self._wait_for_project(slot)
+        if self.limits is not None:
+            self.limits.finished(process.project, process.spider)
+        self._slot_free(slot)
+
+    def _add_log_stats(self, logfile, job):
+        """Read the stats at the end of the job log in a thread, and store
+        them for the logstats page"""
+        d = threads.deferToThread(read_log_stats, logfile)
+        d.addCallback(self._log_stats_read, job)
+        d.addErrback(log.err, "Failed to read the stats of %s" % logfile)
+        return d
+
+    def _log_stats_read(self, stats, job):
+        if stats is not None:
+            self.logstats.insert_logs([log_stats_row(job, stats)])
+
+    def _job_files(self, process):
+        """Return the paths of the log and local items files of the job"""
+        paths = []
+        if process.logfile:
+            paths.append(process.logfile)
+        if process.itemsfile and urlparse(process.itemsfile).scheme == 'file':
+            paths.append(file_uri_to_path(process.itemsfile))
+        return paths
 
     def _get_max_proc(self, config):
         max_proc = config.getint('max_proc', 0)
         if not max_proc:
-            try:
-                cpus = cpu_count()
-            except NotImplementedError:
-                cpus = 1
-            max_proc = cpus * config.getint('max_proc_per_cpu', 4)
+            max_proc = self._get_cpus() * config.getint('max_proc_per_cpu', 4)
         return max_proc
 
+    def _get_cpus(self):
+        try:
+            return cpu_count()
+        except NotImplementedError:
+            return 1
+
 class ScrapyProcessProtocol(protocol.ProcessProtocol):
 
     def __init__(self, slot, project, spider, priority, job, env, msg=None):
@@ -118,15 +264,45 @@ class ScrapyProcessProtocol(protocol.ProcessProtocol):
         self.start_time = datetime.now()
         self.end_time = None
         self.env = env
+        self.exit_status = None
+        self.weight = 1.0
+        self.spawn_time = time.time()
+        self.startup_time = None
+        self.usage = {}
+        self.warm = False
+        self._status = b''
         self.logfile = env.get('SCRAPY_LOG_FILE')
         self.itemsfile = env.get('SCRAPY_FEED_URI')
         self.deferred = defer.Deferred()
         self.msg = msg
+        self.output = None  # sink of stdout and stderr, see scrapyd.output
+        self.output_closed = defer.succeed(None)  # once it wrote everything
+    def childDataReceived(self, childFD, data):
+        if childFD != STATUS_FD:
+            return protocol.ProcessProtocol.childDataReceived(self, childFD, data)
+        lines = (self._status + data).split(b'\n')
+        self._status = lines.pop()
+        for line in lines:
+            try:
+                event = json.loads(line.decode('ascii'))
+            except ValueError:
+                continue
+            if event.get('event') == 'first_request':
+                self.startup_time = event['time'] - self.spawn_time
+            elif event.get('event') == 'usage':
+                merge_usage(self.usage, event['usage'])
+
     def outReceived(self, data):
-        log.msg(data.rstrip(), system="Launcher,%d/stdout" % self.pid)
+        if self.output is not None:
+            self.output.write('stdout', data)
+        else:
+            log.msg(data.rstrip(), system="Launcher,%d/stdout" % self.pid)
 
     def errReceived(self, data):
-        log.msg(data.rstrip(), system="Launcher,%d/stderr" % self.pid)
+        if self.output is not None:
+            self.output.write('stderr', data)
+        else:
+            log.msg(data.rstrip(), system="Launcher,%d/stderr" % self.pid)
 
     def connectionMade(self):
         self.pid = self.transport.pid
@@ -134,9 +310,15 @@ class ScrapyProcessProtocol(protocol.ProcessProtocol):
 
     def processEnded(self, status):
         if isinstance(status.value, error.ProcessDone):
+            self.exit_status = 0
             self.log("Process finished: ")
         else:
+            self.exit_status = status.value.exitCode
+            if self.exit_status is None and status.value.signal:
+                self.exit_status = -status.value.signal
             self.log("Process died: exitstatus=%r " % status.value.exitCode)
+        if self.output is not None:
+            self.output_closed = self.output.close()
         self.deferred.callback(self)
 
     def log(self, action):
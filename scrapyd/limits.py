@@ -0,0 +1,66 @@
+class ConcurrencyLimits(object):
+    """Number of running jobs of each project and spider, and how many of them
+    may run at once. Jobs are counted by the poller when it dispatches them,
+    and by the launcher when they finish.
+
+    The limits come from the ``max_proc_per_project`` and
+    ``max_proc_per_spider`` options (0 for unlimited), overridden per project
+    in the ``[max_proc_per_project]`` section and per spider, as
+    ``project.spider``, in the ``[max_proc_per_spider]`` section. A job can
+    also be scheduled with a ``_max_running`` argument, which overrides the
+    limit of its spider for as long as it is pending.
+    """
+
+    def __init__(self, config):
+        self.project_limit = config.getint('max_proc_per_project', 0)
+        self.spider_limit = config.getint('max_proc_per_spider', 0)
+        # configparser lowercases the option names
+        self.project_limits = dict(
+            (p, int(n)) for p, n in
+            config.items('max_proc_per_project', default=[]))
+        self.spider_limits = dict(
+            (s, int(n)) for s, n in
+            config.items('max_proc_per_spider', default=[]))
+        self.projects = {}
+        self.spiders = {}
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """Call `callback(project)` whenever a job of the project finishes"""
+        self.listeners.append(callback)
+
+    def started(self, project, spider):
+        self.projects[project] = self.projects.get(project, 0) + 1
+        spiders = self.spiders.setdefault(project, {})
+        spiders[spider] = spiders.get(spider, 0) + 1
+
+    def finished(self, project, spider):
+        self.projects[project] -= 1
+        if not self.projects[project]:
+            del self.projects[project]
+        spiders = self.spiders[project]
+        spiders[spider] -= 1
+        if not spiders[spider]:
+            del spiders[spider]
+            if not spiders:
+                del self.spiders[project]
+        for callback in self.listeners:
+            callback(project)
+
+    def project_limit_for(self, project):
+        return self.project_limits.get(project.lower(), self.project_limit)
+
+    def spider_limit_for(self, project, spider):
+        key = ('%s.%s' % (project, spider)).lower()
+        return self.spider_limits.get(key, self.spider_limit)
+
+    def project_full(self, project):
+        """Return whether the project runs as many jobs as it may"""
+        limit = self.project_limit_for(project)
+        return bool(limit) and self.projects.get(project, 0) >= limit
+
+    def running_spiders(self, project):
+        """Return a dict mapping the running spiders of the project to a
+        (running jobs, limit or None) tuple"""
+        return dict((s, (n, self.spider_limit_for(project, s) or None))
+                    for s, n in self.spiders.get(project, {}).items())
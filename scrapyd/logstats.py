@@ -0,0 +1,60 @@
+import io
+import os
+import re
+import time
+
+STATS_MARKER = b'Dumping Scrapy stats:'
+_int_stat = re.compile(r"'([^']+)': (-?\d+),?$")
+_str_stat = re.compile(r"'([^']+)': '([^']*)',?$")
+
+
+def read_log_stats(logfile, tail=65536):
+    """Return the stats Scrapy dumped at the end of the log file, as a dict
+    of their integer and string values, or None if there are none. Only the
+    last `tail` bytes of the file are read."""
+    try:
+        with io.open(logfile, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - tail))
+            data = f.read()
+    except (IOError, OSError):
+        return None
+    pos = data.rfind(STATS_MARKER)
+    if pos < 0:
+        return None
+    stats = {}
+    lines = data[pos + len(STATS_MARKER):].decode('utf-8', 'replace')
+    for line in lines.splitlines()[1:]:
+        line = line.strip()
+        item = line.lstrip('{').rstrip('}')
+        m = _int_stat.match(item) or _str_stat.match(item)
+        if m:
+            key, value = m.groups()
+            stats[key] = int(value) if m.re is _int_stat else value
+        if not line or line.endswith('}'):  # end of the dict
+            break
+    return stats
+
+
+def epoch_millis(dt):
+    """Return the local datetime as milliseconds since the epoch"""
+    return int(time.mktime(dt.timetuple()) * 1000)
+
+
+def log_stats_row(job, stats):
+    """Return the row of LogStatsSqliteData for the finished job, a dict with
+    the keys of the launcher's finished jobs, and its log stats"""
+    log_counts = dict((k.split('/', 1)[1], v) for k, v in stats.items()
+                      if k.startswith('log_count/'))
+    return {
+        'project': job['project'],
+        'spider': job['spider'],
+        'job': job['job'],
+        'create_time': epoch_millis(job['end_time']),
+        'items': stats.get('item_scraped_count', 0),
+        'pages': stats.get('response_received_count', 0),
+        'log_count': sum(log_counts.values()),
+        'errors': log_counts.get('ERROR', 0) + log_counts.get('CRITICAL', 0),
+        'warnings': log_counts.get('WARNING', 0),
+        'finish_reason': stats.get('finish_reason'),
+    }
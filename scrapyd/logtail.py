@@ -0,0 +1,229 @@
+"""Following of the log files of the running jobs, for logtail.json.
+
+There is a single Follower per file, reading what is appended to it once and
+handing it to all the clients following the file. The files are read when
+inotify reports that they changed, where it is available, and polled
+otherwise.
+"""
+import errno
+import os
+
+from twisted.internet import reactor, task
+from twisted.python import filepath, log
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    inotify = None
+
+
+class Follower(object):
+    """Reader of a file being appended to, handing what it reads to its
+    subscribers, which have a write(offset, data) and an end() method.
+    `done` returns whether nothing will be appended to the file anymore.
+    The file is opened once it exists."""
+
+    max_read = 1048576  # the rest is read the next time
+
+    def __init__(self, path, done):
+        self.path = path
+        self.done = done
+        self.file = None
+        self.pos = 0  # of the end of the data read
+        self.subscribers = []
+        if self._open():
+            self.file.seek(0, os.SEEK_END)
+            self.pos = self.file.tell()
+
+    def _open(self):
+        try:
+            self.file = open(self.path, 'rb')
+        except (IOError, OSError) as e:
+            if e.errno != errno.ENOENT:
+                raise
+        return self.file is not None
+
+    def subscribe(self, subscriber, offset, backlog):
+        """Hand the subscriber the lines after `offset` already written, at
+        most the last `backlog` bytes of them, and then what is appended"""
+        self.read()
+        start = min(max(offset, self.pos - backlog), self.pos)
+        if start < self.pos:
+            self.file.seek(start)
+            data = self.file.read(self.pos - start)
+            if start > offset:  # skip the line cut by the backlog limit
+                i = data.find(b'\n') + 1
+                start, data = start + i, data[i:]
+            if data:
+                subscriber.write(start, data)
+        self.subscribers.append(subscriber)
+
+    def read(self):
+        """Hand what was appended since the last read to the subscribers.
+        Return whether there may be more to read."""
+        if self.file is None and not self._open():
+            return False
+        self.file.seek(self.pos)
+        data = self.file.read(self.max_read)
+        if data:
+            offset, self.pos = self.pos, self.pos + len(data)
+            for subscriber in list(self.subscribers):
+                subscriber.write(offset, data)
+        return len(data) == self.max_read
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        subscribers, self.subscribers = self.subscribers, []
+        for subscriber in subscribers:
+            subscriber.end()
+
+
+class LogFollowers(object):
+    """The followers of the files followed by the clients.
+
+    With inotify, a file is read `latency` seconds after a change is
+    reported, reading the changes of that period at once, and polled every
+    `interval` * 5 seconds for the end of the job. Without, it is polled
+    every `interval` seconds.
+    """
+
+    latency = 0.1
+
+    def __init__(self, interval=1.0, clock=reactor, use_inotify=True):
+        self.followers = {}  # path -> Follower
+        self.watched = {}  # path -> bytes path reported by inotify
+        self.interval = interval
+        self.clock = clock
+        self.use_inotify = use_inotify and inotify is not None
+        self.notifier = None
+        self.changed = set()  # paths reported changed by inotify
+        self.delayed = None
+        self.loop = task.LoopingCall(self._poll)
+        self.loop.clock = clock
+
+    def follow(self, path, subscriber, offset, backlog, done):
+        """Hand the subscriber the lines of the file from `offset` and then
+        what is appended, until `done` returns true or unfollow() is
+        called"""
+        follower = self.followers.get(path)
+        if follower is None:
+            follower = self.followers[path] = Follower(path, done)
+            if follower.file is not None:
+                self._watch(path)
+            if not self.loop.running:
+                interval = self.interval * (5 if self.notifier else 1)
+                self.loop.start(interval, now=False)
+        follower.subscribe(subscriber, offset, backlog)
+        return follower
+
+    def unfollow(self, path, subscriber):
+        follower = self.followers.get(path)
+        if follower is not None and subscriber in follower.subscribers:
+            follower.subscribers.remove(subscriber)
+            if not follower.subscribers:
+                self._close(path)
+
+    def stop(self):
+        for path in list(self.followers):
+            self._close(path)
+        if self.delayed is not None:
+            self.delayed.cancel()
+            self.delayed = None
+        if self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+
+    def _watch(self, path):
+        if self.use_inotify and self.notifier is None:
+            try:
+                self.notifier = inotify.INotify()
+                self.notifier.startReading()
+            except Exception:
+                log.err(None, "inotify unavailable, polling the followed logs")
+                self.use_inotify = False
+                self.notifier = None
+        if self.notifier is not None:
+            fp = filepath.FilePath(path)
+            self.notifier.watch(fp, inotify.IN_MODIFY,
+                                callbacks=[self._notified])
+            self.watched[path] = fp.asBytesMode().path
+
+    def _close(self, path):
+        follower = self.followers.pop(path)
+        if path in self.watched:
+            del self.watched[path]
+            try:
+                self.notifier.ignore(filepath.FilePath(path))
+            except KeyError:
+                pass  # removed with the file
+        follower.close()
+        if not self.followers and self.loop.running:
+            self.loop.stop()
+
+    def _notified(self, ignored, fp, mask):
+        self._changed(fp.asBytesMode().path)
+
+    def _changed(self, path):
+        self.changed.add(path)
+        if self.delayed is None:
+            self.delayed = self.clock.callLater(self.latency, self._read_changed)
+
+    def _read_changed(self):
+        self.delayed = None
+        changed, self.changed = self.changed, set()
+        for path, watched in list(self.watched.items()):
+            if watched in changed and self.followers[path].read():
+                self._changed(watched)  # more to read
+
+    def _poll(self):
+        for path, follower in list(self.followers.items()):
+            # checked before reading, so nothing appended after is missed
+            if follower.done():
+                while follower.read():
+                    pass
+                self._close(path)
+            else:
+                follower.read()
+                if follower.file is not None and path not in self.watched:
+                    self._watch(path)  # created since followed
+
+
+class EventStream(object):
+    """Subscriber sending the complete lines of a file to a request as
+    server-sent events, with the offset of the next line as their id. Lines
+    longer than `max_line` are cut."""
+
+    max_line = 1048576
+
+    def __init__(self, request):
+        self.request = request
+        self.partial = b''  # the start of the next line
+        self.pos = 0  # offset of the end of the data written
+
+    def write(self, offset, data):
+        self.pos = offset + len(data)
+        offset -= len(self.partial)
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        events = []
+        for line in lines:
+            offset += len(line) + 1
+            events.append(self._event(offset, line))
+        if len(self.partial) >= self.max_line:
+            offset += len(self.partial)
+            events.append(self._event(offset, self.partial))
+            self.partial = b''
+        if events:
+            self.request.write(b''.join(events))
+
+    def end(self):
+        if self.partial:
+            self.request.write(self._event(self.pos, self.partial))
+        self.request.write(b'event: end\ndata: \n\n')
+        self.request.finish()
+
+    def _event(self, offset, line):
+        line = line.rstrip(b'\r').replace(b'\r', b' ')
+        line = line.decode('utf-8', 'replace').encode('utf-8')
+        return b'id: ' + str(offset).encode('ascii') + b'\ndata: ' + line + b'\n\n'
@@ -0,0 +1,169 @@
+"""Counters, gauges and histograms measured in the hot paths of Scrapyd,
+served in the Prometheus text format by /metrics (scrapyd.webservice.Metrics).
+
+Updating a metric is a dict lookup and an addition, after a bisection of
+the buckets for histograms, so they are always measured.
+"""
+from bisect import bisect_left
+from timeit import default_timer as now  # for durations
+
+_INF = float('inf')
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return the metrics in the Prometheus text format"""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric(object):
+
+    type = 'untyped'
+
+    def __init__(self, name, help, labels=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}  # label values -> value
+        if registry is not None:
+            registry.register(self)
+
+    def samples(self):
+        for labels, value in sorted(self.values.items()):
+            yield '%s%s %s' % (self.name, self._labels(labels),
+                               _format(value))
+
+    def _labels(self, values, extra=()):
+        pairs = list(zip(self.labels, values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join('%s="%s"' % (k, _escape(v))
+                                 for k, v in pairs)
+
+
+class Counter(_Metric):
+
+    type = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def set(self, value, labels=()):
+        """Set the total of a counter computed when the metrics are
+        collected"""
+        self.values[labels] = value
+
+
+class Gauge(_Metric):
+
+    type = 'gauge'
+
+    def set(self, value, labels=()):
+        self.values[labels] = value
+
+
+class Histogram(_Metric):
+    """Histogram of durations in seconds, by default"""
+
+    type = 'histogram'
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                       0.5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, help, labels=(), buckets=None,
+                 registry=REGISTRY):
+        _Metric.__init__(self, name, help, labels, registry)
+        self.buckets = tuple(buckets or self.default_buckets)
+
+    def observe(self, value, labels=()):
+        counts = self.values.get(labels)
+        if counts is None:
+            # one count per bucket and the +Inf one, then the sum
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def time(self, start, labels=()):
+        """Observe the time elapsed since `start`, a value of now()"""
+        self.observe(now() - start, labels)
+
+    def samples(self):
+        for labels, counts in sorted(self.values.items()):
+            total = 0
+            for bound, count in zip(self.buckets + (_INF,), counts):
+                total += count
+                yield '%s_bucket%s %d' % (
+                    self.name, self._labels(labels, [('le', _format(bound))]),
+                    total)
+            yield '%s_sum%s %s' % (self.name, self._labels(labels),
+                                   _format(counts[-1]))
+            yield '%s_count%s %d' % (self.name, self._labels(labels), total)
+
+
+def _format(value):
+    if value == _INF:
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+QUEUE_SECONDS = Histogram(
+    'scrapyd_queue_operation_seconds',
+    'Duration of the put and pop operations on the SQLite job queues.',
+    ['operation'])
+POLL_SECONDS = Histogram(
+    'scrapyd_poll_seconds',
+    'Duration of the polls of the project queues.')
+SCHEDULE_DELAY_SECONDS = Histogram(
+    'scrapyd_schedule_to_spawn_seconds',
+    'Time from the scheduling of the jobs to their spawning.',
+    buckets=(0.01, 0.1, 1, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600,
+             24 * 3600))
+SPAWN_SECONDS = Histogram(
+    'scrapyd_spawn_seconds',
+    'Duration of the spawning of the job processes.')
+SPIDER_LIST_LOOKUPS = Counter(
+    'scrapyd_spider_list_lookups_total',
+    'Lookups of the spider lists of the projects, by result (hit or miss '
+    'of the cache).',
+    ['result'])
+SPIDER_LIST_SECONDS = Histogram(
+    'scrapyd_spider_list_seconds',
+    'Duration of the subprocesses listing the spiders of a project.')
+REQUEST_SECONDS = Histogram(
+    'scrapyd_request_seconds',
+    'Duration of the webservice requests, by endpoint.',
+    ['endpoint'])
+SLOTS = Gauge(
+    'scrapyd_slots',
+    'Process slots, by state: running a job, waiting for one, or parked by '
+    'the admission control.',
+    ['state'])
+MAX_SLOTS = Gauge(
+    'scrapyd_slots_max',
+    'Number of process slots (max_proc).')
+SLOT_BUSY_SECONDS = Counter(
+    'scrapyd_slot_busy_seconds_total',
+    'Total time the slots ran jobs. Its rate divided by scrapyd_slots_max '
+    'is the utilization of the slots.')
@@ -0,0 +1,175 @@
+"""Parsing of the multipart/form-data uploads spooled to disk by Twisted,
+without reading the uploaded files in memory.
+"""
+import re
+from io import BytesIO
+
+from twisted.web import server
+
+_boundary = re.compile(br'boundary="?([^";]+)"?', re.I)
+_disposition = re.compile(br'^content-disposition:(.*)$', re.I | re.M)
+_param = re.compile(br';\s*(name|filename)="([^"]*)"', re.I)
+
+
+class StreamingRequest(server.Request):
+    """Request leaving the form data of the uploads to the resources, which
+    parse it with read_form() instead of having Twisted read the whole body
+    in memory to fill `args`"""
+
+    streaming_paths = (b'/addversion.json',)
+
+    def requestReceived(self, command, path, version):
+        if path.split(b'?', 1)[0].endswith(self.streaming_paths):
+            self._parsePOSTFormSubmission = False
+        return server.Request.requestReceived(self, command, path, version)
+
+
+class FileSlice(object):
+    """Read-only file object over the bytes of `fileobj` from `start` to
+    `end`"""
+
+    def __init__(self, fileobj, start, end):
+        self.fileobj = fileobj
+        self.start = start
+        self.end = end
+        self.pos = start
+
+    def read(self, size=-1):
+        remaining = self.end - self.pos
+        if size is None or size < 0 or size > remaining:
+            size = remaining
+        self.fileobj.seek(self.pos)
+        data = self.fileobj.read(size)
+        self.pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        base = [self.start, self.pos, self.end][whence]
+        self.pos = min(max(self.start, base + offset), self.end)
+        return self.tell()
+
+    def tell(self):
+        return self.pos - self.start
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _Scanner(object):
+    """Buffered reader searching a file for delimiters, keeping at most a
+    chunk in memory"""
+
+    def __init__(self, fileobj, chunk_size):
+        self.fileobj = fileobj
+        self.chunk_size = chunk_size
+        self.buf = b''
+        self.offset = fileobj.tell()  # of the start of the buffer
+
+    def skip_past(self, pattern):
+        """Skip to the end of the next `pattern` and return its offset, or
+        None if there is none"""
+        while True:
+            i = self.buf.find(pattern)
+            if i >= 0:
+                self._consume(i + len(pattern))
+                return self.offset - len(pattern)
+            self._consume(max(0, len(self.buf) - len(pattern) + 1))
+            if not self._fill():
+                return None
+
+    def read_until(self, pattern, limit):
+        """Return the data up to the next `pattern`, skipping it"""
+        while True:
+            i = self.buf.find(pattern)
+            if i >= 0:
+                data = self.buf[:i]
+                self._consume(i + len(pattern))
+                return data
+            if len(self.buf) > limit or not self._fill():
+                raise ValueError("Malformed multipart headers")
+
+    def read(self, size):
+        while len(self.buf) < size and self._fill():
+            pass
+        data = self.buf[:size]
+        self._consume(len(data))
+        return data
+
+    def _fill(self):
+        data = self.fileobj.read(self.chunk_size)
+        self.buf += data
+        return bool(data)
+
+    def _consume(self, size):
+        self.buf = self.buf[size:]
+        self.offset += size
+
+
+def parse_multipart(fileobj, boundary, file_fields=(), max_field_size=65536,
+                    chunk_size=65536):
+    """Parse the multipart/form-data body in the seekable `fileobj`.
+
+    Return a dict of the values of the fields, as lists of bytes like the
+    `args` of Twisted requests, and a dict of FileSlice objects over the
+    fields named in `file_fields`, whose content is not read.
+    """
+    fileobj.seek(0)
+    scanner = _Scanner(fileobj, chunk_size)
+    delimiter = b'\r\n--' + boundary
+    if scanner.skip_past(delimiter[2:]) is None:
+        raise ValueError("Multipart boundary not found")
+    parts = []
+    while True:
+        end = scanner.read(2)
+        if end == b'--':
+            break
+        if end != b'\r\n':
+            raise ValueError("Malformed multipart boundary")
+        headers = scanner.read_until(b'\r\n\r\n', limit=16384)
+        m = _disposition.search(headers)
+        if m is None:
+            raise ValueError("Multipart part without Content-Disposition")
+        params = dict((k.lower(), v) for k, v in _param.findall(m.group(1)))
+        start = scanner.offset
+        stop = scanner.skip_past(delimiter)
+        if stop is None:
+            raise ValueError("Truncated multipart body")
+        parts.append((params.get(b'name'), start, stop))
+    fields, files = {}, {}
+    for name, start, stop in parts:
+        if name in file_fields:
+            files[name] = FileSlice(fileobj, start, stop)
+        elif stop - start > max_field_size:
+            raise ValueError("Multipart field %r too large" % name)
+        else:
+            fileobj.seek(start)
+            fields.setdefault(name, []).append(fileobj.read(stop - start))
+    return fields, files
+
+
+def read_form(txrequest, file_fields):
+    """Return the form fields of the request and its files named in
+    `file_fields`, reading the body if Twisted didn't parse it (see
+    StreamingRequest)"""
+    if any(name in txrequest.args for name in file_fields):
+        # parsed by Twisted
+        args = dict(txrequest.args)
+        files = {}
+        for name in file_fields:
+            if name in args:
+                files[name] = BytesIO(args.pop(name)[0])
+        return args, files
+    ctype = txrequest.requestHeaders.getRawHeaders(b'content-type', [b''])[0]
+    m = _boundary.search(ctype)
+    if not ctype.lower().startswith(b'multipart/form-data') or m is None:
+        return dict(txrequest.args), {}
+    fields, files = parse_multipart(txrequest.content, m.group(1),
+                                    file_fields)
+    fields.update(txrequest.args)  # the query string arguments
+    return fields, files
@@ -0,0 +1,185 @@
+"""Sinks for the stdout and stderr of the job processes, set by the
+``job_output`` option. The launcher creates one for every job and passes it
+all the output of the job, which it may not keep up with: the sinks pause
+reading from the process or drop output rather than block the reactor.
+"""
+import errno
+import os
+
+from twisted.internet import defer, reactor, threads
+from twisted.python import log
+
+
+class LogOutput(object):
+    """Log the output of the job with the messages of Scrapyd, dropping the
+    output beyond `job_output_rate` bytes per second (0 for no limit)"""
+
+    def __init__(self, config, process, clock=reactor):
+        self.process = process
+        self.clock = clock
+        self.rate = config.getint('job_output_rate', 1048576)
+        self.bytes = {'stdout': 0, 'stderr': 0}
+        self.dropped = 0
+        self._unreported = 0  # bytes dropped since the last notice
+        self._allowance = self.rate
+        self._last = clock.seconds()
+
+    def write(self, name, data):
+        """Handle the `data` read from the `name` ('stdout' or 'stderr')
+        stream of the job"""
+        self.bytes[name] += len(data)
+        if not self._allow(len(data)):
+            self.dropped += len(data)
+            self._unreported += len(data)
+            return
+        self._report_dropped()
+        log.msg(data.rstrip(), system="Launcher,%s/%s" % (self.process.pid, name))
+
+    def close(self):
+        """Called when the process ended. Return a Deferred firing once all
+        the output is handled."""
+        self._report_dropped()
+        return defer.succeed(None)
+
+    def stats(self):
+        """Return the number of bytes of output of the job, for its usage"""
+        return {'stdout_bytes': self.bytes['stdout'],
+                'stderr_bytes': self.bytes['stderr'],
+                'dropped_bytes': self.dropped}
+
+    def _allow(self, size):
+        """Token bucket allowing `rate` bytes per second, with bursts of up
+        to a second of output"""
+        if not self.rate:
+            return True
+        now = self.clock.seconds()
+        self._allowance = min(self.rate,
+                              self._allowance + (now - self._last) * self.rate)
+        self._last = now
+        if self._allowance < min(size, self.rate):
+            return False
+        self._allowance -= size
+        return True
+
+    def _report_dropped(self):
+        if self._unreported:
+            log.msg(format="Dropped %(bytes)d bytes of output of job %(job)s, "
+                    "beyond job_output_rate", bytes=self._unreported,
+                    job=self.process.job,
+                    system="Launcher,%s" % self.process.pid)
+            self._unreported = 0
+
+
+class FileOutput(LogOutput):
+    """Append the output of the job to its log file, in a thread.
+
+    The output is buffered and written a line at a time at most, so that it
+    doesn't cut the lines written by Scrapy in the same file. Reading from
+    the process is paused while more than `max_buffer` bytes wait to be
+    written, which holds back the job instead of the reactor.
+
+    Jobs without a log file are handled like LogOutput does.
+    """
+
+    flush_size = 65536
+    flush_delay = 1.0
+    max_buffer = 1048576
+
+    def __init__(self, config, process, clock=reactor):
+        LogOutput.__init__(self, config, process, clock)
+        self.path = process.logfile
+        self.file = None
+        self.buffer = []
+        self.buffered = 0
+        self.writing = None  # Deferred of the write in progress
+        self.written = 0  # bytes handed to the write in progress
+        self.delayed = None
+        self.paused = False
+        self.closed = None  # Deferred fired by close()
+
+    def write(self, name, data):
+        if self.path is None:
+            return LogOutput.write(self, name, data)
+        self.bytes[name] += len(data)
+        self.buffer.append(data)
+        self.buffered += len(data)
+        if self.buffered >= self.flush_size:
+            self._flush()
+        elif self.delayed is None and self.writing is None:
+            self.delayed = self.clock.callLater(self.flush_delay, self._flush)
+        if not self.paused and \
+                self.buffered + self.written >= self.max_buffer:
+            self.paused = True
+            self.process.transport.pauseProducing()
+
+    def close(self):
+        if self.path is None:
+            return LogOutput.close(self)
+        self.closed = defer.Deferred()
+        self._flush()
+        return self.closed
+
+    def _flush(self):
+        if self.delayed is not None:
+            if self.delayed.active():
+                self.delayed.cancel()
+            self.delayed = None
+        if self.writing is not None:
+            return  # flushed again once written
+        data = b''.join(self.buffer)
+        if self.closed is None and len(data) < self.flush_size * 2:
+            # keep the last line until it is complete
+            end = data.rfind(b'\n') + 1
+            data, rest = data[:end], data[end:]
+        else:
+            rest = b''
+        self.buffer = [rest] if rest else []
+        self.buffered = len(rest)
+        if data:
+            self.written = len(data)
+            self.writing = threads.deferToThread(self._write_file, data)
+            self.writing.addErrback(self._write_failed)
+            self.writing.addBoth(self._flushed)
+        elif self.closed is not None:
+            self._close_file()
+        elif rest:
+            self.delayed = self.clock.callLater(self.flush_delay, self._flush)
+
+    def _flushed(self, _):
+        self.writing = None
+        self.written = 0
+        if self.paused and self.buffered < self.max_buffer // 2:
+            self.paused = False
+            self.process.transport.resumeProducing()
+        if self.closed is not None or self.buffered >= self.flush_size:
+            self._flush()
+        elif self.buffer and self.delayed is None:
+            self.delayed = self.clock.callLater(self.flush_delay, self._flush)
+
+    def _write_failed(self, failure):
+        log.err(failure, "Failed to write the output of job %s to %s"
+                % (self.process.job, self.path))
+        # the rest of the output is logged
+        self.dropped += self.written + self.buffered
+        self.buffer = []
+        self.buffered = 0
+        self.path = None
+
+    def _write_file(self, data):
+        if self.file is None:
+            logdir = os.path.dirname(self.path)
+            if logdir and not os.path.isdir(logdir):
+                try:
+                    os.makedirs(logdir)
+                except OSError as e:
+                    if e.errno != errno.EEXIST:  # created by the runner
+                        raise
+            self.file = open(self.path, 'ab')
+        self.file.write(data)
+        self.file.flush()
+
+    def _close_file(self):
+        d = threads.deferToThread(self.file.close) if self.file else \
+            defer.succeed(None)
+        d.addErrback(log.err, "Failed to close %s" % self.path)
+        d.chainDeferred(self.closed)
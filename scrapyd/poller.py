@@ -1,37 +1,310 @@
+import heapq
+import itertools
+import os
+from collections import OrderedDict
+
 from zope.interface import implementer
-from six import iteritems
-from twisted.internet.defer import DeferredQueue, inlineCallbacks, maybeDeferred, returnValue
+from twisted.application.service import Service
+from twisted.internet import reactor
+from twisted.internet.defer import DeferredQueue, inlineCallbacks, maybeDeferred, \
+    returnValue, succeed
+from twisted.python import filepath, log
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    inotify = None
+
+from scrapy.utils.misc import load_object
 
 from .utils import get_spider_queues
 from .interfaces import IPoller
+from .limits import ConcurrencyLimits
+from .jobevents import JobEvents, pending_job
+from .metrics import POLL_SECONDS, now
 
 @implementer(IPoller)
 class QueuePoller(object):
+    """Poller that dispatches the messages of the project queues.
+
+    It keeps an in-memory index of the queues with pending messages, updated
+    on every notify() and pop, so choosing the next message doesn't query
+    every project queue. The order in which the projects are served is
+    decided by the strategy set in the ``poll_strategy`` option.
+
+    The projects and spiders running as many jobs as they may are skipped: their messages are left
+    in the queues until one of their jobs finishes.
+
+    The queues having a version() method are only read by poll() when their
+    version changed, because another process or component wrote them.
+    """
 
     def __init__(self, config):
         self.config = config
+        strategy = config.get('poll_strategy',
+                              'scrapyd.poller.RoundRobinStrategy')
+        self.strategy = load_object(strategy)(config)
+        self.limits = ConcurrencyLimits(config)
+        self.limits.add_listener(self.notify)
+        self.events = JobEvents()
+        self.queues = {}
+        self.versions = {}  # project -> version of its queue when last read
         self.update_projects()
         self.dq = DeferredQueue()
 
     @inlineCallbacks
-    def poll(self):
-        if not self.dq.waiting:
-            return
-        for p, q in iteritems(self.queues):
-            c = yield maybeDeferred(q.count)
-            if c:
-                msg = yield maybeDeferred(q.pop)
-                if msg is not None:  # In case of a concurrently accessed queue
-                    returnValue(self.dq.put(self._message(msg, p)))
+    def poll(self, projects=None):
+        """Resynchronize the index with the queues of the projects, all of
+        them by default, which may have been written by other processes, and
+        fill every waiting slot"""
+        start = now()
+        for p in list(self.queues) if projects is None else projects:
+            if p in self.queues and self._changed(p):
+                yield self._update(p)
+        yield self._dispatch()
+        POLL_SECONDS.time(start)
+
+    def projects_in(self, database):
+        """Return the projects whose queue is stored in the database file of
+        the given name"""
+        return [p for p, q in self.queues.items()
+                if os.path.basename(getattr(q, 'database', None) or '')
+                == database]
+
+    def notify(self, project):
+        """Called when messages have been added to the given project queue"""
+        d = self._update(project)
+        d.addCallback(lambda _: self._dispatch())
+        return d
 
     def next(self):
-        return self.dq.get()
+        d = self.dq.get()
+        self._dispatch()
+        return d
 
     def update_projects(self):
-        self.queues = get_spider_queues(self.config)
+        old, self.queues = self.queues, get_spider_queues(self.config, self.queues)
+        for p in old:
+            if p not in self.queues:
+                self.strategy.remove(p)
+                self.versions.pop(p, None)
+        for p in self.queues:
+            if p not in old:
+                self._update(p)
+
+    @inlineCallbacks
+    def _dispatch(self):
+        while self.dq.waiting:
+            p = self.strategy.select()
+            if p is None:
+                returnValue(None)
+            msg = yield maybeDeferred(self.queues[p].pop,
+                                      *self._running(p))
+            # None if every spider is at its limit, or in case of a
+            # concurrently accessed queue
+            if msg is not None:
+                self.limits.started(p, msg['name'])
+                self.events.publish('pending', 'remove', pending_job(p, msg))
+                self.strategy.dispatched(p)
+                self.dq.put(self._message(msg, p))
+            yield self._update(p)
+
+    def _update(self, project):
+        if self.limits.project_full(project):
+            self.strategy.remove(project)
+            return succeed(None)
+        d = maybeDeferred(self.queues[project].peek_priority,
+                          *self._running(project))
+        d.addCallback(self._set_priority, project)
+        return d
+
+    def _changed(self, project):
+        """Return whether the project queue may have changed since the last
+        call"""
+        version = getattr(self.queues[project], 'version', None)
+        if version is None:
+            return True
+        version = version()
+        changed = self.versions.get(project) != version
+        self.versions[project] = version
+        return changed
+
+    def _running(self, project):
+        """Return the arguments to pop or peek the next message of a spider
+        that is not at its limit"""
+        running = self.limits.running_spiders(project)
+        return (running,) if running else ()
+
+    def _set_priority(self, priority, project):
+        if priority is None:
+            self.strategy.remove(project)
+        else:
+            self.strategy.add(project, priority)
 
     def _message(self, queue_msg, project):
         d = queue_msg.copy()
         d['_project'] = project
         d['_spider'] = d.pop('name')
         return d
+
+
+class QueueWatcher(Service):
+    """Service polling the queues of the projects as soon as inotify reports
+    that their database files in `dbs_dir` were written, `latency` seconds
+    after the first change, so the jobs scheduled by other processes don't
+    wait for the poll_interval timer. Without inotify, it does nothing."""
+
+    latency = 0.05
+    suffixes = ('-wal', '-journal')
+
+    def __init__(self, poller, dbs_dir, clock=reactor):
+        self.poller = poller
+        self.dbs_dir = dbs_dir
+        self.clock = clock
+        self.notifier = None
+        self.changed = set()  # names of the database files written
+        self.delayed = None
+
+    def startService(self):
+        Service.startService(self)
+        if inotify is None:
+            return
+        try:
+            self.notifier = inotify.INotify()
+            self.notifier.startReading()
+            self.notifier.watch(filepath.FilePath(self.dbs_dir),
+                                inotify.IN_MODIFY | inotify.IN_MOVED_TO,
+                                callbacks=[self._notified])
+        except Exception:
+            log.err(None, "inotify unavailable, polling the queues every "
+                    "poll_interval")
+            if self.notifier is not None:
+                self.notifier.loseConnection()
+            self.notifier = None
+
+    def stopService(self):
+        Service.stopService(self)
+        if self.delayed is not None:
+            self.delayed.cancel()
+            self.delayed = None
+        if self.notifier is not None:
+            self.notifier.loseConnection()
+            self.notifier = None
+
+    def _notified(self, ignored, fp, mask):
+        name = fp.asTextMode().basename()
+        for suffix in self.suffixes:
+            if name.endswith(suffix):
+                name = name[:-len(suffix)]
+        self.changed.add(name)
+        if self.delayed is None:
+            self.delayed = self.clock.callLater(self.latency, self._poll)
+
+    def _poll(self):
+        self.delayed = None
+        changed, self.changed = self.changed, set()
+        projects = [p for name in changed for p in self.poller.projects_in(name)]
+        if projects:
+            d = self.poller.poll(projects)
+            d.addErrback(log.err, "Error while polling the changed queues")
+
+
+class RoundRobinStrategy(object):
+    """Take turns between the projects with pending messages"""
+
+    def __init__(self, config):
+        self.projects = OrderedDict()
+
+    def add(self, project, priority):
+        """Mark the project as having pending messages, the next of which has
+        the given priority"""
+        self.projects[project] = priority
+
+    def remove(self, project):
+        """Mark the project as having no pending messages"""
+        self.projects.pop(project, None)
+
+    def select(self):
+        """Return the project to pop the next message from, or None"""
+        return next(iter(self.projects), None)
+
+    def dispatched(self, project):
+        """Called after a message of the project has been dispatched"""
+        if project in self.projects:
+            self.projects[project] = self.projects.pop(project)
+
+
+class _HeapStrategy(object):
+    """Base class for the strategies keeping the projects in a heap, whose
+    stale entries are discarded lazily"""
+
+    def __init__(self, config):
+        self.entries = {}
+        self.heap = []
+        self.counter = itertools.count()
+
+    def remove(self, project):
+        entry = self.entries.pop(project, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def select(self):
+        while self.heap and self.heap[0][-1] is None:
+            heapq.heappop(self.heap)
+        if self.heap:
+            return self.heap[0][-1]
+
+    def _push(self, key, project):
+        entry = [key, next(self.counter), project]
+        self.entries[project] = entry
+        heapq.heappush(self.heap, entry)
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [e for e in self.heap if e[-1] is not None]
+            heapq.heapify(self.heap)
+
+
+class WeightedFairStrategy(_HeapStrategy):
+    """Share the slots between the projects in proportion to the weights given
+    in the ``[project_weights]`` section (1 by default), using stride
+    scheduling. A project that had no pending messages doesn't get credit for
+    the time it was idle.
+    """
+
+    def __init__(self, config):
+        super(WeightedFairStrategy, self).__init__(config)
+        self.weights = dict((p, float(w)) for p, w in
+                            config.items('project_weights', default=[]))
+        self.passes = {}
+        self.vtime = 0.0
+
+    def add(self, project, priority):
+        if project not in self.entries:
+            self.passes[project] = max(self.passes.get(project, 0.0), self.vtime)
+            self._push(self.passes[project], project)
+
+    def dispatched(self, project):
+        self.vtime = self.passes[project]
+        self.passes[project] += 1.0 / self.weights.get(project, 1.0)
+        if project in self.entries:
+            self.remove(project)
+            self._push(self.passes[project], project)
+
+
+class GlobalPriorityStrategy(_HeapStrategy):
+    """Serve the project whose next message has the highest priority, as if
+    all the projects shared a single queue. Projects with equal priorities
+    take turns.
+    """
+
+    def add(self, project, priority):
+        entry = self.entries.get(project)
+        if entry is not None and entry[0] == -priority:
+            return
+        self.remove(project)
+        self._push(-priority, project)
+
+    def dispatched(self, project):
+        entry = self.entries.get(project)
+        if entry is not None:
+            self.remove(project)
+            self._push(entry[0], project)
@@ -1,28 +1,39 @@
 import sys
 import os
+import atexit
+import json
 import shutil
 import tempfile
+import time
 from contextlib import contextmanager
 
 from scrapyd import get_application
+from scrapyd.config import Config
 from scrapyd.interfaces import IEggStorage
-from scrapyd.eggutils import activate_egg
+from scrapyd.eggutils import activate_egg, EggCache
+from scrapyd.usage import get_rusage
 
 @contextmanager
 def project_environment(project):
-    app = get_application()
+    config = Config()
+    app = get_application(config)
     eggstorage = app.getComponent(IEggStorage)
     eggversion = os.environ.get('SCRAPY_EGG_VERSION', None)
     version, eggfile = eggstorage.get(project, eggversion)
-    if eggfile:
+    cachedir = config.get('egg_cache_dir', '')
+    eggpath = None
+    if eggfile and cachedir:
+        maxsize = config.getint('egg_cache_size', 1024) * 1024 * 1024
+        with eggfile:
+            # the egg is locked against eviction until the process exits
+            activate_egg(EggCache(cachedir, maxsize).get(project, eggfile))
+    elif eggfile:
         prefix = '%s-%s-' % (project, version)
         fd, eggpath = tempfile.mkstemp(prefix=prefix, suffix='.egg')
         lf = os.fdopen(fd, 'wb')
         shutil.copyfileobj(eggfile, lf)
         lf.close()
         activate_egg(eggpath)
-    else:
-        eggpath = None
     try:
         assert 'scrapy.conf' not in sys.modules, "Scrapy settings already loaded"
         yield
@@ -30,11 +41,105 @@ def project_environment(project):
         if eggpath:
             os.remove(eggpath)
 
+def make_log_dir():
+    """Create the directory of the log file of the job, which the launcher
+    leaves to the runner to spawn it without touching the disk"""
+    logfile = os.environ.get('SCRAPY_LOG_FILE')
+    logdir = os.path.dirname(logfile or '')
+    if logdir and not os.path.isdir(logdir):
+        try:
+            os.makedirs(logdir)
+        except OSError:
+            if not os.path.isdir(logdir):  # not created by a concurrent job
+                raise
+
+def report_status(event, **data):
+    """Send a status event to the launcher, if it listens to them"""
+    fd = os.environ.get('SCRAPYD_STATUS_FD')
+    if fd:
+        data.update(event=event, time=time.time())
+        line = json.dumps(data) + '\n'
+        try:
+            os.write(int(fd), line.encode('ascii'))
+        except OSError:
+            pass
+
+class StatusReporter(object):
+    """Extension reporting when the first request of the crawl is scheduled"""
+
+    def __init__(self, crawler):
+        from scrapy import signals
+        self.reported = False
+        crawler.signals.connect(self.request_scheduled,
+                                signal=signals.request_scheduled)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def request_scheduled(self, request, spider):
+        if not self.reported:
+            self.reported = True
+            report_status('first_request')
+
+def report_usage(base=None):
+    """Send the resources used by the job to the launcher, which can't get
+    them when it reaps the process"""
+    usage = get_rusage(base)
+    if usage is not None:
+        report_status('usage', usage=usage)
+
+def get_settings():
+    """Return the project settings, with the StatusReporter extension enabled
+    if the launcher listens to status events"""
+    from scrapy.utils.project import get_project_settings
+    settings = get_project_settings()
+    if os.environ.get('SCRAPYD_STATUS_FD'):
+        extensions = settings.getdict('EXTENSIONS')
+        extensions['scrapyd.runner.StatusReporter'] = 0
+        settings.set('EXTENSIONS', extensions, priority='project')
+    return settings
+
+def warm_up():
+    """Import Scrapy and the project spiders before the job to run is known.
+    The settings module is imported again by the job, as it may depend on
+    the job environment."""
+    import scrapy.cmdline, scrapy.crawler
+    module = os.environ.get('SCRAPY_SETTINGS_MODULE')
+    if not module:
+        return
+    try:
+        from scrapy.utils.misc import load_object
+        settings = get_settings()
+        loadercls = settings.get('SPIDER_LOADER_CLASS') or \
+            settings.get('SPIDER_MANAGER_CLASS')
+        load_object(loadercls).from_settings(settings)
+    except Exception:
+        pass  # the job will fail the same way, and report it
+    finally:
+        sys.modules.pop(module, None)
+
 def main():
     project = os.environ['SCRAPY_PROJECT']
     with project_environment(project):
         from scrapy.cmdline import execute
-        execute()
+        argv = sys.argv
+        if argv[1:] == ['warm']:
+            # wait for the launcher to send the job to run
+            warm_up()
+            report_status('ready')
+            line = sys.stdin.readline()
+            if not line:
+                return
+            job = json.loads(line)
+            os.environ.update(job['env'])
+            argv = argv[:1] + job['args']
+            # leave out the resources used while warming up
+            atexit.register(report_usage, get_rusage())
+        else:
+            atexit.register(report_usage)
+        make_log_dir()
+        execute(argv, get_settings())
 
 if __name__ == '__main__':
     main()
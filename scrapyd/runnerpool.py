@@ -0,0 +1,128 @@
+import json
+import os
+import sys
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor, protocol
+from twisted.python import log
+from twisted.python.runtime import platform
+
+from .interfaces import IEggStorage
+
+STATUS_FD = 3
+
+
+def get_child_fds(env):
+    """Return the childFDs to spawn a runner with, and set the environment
+    variable telling it on which one to report its status events"""
+    if platform.isWindows():
+        return None
+    env['SCRAPYD_STATUS_FD'] = str(STATUS_FD)
+    return {0: 'w', 1: 'r', 2: 'r', STATUS_FD: 'r'}
+
+
+class WarmRunner(protocol.ProcessProtocol):
+    """A runner process started ahead of time, which has imported Scrapy and
+    the project and waits on its stdin for the job to run. Once it has been
+    given a job, everything is forwarded to the job process protocol."""
+
+    def __init__(self, pool, key):
+        self.pool = pool
+        self.key = key
+        self.protocol = None
+        self.ended = False
+        self.deferred = defer.Deferred()
+
+    def run(self, pp, args, env):
+        self.protocol = pp
+        pp.makeConnection(self.transport)
+        job = {'args': args, 'env': env}
+        self.transport.write(json.dumps(job).encode('ascii') + b'\n')
+        self.transport.closeStdin()
+
+    def stop(self):
+        if not self.ended:
+            self.transport.closeStdin()
+
+    def childDataReceived(self, childFD, data):
+        if self.protocol is not None:
+            self.protocol.childDataReceived(childFD, data)
+        elif childFD != STATUS_FD:
+            log.msg(data.rstrip(), system="Launcher,%d/warm" % self.transport.pid)
+
+    def processEnded(self, status):
+        self.ended = True
+        if self.protocol is not None:
+            self.protocol.processEnded(status)
+        else:
+            self.pool.discard(self)
+        self.deferred.callback(self)
+
+
+class RunnerPool(object):
+    """Pool of warm runners, keeping one idle runner for each of the last
+    `size` project versions that ran a job"""
+
+    def __init__(self, config, app, size):
+        self.app = app
+        self.size = size
+        self.runner = config.get('runner', 'scrapyd.runner')
+        if config.cp.has_section('settings'):
+            self.settings = dict(config.cp.items('settings'))
+        else:
+            self.settings = {}
+        self.idle = OrderedDict()
+
+    def run(self, pp, args, env):
+        """Run the job in a warm runner if one is available, return whether
+        it was. A warm runner is started for the next job either way."""
+        key = self._key(env['SCRAPY_PROJECT'], env.get('SCRAPY_EGG_VERSION'))
+        runner = self.idle.pop(key, None)
+        self.spawn(key)
+        if runner is None or runner.ended:
+            return False
+        env = dict(env)
+        if key[1] is not None:
+            env['SCRAPY_EGG_VERSION'] = key[1]
+        runner.run(pp, args, env)
+        return True
+
+    def spawn(self, key):
+        if key in self.idle:
+            self.idle[key] = self.idle.pop(key)
+            return
+        while self.idle and len(self.idle) >= self.size:
+            self.idle.popitem(last=False)[1].stop()
+        project, version = key
+        env = os.environ.copy()
+        env['SCRAPY_PROJECT'] = project
+        if version is not None:
+            env['SCRAPY_EGG_VERSION'] = version
+        if project in self.settings:
+            env['SCRAPY_SETTINGS_MODULE'] = self.settings[project]
+        childFDs = get_child_fds(env)
+        runner = WarmRunner(self, key)
+        args = [sys.executable, '-m', self.runner, 'warm']
+        reactor.spawnProcess(runner, sys.executable, args=args, env=env,
+                             childFDs=childFDs)
+        self.idle[key] = runner
+
+    def discard(self, runner):
+        if self.idle.get(runner.key) is runner:
+            del self.idle[runner.key]
+
+    def stop(self):
+        """Stop the idle runners, return a Deferred fired once they exited"""
+        runners = list(self.idle.values())
+        self.idle.clear()
+        for runner in runners:
+            runner.stop()
+        return defer.DeferredList([r.deferred for r in runners])
+
+    def _key(self, project, version):
+        """Return the project and the egg version a job will run, so the
+        latest version is not confused with the one that preceded it"""
+        if version is None:
+            versions = self.app.getComponent(IEggStorage).list(project)
+            version = versions[-1] if versions else None
+        return project, version
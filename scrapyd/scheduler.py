@@ -2,12 +2,16 @@ from zope.interface import implementer
 
 from .interfaces import ISpiderScheduler
 from .utils import get_spider_queues
+from .jobevents import pending_job
 
 @implementer(ISpiderScheduler)
 class SpiderScheduler(object):
 
-    def __init__(self, config):
+    def __init__(self, config, events=None):
         self.config = config
+        self.events = events
+        self.listeners = []
+        self.queues = {}
         self.update_projects()
 
     def schedule(self, project, spider_name, priority=0.0, **spider_args):
@@ -15,9 +19,36 @@ class SpiderScheduler(object):
         # priority passed as kw for compat w/ custom queue. TODO use pos in 1.4
         spider_args['_priority'] = str(priority)
         q.add(spider_name, priority=priority, **spider_args)
+        self._published(project, [(spider_name, spider_args)])
+        self._notify(project)
+
+    def schedule_many(self, project, jobs):
+        q = self.queues[project]
+        messages = []
+        for spider_name, priority, spider_args in jobs:
+            spider_args['_priority'] = str(priority)
+            messages.append((spider_name, priority, spider_args))
+        q.add_many(messages)
+        self._published(project, [(m[0], m[2]) for m in messages])
+        self._notify(project)
+
+    def add_listener(self, listener):
+        """Call listener(project) every time spiders are scheduled"""
+        self.listeners.append(listener)
+
+    def _published(self, project, jobs):
+        if self.events is None:
+            return
+        for spider_name, spider_args in jobs:
+            message = dict(spider_args, name=spider_name)
+            self.events.publish('pending', 'add', pending_job(project, message))
+
+    def _notify(self, project):
+        for listener in self.listeners:
+            listener(project)
 
     def list_projects(self):
         return self.queues.keys()
 
     def update_projects(self):
-        self.queues = get_spider_queues(self.config)
+        self.queues = get_spider_queues(self.config, self.queues)
@@ -1,31 +1,90 @@
+import os
+
 from zope.interface import implementer
 
 from scrapyd.interfaces import ISpiderQueue
-from scrapyd.sqlite import JsonSqlitePriorityQueue
+from scrapyd.sqlite import JsonSqlitePriorityQueue, JsonSqliteSharedPriorityQueue
+from scrapyd.utils import get_sqlite_pragmas
 
 
 @implementer(ISpiderQueue)
 class SqliteSpiderQueue(object):
+    """Spider queue stored in its own SQLite database, one per project"""
+
+    def __init__(self, database=None, table='spider_queue', pragmas=None):
+        self.q = JsonSqlitePriorityQueue(database, table, pragmas)
 
-    def __init__(self, database=None, table='spider_queue'):
-        self.q = JsonSqlitePriorityQueue(database, table)
+    @property
+    def database(self):
+        return self.q.database
+
+    @classmethod
+    def from_config(cls, config, project):
+        dbsdir = config.get('dbs_dir', 'dbs')
+        return cls(os.path.join(dbsdir, '%s.db' % project),
+                   pragmas=get_sqlite_pragmas(config))
 
     def add(self, name, priority=0.0, **spider_args):
+        self.q.put_many([self._item(name, priority, spider_args)])
+
+    def add_many(self, messages):
+        self.q.put_many([self._item(*m) for m in messages])
+
+    def _item(self, name, priority, spider_args):
         d = spider_args.copy()
         d['name'] = name
-        self.q.put(d, priority=priority)
+        max_running = d.get('_max_running')
+        if max_running is not None:
+            max_running = int(max_running)
+        return d, priority, name, max_running
+
+    def pop(self, running=None):
+        popped = self.q.pop(running, with_time=True)
+        if popped is None:
+            return None
+        msg, inserted = popped
+        if inserted is not None:
+            msg['_scheduled'] = inserted
+        return msg
+
+    def peek_priority(self, running=None):
+        return self.q.peek_priority(running)
 
-    def pop(self):
-        return self.q.pop()
+    def count(self, spider=None):
+        return self.q.count(spider)
 
-    def count(self):
-        return len(self.q)
+    def version(self):
+        """Return a value that changes when the queue may have changed"""
+        return self.q.version()
 
-    def list(self):
-        return [x[0] for x in self.q]
+    def list(self, offset=0, limit=None, spider=None):
+        return [x[0] for x in self.q.slice(offset, limit, spider)]
+
+    def iterate(self, spider=None):
+        """Iterate over the messages like list(), reading them a page at a
+        time"""
+        return (x[0] for x in self.q.iterate(spider))
 
     def remove(self, func):
         return self.q.remove(func)
 
     def clear(self):
         self.q.clear()
+
+    def close(self):
+        self.q.close()
+
+
+class SharedSqliteSpiderQueue(SqliteSpiderQueue):
+    """Spider queue stored along with the queues of every other project in a
+    single SQLite database"""
+
+    def __init__(self, database=None, project='', table='spider_queue',
+                 pragmas=None):
+        self.q = JsonSqliteSharedPriorityQueue(database, table, project, pragmas)
+
+    @classmethod
+    def from_config(cls, config, project):
+        dbsdir = config.get('dbs_dir', 'dbs')
+        return cls(os.path.join(dbsdir, 'spider_queue.db'), project,
+                   pragmas=get_sqlite_pragmas(config))
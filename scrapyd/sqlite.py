@@ -1,5 +1,7 @@
+import os
 import sqlite3
 import json
+import time
 try:
     from collections.abc import MutableMapping
 except ImportError:
@@ -9,37 +11,312 @@ import six
 from bson import json_util
 
 from ._deprecate import deprecate_class
+from .metrics import QUEUE_SECONDS, now
+
+# "delete ... returning" lets JsonSqlitePriorityQueue.pop() claim a message
+# with a single statement
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_connections = {}  # path -> [connection, pragmas, number of users]
+_group_commits = {}
+
+JOURNAL_MODES = ('delete', 'truncate', 'persist', 'memory', 'wal', 'off')
+SYNCHRONOUS = ('off', 'normal', 'full', 'extra')
+
+
+def get_connection(database, pragmas=None):
+    """Return a connection to the given database, shared by all its users in
+    this process. In-memory databases are never shared.
+
+    `pragmas` is a dict of PRAGMA statements to run on new connections, as
+    returned by scrapyd.utils.get_sqlite_pragmas(). A ValueError is raised if
+    the database is already open with other values. Call release_connection()
+    once the connection is no longer used.
+    """
+    if database == ':memory:':
+        return _connect(database, pragmas)
+    path = os.path.abspath(database)
+    entry = _connections.get(path)
+    if entry is None:
+        entry = _connections[path] = [_connect(path, pragmas),
+                                      dict(pragmas or {}), 0]
+    else:
+        for name, value in (pragmas or {}).items():
+            if entry[1].get(name) != value:
+                raise ValueError("%s is already open with pragma %s=%r" % (
+                    database, name, entry[1].get(name)))
+    entry[2] += 1
+    return entry[0]
+
+
+def release_connection(conn):
+    """Release a connection returned by get_connection(), closing it once it
+    has no users left"""
+    for path, entry in list(_connections.items()):
+        if entry[0] is conn:
+            entry[2] -= 1
+            if entry[2] > 0:
+                return
+            del _connections[path]
+            break
+    commit = _group_commits.pop(conn, None)
+    if commit is not None:
+        commit.flush()
+    conn.close()
+
+
+def _connect(database, pragmas):
+    # about check_same_thread: http://twistedmatrix.com/trac/ticket/4040
+    conn = sqlite3.connect(database, check_same_thread=False)
+    for name, value in sorted((pragmas or {}).items()):
+        conn.execute("pragma %s=%s" % (name, value)).fetchall()
+    return conn
+
+
+def get_group_commit(conn):
+    """Return the GroupCommit of the given connection"""
+    if conn not in _group_commits:
+        _group_commits[conn] = GroupCommit(conn)
+    return _group_commits[conn]
+
+
+class GroupCommit(object):
+    """Commit the writes made on a connection during the same reactor turn in
+    a single transaction. Call it instead of conn.commit().
+
+    Writes are visible to the users of the same connection right away, but
+    other connections only see them, and they only become durable, once
+    the transaction is committed at the end of the reactor turn.
+    """
+
+    def __init__(self, conn, clock=None):
+        self.conn = conn
+        if clock is None:
+            from twisted.internet import reactor as clock
+            clock.addSystemEventTrigger('before', 'shutdown', self.flush)
+        self.clock = clock
+        self.pending = None
+
+    def __call__(self):
+        if self.pending is None:
+            self.pending = self.clock.callLater(0, self.flush)
+
+    def flush(self):
+        if self.pending is not None and self.pending.active():
+            self.pending.cancel()
+        self.pending = None
+        self.conn.commit()
 
 
 class LogStatsSqliteData(object):
+    """Stats of the finished jobs, as dumped by Scrapy at the end of their
+    logs, indexed by end time, in milliseconds since the epoch, for the
+    charts of the logstats page.
+
+    The stats are also summed in hourly and daily rollup tables, updated as
+    the stats are inserted, so that the charts of long periods don't
+    aggregate every job, see get_stats(). Each period has a rollup per
+    project and spider, one per project, and one for all the jobs, so a
+    chart sums a single row per bucket whatever the number of spiders.
+    """
 
-    def __init__(self, database, table):
-        self.database = database
+    columns = ['project', 'spider', 'job', 'create_time', 'log_count',
+               'items', 'pages', 'errors', 'warnings', 'finish_reason']
+
+    # columns missing from the table created by older versions
+    added_columns = [('project', 'text'), ('job', 'text'),
+                     ('errors', 'integer'), ('warnings', 'integer'),
+                     ('finish_reason', 'text')]
+
+    # rollup tables, from the coarsest, and their bucket in milliseconds
+    rollups = [('daily', 86400000), ('hourly', 3600000)]
+    # suffix of the rollup tables of each level, and the columns they are
+    # summed by, from the finest
+    levels = [('', ('project', 'spider')), ('_projects', ('project',)),
+              ('_total', ())]
+    # stats whose min and max are kept in the rollups, along with their sum
+    measures = ['items', 'pages', 'errors']
+    totals = ['log_count', 'warnings']
+
+    def __init__(self, database=None, table='log_stats', pragmas=None,
+                 group_commit=False):
+        self.database = database or ':memory:'
         self.table = table
-        self.conn = sqlite3.connect(self.database, check_same_thread=False)
-        q = "create table if not exists %s (id integer primary key autoincrement, \
-                                            spider text not null, \
-                                            create_time integer not null, \
-                                            log_count integer not null, \
-                                            items integer not null, \
-                                            pages integer not null \
-                                            ); " % table
-        q += "create index if not exists create_time_index on %s (create_time); " % table
-        q += "create index if not exists spider_index on %s (spider); " % table
-        # q += "create unique index create_time_spider_index on %s (create_time, spider) " %table
-
+        self.conn = get_connection(self.database, pragmas)
+        q = "create table if not exists %s (" \
+            "id integer primary key autoincrement, " \
+            "spider text not null, create_time integer not null, " \
+            "log_count integer not null, items integer not null, " \
+            "pages integer not null, project text, job text, " \
+            "errors integer, warnings integer, finish_reason text)" % table
         self.conn.execute(q)
-        self.insert_log_q = "insert into %s (spider, create_time, log_count, items, pages) \
-                                        values (?, ?, ?, ?, ?); "%table
-
-    def insert_log(self, create_time, spider, log_count, pages, items):
-        self.conn.execute(q, (spider, create_time, log_count, items, pages))
+        q = "pragma table_info(%s)" % table
+        existing = set(c[1] for c in self.conn.execute(q))
+        for name, type in self.added_columns:
+            if name not in existing:
+                q = "alter table %s add column %s %s" % (table, name, type)
+                self.conn.execute(q)
+        for name, columns in [('create_time', 'create_time'),
+                              ('project_time', 'project, create_time'),
+                              ('spider_time', 'spider, create_time')]:
+            q = "create index if not exists %s_%s on %s (%s)" \
+                % (table, name, table, columns)
+            self.conn.execute(q)
+        for name, size in self.rollups:
+            rollup = '%s_%s' % (table, name)
+            source = None
+            for suffix, keys in self.levels:
+                self._create_rollup(rollup + suffix, size, keys, source)
+                source = rollup
         self.conn.commit()
+        if group_commit:
+            self.commit = get_group_commit(self.conn)
+        else:
+            self.commit = self.conn.commit
+
+    def _create_rollup(self, rollup, size, keys, source=None):
+        """Create a rollup table summed by `keys`, filled from the stats
+        already stored, or from the finer `source` rollup"""
+        q = "select 1 from sqlite_master where type='table' and name=?"
+        if self.conn.execute(q, (rollup,)).fetchone():
+            return
+        columns = ['bucket integer not null']
+        columns += ['%s text not null' % k for k in keys]
+        columns += ['jobs integer not null default 0']
+        for m in self.measures:
+            columns += ['%s integer not null default 0' % m,
+                        '%s_min integer' % m, '%s_max integer' % m]
+        columns += ['%s integer not null default 0' % t for t in self.totals]
+        q = "create table %s (%s, primary key (%s)) without rowid" % (
+            rollup, ', '.join(columns), ', '.join(('bucket',) + keys))
+        self.conn.execute(q)
+        for k in keys:
+            q = "create index %s_%s on %s (%s, bucket)" % (rollup, k, rollup,
+                                                          k)
+            self.conn.execute(q)
+        names = ['jobs']
+        for m in self.measures:
+            names += [m, m + '_min', m + '_max']
+        names += self.totals
+        if source is None:
+            groups = ['create_time - create_time %% %d' % size] + \
+                ['ifnull(project, \'\')' if k == 'project' else k
+                 for k in keys]
+            exprs = ['count(*)']
+            for m in self.measures:
+                exprs += ['sum(ifnull(%s, 0))' % m, 'min(ifnull(%s, 0))' % m,
+                          'max(ifnull(%s, 0))' % m]
+            exprs += ['sum(ifnull(%s, 0))' % t for t in self.totals]
+        else:
+            groups = ['bucket'] + list(keys)
+            exprs = ['sum(jobs)']
+            for m in self.measures:
+                exprs += ['sum(%s)' % m, 'min(%s_min)' % m, 'max(%s_max)' % m]
+            exprs += ['sum(%s)' % t for t in self.totals]
+        q = "insert into %s (%s) select %s from %s group by %s" % (
+            rollup, ', '.join(['bucket'] + list(keys) + names),
+            ', '.join(groups + exprs), source or self.table,
+            ', '.join(str(i + 1) for i in range(len(groups))))
+        self.conn.execute(q)
 
-    def get_all_stats(self, st, et):
-        pass
-    def get_stats(self, st, et, spider):
-        pass
+    def insert_log(self, create_time, spider, log_count, pages, items,
+                   **fields):
+        fields.update(create_time=create_time, spider=spider,
+                      log_count=log_count, pages=pages, items=items)
+        self.insert_logs([fields])
+
+    def insert_logs(self, rows):
+        """Insert the stats of several jobs, given as dicts of columns, and
+        add them to the rollups"""
+        rows = list(rows)
+        q = "insert into %s (%s) values (%s)" % (self.table,
+            ', '.join(self.columns), ', '.join('?' * len(self.columns)))
+        self.conn.executemany(q, ([row.get(k) for k in self.columns]
+                                  for row in rows))
+        sets = ['jobs = jobs + 1']
+        for m in self.measures:
+            sets += ['%s = %s + ?' % (m, m),
+                     '%s_min = min(ifnull(%s_min, ?), ?)' % (m, m),
+                     '%s_max = max(ifnull(%s_max, ?), ?)' % (m, m)]
+        sets += ['%s = %s + ?' % (t, t) for t in self.totals]
+        for name, size in self.rollups:
+            for suffix, columns in self.levels:
+                rollup = '%s_%s%s' % (self.table, name, suffix)
+                columns = ('bucket',) + columns
+                keys = [(r['create_time'] - r['create_time'] % size,
+                         r.get('project') or '', r['spider'])[:len(columns)]
+                        for r in rows]
+                q = "insert or ignore into %s (%s) values (%s)" % (
+                    rollup, ', '.join(columns), ', '.join('?' * len(columns)))
+                self.conn.executemany(q, keys)
+                q = "update %s set %s where %s" % (
+                    rollup, ', '.join(sets),
+                    ' and '.join('%s = ?' % c for c in columns))
+                self.conn.executemany(q, (self._rollup_args(r) + list(k)
+                                          for r, k in zip(rows, keys)))
+        self.commit()
+
+    def _rollup_args(self, row):
+        args = []
+        for m in self.measures:
+            args += [row.get(m) or 0] * 5
+        return args + [row.get(t) or 0 for t in self.totals]
+
+    def get_all_stats(self, st, et, points=None):
+        return self.get_stats(st, et, points=points)
+
+    def get_stats(self, st, et, spider=None, project=None, points=None,
+                  use_rollups=True):
+        """Return the stats of the jobs that ended from `st` to `et`,
+        summed over at most `points` intervals of the same length, as a
+        list of dicts whose `time` is the start of the interval. Intervals
+        without jobs are left out.
+
+        The stats are read from the coarsest rollup that still gives at
+        least half the requested points. The range is then widened to whole
+        buckets, and the intervals are a whole number of buckets.
+        """
+        width = max(1, -(-(et - st) // points)) if points else 1
+        table, column, size = self.table, 'create_time', 1
+        names = ['jobs']
+        # the coarsest level that still has the columns filtered on
+        suffix = '' if spider is not None else \
+            '_projects' if project is not None else '_total'
+        for name, rollup_size in self.rollups if use_rollups else []:
+            if rollup_size < 2 * width:
+                table, column, size = '%s_%s%s' % (self.table, name, suffix), \
+                    'bucket', rollup_size
+                break
+        if size == 1:
+            exprs = ['count(*)']
+            for m in self.measures:
+                exprs += ['sum(ifnull(%s, 0))' % m, 'min(ifnull(%s, 0))' % m,
+                          'max(ifnull(%s, 0))' % m]
+        else:
+            st, et = st - st % size, et + (-et % size)
+            width += -width % size
+            exprs = ['sum(jobs)']
+            for m in self.measures:
+                exprs += ['sum(%s)' % m, 'min(%s_min)' % m,
+                          'max(%s_max)' % m]
+        for m in self.measures:
+            names += [m, m + '_min', m + '_max']
+        names += self.totals
+        exprs += ['ifnull(sum(%s), 0)' % t for t in self.totals]
+        where, args = ['%s >= ?' % column, '%s < ?' % column], [st, et]
+        for name, value in [('project', project), ('spider', spider)]:
+            if value is not None:
+                where.append('%s = ?' % name)
+                args.append(value)
+        q = "select (%s - ?) / ? as point, %s from %s where %s " \
+            "group by point order by point" % (
+                column, ', '.join(exprs), table, ' and '.join(where))
+        stats = []
+        for row in self.conn.execute(q, [st, width] + args):
+            point = dict(zip(names, row[1:]))
+            point['time'] = st + row[0] * width
+            stats.append(point)
+        return stats
 
 json_options = json_util.JSONOptions(tz_aware=False,
                                 datetime_representation=json_util.DatetimeRepresentation.ISO8601)
@@ -53,60 +330,104 @@ def decode(obj, json_options=json_options):
 
 
 class JsonSqliteList(object):
-    """SQLite-backed list"""
+    """SQLite-backed list.
+
+    If `maxlen` is given, it behaves as a ring buffer: appending an item drops
+    the items appended more than `maxlen` appends ago, using the integer
+    autoincrement key, so the list never needs to be scanned.
+    """
 
-    def __init__(self, database=None, table="list"):
+    def __init__(self, database=None, table="list", pragmas=None,
+                 group_commit=False, maxlen=None):
         self.database = database or ':memory:'
         self.table = table
-        self.conn = sqlite3.connect(self.database, check_same_thread=False)
-        q = "create table if not exists %s (key blob primary key, value blob)" \
-            % table
+        self.maxlen = maxlen
+        self.conn = get_connection(self.database, pragmas)
+        q = "create table if not exists %s (key integer primary key " \
+            "autoincrement, value blob)" % table
         self.conn.execute(q)
-
-    def __getitem__(self, key):
-        if isinstance(key, slice):
-            q = "select value from %s where key>=? and key<?" % self.table
-            start = self.encode(key.start or 0)
-            stop = self.encode(key.stop or 0)
-            values = self.conn.execute(q, (start, stop)).fetchall()
-            if values:
-                return [self.decode(v[0]) for v in values]
+        self._upgrade_blob_keys()
+        if group_commit:
+            self.commit = get_group_commit(self.conn)
         else:
-            key = self.encode(key)
-            q = "select value from %s where key=?" % self.table
-            value = self.conn.execute(q, (key,)).fetchone()
-            if value:
-                return self.decode(value[0])
-        raise IndexError(key)
+            self.commit = self.conn.commit
+
+    def _upgrade_blob_keys(self):
+        """Convert a table created by older versions, whose keys were encoded
+        list indexes"""
+        columns = self.conn.execute("pragma table_info(%s)" % self.table)
+        if [c[2].lower() for c in columns if c[1] == 'key'] != ['blob']:
+            return
+        old = '%s_blob_keys' % self.table
+        self.conn.execute("alter table %s rename to %s" % (self.table, old))
+        q = "create table %s (key integer primary key autoincrement, " \
+            "value blob)" % self.table
+        self.conn.execute(q)
+        q = "insert into %s (value) select value from %s order by rowid" \
+            % (self.table, old)
+        self.conn.execute(q)
+        self.conn.execute("drop table %s" % old)
+        self.conn.commit()
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            offset, limit = self._slice(index)
+            q = "select value from %s order by key limit ? offset ?" % self.table
+            return [self.decode(v[0]) for v in
+                    self.conn.execute(q, (limit, offset))]
+        q = "select value from %s order by key %s limit 1 offset ?" \
+            % (self.table, 'desc' if index < 0 else 'asc')
+        value = self.conn.execute(q, (self._offset(index),)).fetchone()
+        if value is None:
+            raise IndexError(index)
+        return self.decode(value[0])
 
     def __len__(self):
         q = "select count(*) from %s" % self.table
         return self.conn.execute(q).fetchone()[0]
 
-    def __delitem__(self, key):
-        if isinstance(key, slice):
-            q = "delete from %s where key>=? and key<?" % self.table
-            start = self.encode(key.start or 0)
-            stop = self.encode(key.stop or 0)
-            self.conn.execute(q, (start, stop))
-            self.conn.commit()
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            offset, limit = self._slice(index)
         else:
-            key = self.encode(key)
-            q = "delete from %s where key=?" % self.table
-            self.conn.execute(q, (key,))
-            self.conn.commit()
+            if not -len(self) <= index < len(self):
+                raise IndexError(index)
+            offset, limit = index % len(self), 1
+        q = "delete from %s where key in (select key from %s order by key " \
+            "limit ? offset ?)" % (self.table, self.table)
+        self.conn.execute(q, (limit, offset))
+        self.commit()
 
     def __iter__(self):
-        q = "select value from %s" % self.table
+        q = "select value from %s order by key" % self.table
         return (self.decode(x[0]) for x in self.conn.execute(q))
 
     def append(self, obj):
-        q = "select count(*) from %s" % self.table
-        key = self.conn.execute(q).fetchone()[0]
-        key, value = self.encode(key), self.encode(obj)
-        q = "insert or replace into %s (key, value) values (?,?)" % self.table
-        self.conn.execute(q, (key, value))
-        self.conn.commit()
+        q = "insert into %s (value) values (?)" % self.table
+        c = self.conn.execute(q, (self.encode(obj),))
+        self._trim(c.lastrowid)
+        self.commit()
+
+    def extend(self, objs):
+        q = "insert into %s (value) values (?)" % self.table
+        self.conn.executemany(q, ((self.encode(x),) for x in objs))
+        q = "select max(key) from %s" % self.table
+        self._trim(self.conn.execute(q).fetchone()[0])
+        self.commit()
+
+    def _trim(self, lastkey):
+        if self.maxlen is not None and lastkey is not None:
+            q = "delete from %s where key<=?" % self.table
+            self.conn.execute(q, (lastkey - self.maxlen,))
+
+    def _offset(self, index):
+        return -index - 1 if index < 0 else index
+
+    def _slice(self, index):
+        start, stop, step = index.indices(len(self))
+        if step != 1:
+            raise ValueError("slice steps are not supported")
+        return start, max(stop - start, 0)
 
     def encode(self, obj):
         return encode(obj)
@@ -118,14 +439,18 @@ class JsonSqliteList(object):
 class JsonSqliteDict(MutableMapping):
     """SQLite-backed dictionary"""
 
-    def __init__(self, database=None, table="dict"):
+    def __init__(self, database=None, table="dict", pragmas=None,
+                 group_commit=False):
         self.database = database or ':memory:'
         self.table = table
-        # about check_same_thread: http://twistedmatrix.com/trac/ticket/4040
-        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        self.conn = get_connection(self.database, pragmas)
         q = "create table if not exists %s (key blob primary key, value blob)" \
             % table
         self.conn.execute(q)
+        if group_commit:
+            self.commit = get_group_commit(self.conn)
+        else:
+            self.commit = self.conn.commit
 
     def __getitem__(self, key):
         key = self.encode(key)
@@ -139,13 +464,13 @@ class JsonSqliteDict(MutableMapping):
         key, value = self.encode(key), self.encode(value)
         q = "insert or replace into %s (key, value) values (?,?)" % self.table
         self.conn.execute(q, (key, value))
-        self.conn.commit()
+        self.commit()
 
     def __delitem__(self, key):
         key = self.encode(key)
         q = "delete from %s where key=?" % self.table
         self.conn.execute(q, (key,))
-        self.conn.commit()
+        self.commit()
 
     def __len__(self):
         q = "select count(*) from %s" % self.table
@@ -188,67 +513,341 @@ class JsonSqliteDict(MutableMapping):
 class JsonSqlitePriorityQueue(object):
     """SQLite priority queue. It relies on SQLite concurrency support for
     providing atomic inter-process operations.
+
+    Messages with the same priority are popped in insertion (FIFO) order.
+    Messages can be put with a `key` (the spider name in spider queues) and a
+    `max_running` limit, so pop() and peek_priority() can skip the messages
+    whose key reached its limit of running messages, see _next().
     """
 
-    def __init__(self, database=None, table="queue"):
+    def __init__(self, database=None, table="queue", pragmas=None):
         self.database = database or ':memory:'
         self.table = table
-        # about check_same_thread: http://twistedmatrix.com/trac/ticket/4040
-        self.conn = sqlite3.connect(self.database, check_same_thread=False)
+        self.conn = get_connection(self.database, pragmas)
         q = "create table if not exists %s (id integer primary key, " \
-            "priority real key, message blob)" % table
+            "priority real key, message blob, key text, " \
+            "max_running integer, inserted real)" % table
+        self.conn.execute(q)
+        self._add_columns()
+        # covering index for pop(), so it doesn't scan the whole table
+        q = "create index if not exists %s_priority_id on %s " \
+            "(priority desc, id)" % (table, table)
+        self.conn.execute(q)
+        q = "create index if not exists %s_key_priority_id on %s " \
+            "(key, priority desc, id)" % (table, table)
+        self.conn.execute(q)
+        # for _head(), to skip the messages of the keys at their limit
+        q = "create index if not exists %s_key_max_running_priority_id on " \
+            "%s (key, max_running, priority desc, id)" % (table, table)
         self.conn.execute(q)
-
-    def put(self, message, priority=0.0):
-        args = (priority, self.encode(message))
-        q = "insert into %s (priority, message) values (?,?)" % self.table
-        self.conn.execute(q, args)
         self.conn.commit()
 
-    def pop(self):
-        q = "select id, message from %s order by priority desc limit 1" \
-            % self.table
-        idmsg = self.conn.execute(q).fetchone()
-        if idmsg is None:
+    def _add_columns(self):
+        """Add the columns missing from a table created by older versions,
+        taking the keys from the spider names of the messages"""
+        q = "pragma table_info(%s)" % self.table
+        columns = [c[1] for c in self.conn.execute(q)]
+        if 'inserted' not in columns:
+            q = "alter table %s add column inserted real" % self.table
+            self.conn.execute(q)
+        if 'key' in columns:
             return
-        id, msg = idmsg
-        q = "delete from %s where id=?" % self.table
-        c = self.conn.execute(q, (id,))
-        if not c.rowcount: # record vanished, so let's try again
-            self.conn.rollback()
-            return self.pop()
+        for column in ('key text', 'max_running integer'):
+            q = "alter table %s add column %s" % (self.table, column)
+            self.conn.execute(q)
+        try:
+            q = "update %s set key=json_extract(cast(message as text), " \
+                "'$.name')" % self.table
+            self.conn.execute(q)
+        except sqlite3.OperationalError:  # no JSON support, keys left unset
+            pass
+
+    def put(self, message, priority=0.0, key=None, max_running=None):
+        self.put_many([(message, priority, key, max_running)])
+
+    def put_many(self, messages):
+        """Put several (message, priority) or (message, priority, key,
+        max_running) tuples in a single transaction"""
+        start = now()
+        inserted = time.time()
+        q = "insert into %s (%spriority, message, key, max_running, " \
+            "inserted) values (%s?,?,?,?,?)" % ((self.table,) +
+                                               self._scope_insert())
+        self.conn.executemany(q, (self._row(m) + (inserted,)
+                                  for m in messages))
         self.conn.commit()
-        return self.decode(msg)
+        QUEUE_SECONDS.time(start, ('put',))
+
+    def pop(self, running=None, with_time=False):
+        """Pop the next message, skipping the messages whose key reached its
+        limit, see _next(). With `with_time`, return a (message, time) tuple,
+        `time` being when the message was put, or None for the messages put
+        by older versions."""
+        start = now()
+        try:
+            if _HAS_RETURNING and not running:
+                popped = self._pop_returning(running)
+            else:
+                popped = self._pop_immediate(running)
+        finally:
+            QUEUE_SECONDS.time(start, ('pop',))
+        if popped is not None:
+            msg, inserted = popped
+            return (msg, inserted) if with_time else msg
+
+    def _pop_returning(self, running=None):
+        cte, next_id, args = self._next('id', running)
+        q = "%sdelete from %s where id = (%s) returning message, inserted" \
+            % (cte, self.table, next_id)
+        row = self.conn.execute(q, args).fetchone()
+        self.conn.commit()
+        if row is not None:
+            return self.decode(row[0]), row[1]
+
+    def _pop_immediate(self, running=None):
+        # the reserved lock taken by "begin immediate" keeps other writers
+        # away until the selected row is deleted, so no retry is needed
+        self.conn.execute("begin immediate")
+        try:
+            if running:
+                head = self._head(running)
+                q = "select id, message, inserted from %s where id=?" \
+                    % self.table
+                row = None if head is None else \
+                    self.conn.execute(q, (head[1],)).fetchone()
+            else:
+                cte, q, args = self._next('id, message, inserted', running)
+                row = self.conn.execute(cte + q, args).fetchone()
+            if row is None:
+                return
+            id, msg, inserted = row
+            q = "delete from %s where id=?" % self.table
+            self.conn.execute(q, (id,))
+        finally:
+            self.conn.commit()
+        return self.decode(msg), inserted
+
+    def peek_priority(self, running=None):
+        """Return the priority of the next message, or None if empty"""
+        if running:
+            head = self._head(running)
+            return None if head is None else head[0]
+        cte, q, args = self._next('priority', running)
+        row = self.conn.execute(cte + q, args).fetchone()
+        if row is not None:
+            return row[0]
+
+    def _next(self, columns, running):
+        """Return the common table expression, the query and its arguments
+        selecting `columns` of the next message.
+
+        `running` maps keys to a (running, limit) tuple, where `running` is
+        the number of running messages with that key and `limit` the number
+        allowed, or None. The messages whose key has reached the message's
+        `max_running`, or else the key's limit, are skipped. Once there are
+        running messages, pop() and peek_priority() use _head() instead, as
+        this query reads all the skipped messages.
+        """
+        scope, args = self._scope()
+        where = ["%s=?" % c for c in scope]
+        cte = ""
+        if running:
+            rows = ', '.join(['(?,?,?)'] * len(running))
+            cte = "with running(key, n, lim) as (values %s) " % rows
+            args = [x for k, (n, lim) in running.items() for x in (k, n, lim)] \
+                + list(args)
+            where.append("(running.n is null or running.n < coalesce("
+                         "%s.max_running, running.lim, running.n + 1))"
+                         % self.table)
+        q = "select %s from %s" % (', '.join('%s.%s' % (self.table, c)
+                                            for c in columns.split(', ')),
+                                  self.table)
+        if running:
+            q += " left join running on %s.key = running.key" % self.table
+        if where:
+            q += " where " + " and ".join(where)
+        q += " order by %s.priority desc, %s.id limit 1" % (self.table,
+                                                            self.table)
+        return cte, q, args
+
+    def _head(self, running):
+        """Return the (priority, id) of the next message, like _next(), or
+        None if there is none.
+
+        The messages of a key with the same `max_running` are either all
+        allowed or all skipped, so instead of reading the messages in
+        priority order past those of the keys at their limit, the index is
+        searched once for the first message of every allowed group, and the
+        best of them is returned.
+        """
+        scope, sargs = self._scope()
+        where = ''.join('%s=? and ' % c for c in scope)
+        first = "select priority, id from %s where %s%%s " \
+            "order by priority desc, id limit 1" % (self.table, where)
+        heads = []
+
+        def seek(cond, *args):
+            row = self.conn.execute(first % cond, tuple(sargs) + args).fetchone()
+            if row is not None:
+                heads.append(row)
+
+        def next_value(column, cond, *args):
+            q = "select %s from %s where %s%s order by %s limit 1" \
+                % (column, self.table, where, cond, column)
+            row = self.conn.execute(q, tuple(sargs) + args).fetchone()
+            return row if row is None else row[0]
+
+        seek("key is null")
+        key = next_value('key', "key is not null")
+        while key is not None:
+            if key not in running:
+                seek("key=?", key)
+            else:
+                n, limit = running[key]
+                if limit is None or n < limit:
+                    seek("key=? and max_running is null", key)
+                max_running = next_value('max_running',
+                                         "key=? and max_running>?", key, n)
+                while max_running is not None:
+                    seek("key=? and max_running=?", key, max_running)
+                    max_running = next_value(
+                        'max_running', "key=? and max_running>?", key,
+                        max_running)
+            key = next_value('key', "key>?", key)
+        if heads:
+            return min(heads, key=lambda h: (-h[0], h[1]))
+
+    def _scope(self):
+        """Return the columns and values selecting the rows of this queue"""
+        return (), ()
+
+    def _scope_insert(self):
+        return '', ''
+
+    def _row(self, message):
+        message, priority, key, max_running = tuple(message) + \
+            (None,) * (4 - len(message))
+        return tuple(self._scope()[1]) + (priority, self.encode(message), key, max_running)
+
+    def _where(self, key=None):
+        scope, args = self._scope()
+        if key is not None:
+            scope, args = tuple(scope) + ('key',), tuple(args) + (key,)
+        if not scope:
+            return '', ()
+        return ' where ' + ' and '.join('%s=?' % c for c in scope), args
 
     def remove(self, func):
-        q = "select id, message from %s" % self.table
-        n = 0
-        for id, msg in self.conn.execute(q):
-            if func(self.decode(msg)):
-                q = "delete from %s where id=?" % self.table
-                c = self.conn.execute(q, (id,))
-                if not c.rowcount: # record vanished, so let's try again
-                    self.conn.rollback()
-                    return self.remove(func)
-                n += 1
+        where, args = self._where()
+        q = "select id, message from %s%s" % (self.table, where)
+        ids = [(id,) for id, msg in self.conn.execute(q, args)
+               if func(self.decode(msg))]
+        q = "delete from %s where id=?" % self.table
+        n = self.conn.executemany(q, ids).rowcount
         self.conn.commit()
         return n
 
     def clear(self):
-        self.conn.execute("delete from %s" % self.table)
+        where, args = self._where()
+        self.conn.execute("delete from %s%s" % (self.table, where), args)
         self.conn.commit()
 
+    def close(self):
+        """Release the connection to the database"""
+        release_connection(self.conn)
+
+    def version(self):
+        """Return a value that changes when the database is written, by this
+        connection or any other, in this process or another. It is cheap
+        enough to be checked often."""
+        version = self.conn.execute("pragma data_version").fetchone()[0]
+        return version, self.conn.total_changes
+
+    def count(self, key=None):
+        """Return the number of messages, or of those with the given key"""
+        where, args = self._where(key)
+        q = "select count(*) from %s%s" % (self.table, where)
+        return self.conn.execute(q, args).fetchone()[0]
+
     def __len__(self):
-        q = "select count(*) from %s" % self.table
-        return self.conn.execute(q).fetchone()[0]
+        return self.count()
+
+    def slice(self, offset=0, limit=None, key=None):
+        """Return the (message, priority) pairs in the order they would be
+        popped, starting at `offset`, at most `limit` of them, and only
+        those with the given key if any. Only these messages are decoded."""
+        where, args = self._where(key)
+        q = "select message, priority from %s%s order by priority desc, id " \
+            "limit ? offset ?" % (self.table, where)
+        args = tuple(args) + (-1 if limit is None else limit, offset)
+        return [(self.decode(x), y) for x, y in self.conn.execute(q, args)]
+
+    def iterate(self, key=None, page_size=1000):
+        """Iterate over the (message, priority) pairs in the order they would
+        be popped, only those with the given key if any. They are read
+        `page_size` at a time, after the last one read, so only a page is in
+        memory and no read transaction is kept open between pages."""
+        where, args = self._where(key)
+        q = "select id, message, priority from %s%s%%s order by priority " \
+            "desc, id limit ?" % (self.table, where)
+        sep = ' and ' if where else ' where '
+        # two queries instead of an "or", so both are ranges of the index
+        same = q % (sep + 'priority = ? and id > ?')
+        lower = q % (sep + 'priority < ?')
+        page = self.conn.execute(q % '', tuple(args) + (page_size,)).fetchall()
+        while page:
+            for id, message, priority in page:
+                yield self.decode(message), priority
+            if len(page) < page_size:
+                break
+            id, _, priority = page[-1]
+            page = self.conn.execute(
+                same, tuple(args) + (priority, id, page_size)).fetchall()
+            if len(page) < page_size:
+                page += self.conn.execute(
+                    lower, tuple(args) + (priority, page_size - len(page))
+                ).fetchall()
 
     def __iter__(self):
-        q = "select message, priority from %s order by priority desc" % \
-            self.table
-        return ((self.decode(x), y) for x, y in self.conn.execute(q))
+        return self.iterate()
 
     def encode(self, obj):
         return sqlite3.Binary(json.dumps(obj).encode('ascii'))
 
     def decode(self, text):
         return json.loads(bytes(text).decode('ascii'))
+
+
+class JsonSqliteSharedPriorityQueue(JsonSqlitePriorityQueue):
+    """SQLite priority queue sharing its table with other queues, told apart
+    by the `queue` column. All the queues of a database share a connection.
+    """
+
+    def __init__(self, database=None, table="shared_queue", queue="",
+                 pragmas=None):
+        self.database = database or ':memory:'
+        self.table = table
+        self.queue = queue
+        self.conn = get_connection(self.database, pragmas)
+        q = "create table if not exists %s (id integer primary key, " \
+            "queue text not null, priority real, message blob, key text, " \
+            "max_running integer, inserted real)" % table
+        self.conn.execute(q)
+        self._add_columns()
+        q = "create index if not exists %s_queue_priority_id on %s " \
+            "(queue, priority desc, id)" % (table, table)
+        self.conn.execute(q)
+        q = "create index if not exists %s_queue_key_priority_id on %s " \
+            "(queue, key, priority desc, id)" % (table, table)
+        self.conn.execute(q)
+        q = "create index if not exists %s_queue_key_max_running_priority_id" \
+            " on %s (queue, key, max_running, priority desc, id)" \
+            % (table, table)
+        self.conn.execute(q)
+        self.conn.commit()
+
+    def _scope(self):
+        return ('queue',), (self.queue,)
+
+    def _scope_insert(self):
+        return 'queue, ', '?,'
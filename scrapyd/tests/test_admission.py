@@ -0,0 +1,105 @@
+import os
+
+from twisted.application.service import Application
+from twisted.trial import unittest
+
+from scrapyd.admission import AdmissionController, read_meminfo, read_loadavg
+from scrapyd.config import Config
+from scrapyd.interfaces import IPoller
+from scrapyd.launcher import Launcher
+from scrapyd.poller import QueuePoller
+
+GB = 1024 ** 3
+
+
+class AdmissionControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.controller = AdmissionController(Config(), 2, 16, cpus=4)
+        self.mem = (16 * GB, 8 * GB)
+        self.load = 1.0
+        self.rss = {}
+        self.controller.meminfo = lambda: self.mem
+        self.controller.loadavg = lambda: self.load
+        self.controller.rss = self.rss.get
+
+    def test_admit(self):
+        self.assertEqual(self.controller.capacity, 2)
+        self.assertTrue(self.controller.admit(0, 0))
+        self.assertTrue(self.controller.admit(1, 5))  # below min_proc
+        self.assertFalse(self.controller.admit(2, 2))
+        self.controller.capacity = 4.5
+        self.assertTrue(self.controller.admit(3, 3))
+        self.assertFalse(self.controller.admit(2, 4))
+
+    def test_grow(self):
+        capacities = []
+        for i in range(10):
+            self.controller.sample([], 0)
+            capacities.append(self.controller.capacity)
+        self.assertEqual(capacities[:3], [3, 4, 5])
+        self.assertEqual(capacities[-1], 16)
+
+    def test_shrink_on_load(self):
+        self.controller.capacity = 12
+        self.load = 7.0
+        self.controller.sample([], 8)
+        self.assertEqual(self.controller.capacity, 8 * 0.75)
+        self.controller.sample([], 8)
+        self.assertEqual(self.controller.capacity, 6 * 0.75)
+        for i in range(10):
+            self.controller.sample([], 1)
+        self.assertEqual(self.controller.capacity, 2)
+
+    def test_shrink_on_memory(self):
+        self.controller.capacity = 8
+        self.mem = (16 * GB, 1 * GB)
+        self.controller.sample([], 8)
+        self.assertEqual(self.controller.capacity, 6)
+
+    def test_rss_limit(self):
+        # 4 jobs of weight 1 using 1GB each, 8GB available of which 1.6GB
+        # are kept free: room for 6 more jobs
+        self.rss.update({1: GB, 2: GB, 3: GB, 4: GB})
+        self.controller.capacity = 8
+        self.controller.sample([1, 2, 3, 4, 5], 4)
+        self.assertEqual(self.controller.capacity, 10)
+        self.controller.sample([1, 2, 3, 4], 4)
+        self.assertAlmostEqual(self.controller.capacity, 4 + 6.4)
+
+    def test_proc_files(self):
+        path = self.mktemp()
+        with open(path, 'w') as f:
+            f.write("MemTotal:       16318480 kB\nMemFree:          900000 kB\n"
+                    "MemAvailable:    8159240 kB\n")
+        self.assertEqual(read_meminfo(path), (16318480 * 1024, 8159240 * 1024))
+        with open(path, 'w') as f:
+            f.write("0.52 0.58 0.59 1/1079 12345\n")
+        self.assertEqual(read_loadavg(path), 0.52)
+        self.assertEqual(read_meminfo(path + '.missing'), None)
+
+
+class LauncherAdmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        d = self.mktemp()
+        eggs_dir = os.path.join(d, 'eggs')
+        dbs_dir = os.path.join(d, 'dbs')
+        os.makedirs(eggs_dir)
+        os.makedirs(dbs_dir)
+        config = Config(values={'eggs_dir': eggs_dir, 'dbs_dir': dbs_dir,
+                                'max_proc': '4', 'min_proc': '1'})
+        app = Application("test")
+        app.setComponent(IPoller, QueuePoller(config))
+        self.launcher = Launcher(config, app)
+        self.launcher.admission.meminfo = lambda: None
+        self.launcher.admission.loadavg = lambda: 0.0
+
+    def test_slots(self):
+        for slot in range(4):
+            self.launcher._slot_free(slot)
+        self.assertEqual(self.launcher.waiting, set([0]))
+        self.assertEqual(len(self.launcher.parked), 3)
+        self.launcher._admission_sample()
+        self.assertEqual(len(self.launcher.waiting), 2)
+        self.assertEqual(len(self.launcher.parked), 2)
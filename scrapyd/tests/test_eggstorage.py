@@ -1,3 +1,7 @@
+import hashlib
+import os
+from glob import glob
+
 try:
     from cStringIO import StringIO as BytesIO
 except ImportError:
@@ -9,14 +13,16 @@ from zope.interface.verify import verifyObject
 
 from scrapyd.interfaces import IEggStorage
 from scrapyd.config import Config
-from scrapyd.eggstorage import FilesystemEggStorage
+from scrapyd import eggstorage
+from scrapyd.utils import get_project_list
+from scrapyd.eggstorage import FilesystemEggStorage, ContentAddressedEggStorage
 
 class EggStorageTest(unittest.TestCase):
 
     def setUp(self):
         d = self.mktemp()
-        config = Config(values={'eggs_dir': d})
-        self.eggst = FilesystemEggStorage(config)
+        self.config = Config(values={'eggs_dir': d})
+        self.eggst = FilesystemEggStorage(self.config)
 
     def test_interface(self):
         verifyObject(IEggStorage, self.eggst)
@@ -56,3 +62,109 @@ class EggStorageTest(unittest.TestCase):
 
         self.eggst.delete('mybot')
         self.assertEqual(self.eggst.list('mybot'), [])
+
+    def test_version_index(self):
+        self.eggst.racy_delay = -1  # trust the mtimes set in the same tick
+        for version in ('r9', 'r10', 'r2'):
+            self.eggst.put(BytesIO(b"egg"), 'mybot', version)
+        self.assertEqual(self.eggst.get('mybot')[0], 'r10')
+
+        # other processes read the manifest instead of listing the directory
+        other = FilesystemEggStorage(self.config)
+        other.racy_delay = -1
+        self.patch(eggstorage, 'glob', lambda p: self.fail("listed %s" % p))
+        self.assertEqual(other.list('mybot'), ['r2', 'r9', 'r10'])
+        v, f = other.get('mybot')
+        f.close()
+        self.assertEqual(v, 'r10')
+
+        # and notice the changes made by others from the directory mtime
+        self.eggst.delete('mybot', 'r10')
+        self.assertEqual(self.eggst.list('mybot'), ['r2', 'r9'])
+        self.patch(eggstorage, 'glob', glob)
+        eggdir = os.path.join(self.config.get('eggs_dir'), 'mybot')
+        with open(os.path.join(eggdir, 'r11.egg'), 'wb') as f:
+            f.write(b"egg")
+        os.utime(eggdir, (0, 0))
+        self.assertEqual(other.list('mybot'), ['r2', 'r9', 'r11'])
+
+    def test_racy_mtime(self):
+        self.eggst.put(BytesIO(b"egg"), 'mybot', 'r1')
+        eggdir = os.path.join(self.config.get('eggs_dir'), 'mybot')
+        with open(os.path.join(eggdir, 'r2.egg'), 'wb') as f:
+            f.write(b"egg")
+        # the directory mtime may not have changed, it isn't trusted yet
+        self.assertEqual(self.eggst.list('mybot'), ['r1', 'r2'])
+
+    def test_put_replaces_atomically(self):
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '01')
+        v, f = self.eggst.get('mybot', '01')
+        self.eggst.put(BytesIO(b"egg01b"), 'mybot', '01')
+        # a runner reading the egg keeps the old file
+        self.assertEqual(f.read(), b"egg01")
+        f.close()
+        v, f = self.eggst.get('mybot', '01')
+        self.assertEqual(f.read(), b"egg01b")
+        f.close()
+        eggdir = os.path.join(self.config.get('eggs_dir'), 'mybot')
+        self.assertEqual(os.listdir(eggdir), ['01.egg'])
+
+
+class ContentAddressedEggStorageTest(EggStorageTest):
+
+    def setUp(self):
+        d = self.mktemp()
+        self.config = Config(values={'eggs_dir': d})
+        self.eggst = ContentAddressedEggStorage(self.config)
+
+    def _inode(self, project, version):
+        return os.stat(self.eggst._eggpath(project, version)).st_ino
+
+    def test_dedup(self):
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '01')
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '02')
+        self.eggst.put(BytesIO(b"egg01"), 'otherbot', '01')
+        self.eggst.put(BytesIO(b"egg03"), 'mybot', '03')
+        self.assertEqual(len(os.listdir(self.eggst.blobdir)), 2)
+        self.assertEqual(self._inode('mybot', '01'), self._inode('mybot', '02'))
+        self.assertEqual(self._inode('mybot', '01'),
+                         self._inode('otherbot', '01'))
+        self.assertNotEqual(self._inode('mybot', '01'),
+                            self._inode('mybot', '03'))
+        v, f = self.eggst.get('otherbot')
+        self.assertEqual(f.read(), b"egg01")
+        f.close()
+        # the blobs are not projects
+        self.assertEqual(get_project_list(self.config), ['mybot', 'otherbot'])
+
+    def test_unused_blobs_removed(self):
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '01')
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '02')
+        self.eggst.put(BytesIO(b"egg03"), 'mybot', '03')
+        self.eggst.delete('mybot', '03')
+        self.assertEqual(len(os.listdir(self.eggst.blobdir)), 1)
+        self.eggst.delete('mybot', '01')
+        self.assertEqual(len(os.listdir(self.eggst.blobdir)), 1)
+        self.eggst.delete('mybot')
+        self.assertEqual(os.listdir(self.eggst.blobdir), [])
+
+    def test_replaced_blob_removed(self):
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '01')
+        self.eggst.put(BytesIO(b"egg02"), 'mybot', '01')
+        self.assertEqual(os.listdir(self.eggst.blobdir),
+                         [os.path.basename(self.eggst._blobpath(
+                             hashlib.sha256(b"egg02").hexdigest()))])
+        # the same egg again keeps its blob
+        self.eggst.put(BytesIO(b"egg02"), 'mybot', '01')
+        self.assertEqual(len(os.listdir(self.eggst.blobdir)), 1)
+        v, f = self.eggst.get('mybot')
+        self.assertEqual(f.read(), b"egg02")
+        f.close()
+
+    def test_digest(self):
+        self.eggst.put(BytesIO(b"egg01"), 'mybot', '01')
+        self.assertEqual(self.eggst.digest('mybot', '01'),
+                         hashlib.sha256(b"egg01").hexdigest())
+        self.assertEqual(self.eggst.digest('mybot', '02'), None)
+        self.eggst.delete('mybot', '01')
+        self.assertEqual(self.eggst.digest('mybot', '01'), None)
@@ -0,0 +1,128 @@
+import os
+import shutil
+from io import BytesIO
+from pkgutil import get_data
+
+import pkg_resources
+from twisted.trial import unittest
+
+from scrapyd.eggutils import EggCache, fcntl
+
+
+class EggCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cachedir = self.mktemp()
+        self.cache = EggCache(self.cachedir)
+        self.addCleanup(self.cache.release)
+
+    def eggfile(self, name='mybot.egg'):
+        path = os.path.abspath(self.mktemp())
+        with open(path, 'wb') as f:
+            f.write(get_data('scrapyd.tests', name))
+        return open(path, 'rb')
+
+    def test_extract(self):
+        with self.eggfile() as eggfile:
+            path = self.cache.get('mybot', eggfile)
+        self.assertEqual(os.path.dirname(path),
+                         os.path.join(self.cachedir, 'mybot'))
+        dist = next(pkg_resources.find_distributions(path))
+        self.assertEqual(dist.get_entry_info('scrapy', 'settings').module_name,
+                         'mybot.settings')
+        settings = os.path.join(path, 'mybot', 'settings.py')
+        self.assertEqual(os.stat(settings).st_mode & 0o777, 0o444)
+
+    def test_reuse(self):
+        with self.eggfile() as eggfile:
+            path = self.cache.get('mybot', eggfile)
+        self.cache.maxsize = 1
+        self.cache.evict = lambda *a, **kw: self.fail("cache evicted")
+        with open(eggfile.name, 'rb') as eggfile:
+            # the egg is neither read nor extracted again
+            eggfile.read = eggfile.seek = lambda *a: self.fail("egg read")
+            self.assertEqual(self.cache.get('mybot', eggfile), path)
+
+    def test_replaced(self):
+        with self.eggfile() as eggfile:
+            path1 = self.cache.get('mybot', eggfile)
+        # rewritten in place, so with the same inode
+        with open(eggfile.name, 'r+b') as f:
+            f.write(get_data('scrapyd.tests', 'mybot2.egg'))
+            f.truncate()
+        with open(eggfile.name, 'rb') as eggfile:
+            path2 = self.cache.get('mybot', eggfile)
+        self.assertNotEqual(path1, path2)
+        self.assertEqual(len(self.refs('mybot')), 1)
+
+    def test_same_content(self):
+        with self.eggfile() as eggfile:
+            path = self.cache.get('mybot', eggfile)
+        eggfile = BytesIO(get_data('scrapyd.tests', 'mybot.egg'))
+        self.assertEqual(self.cache.get('mybot', eggfile), path)
+        eggfile = BytesIO(get_data('scrapyd.tests', 'mybot2.egg'))
+        self.assertNotEqual(self.cache.get('mybot', eggfile), path)
+
+    def refs(self, project):
+        projdir = os.path.join(self.cachedir, project)
+        return [x for x in os.listdir(projdir) if x.endswith('.ref')]
+
+    def test_evict(self):
+        with self.eggfile() as eggfile:
+            path1 = self.cache.get('mybot', eggfile)
+        with self.eggfile('mybot2.egg') as eggfile:
+            path2 = self.cache.get('mybot', eggfile)
+        self.cache.release()  # the runner exited
+        os.utime(path1, (0, 0))
+        self.cache.maxsize = 1
+        with self.eggfile('mybotunicode.egg') as eggfile:
+            path3 = self.cache.get('mybotunicode', eggfile)
+        self.assertFalse(os.path.exists(path1))
+        self.assertFalse(os.path.exists(path2))
+        self.assertTrue(os.path.exists(path3))
+        self.assertEqual(self.refs('mybot'), [])
+        self.assertEqual(len(self.refs('mybotunicode')), 1)
+
+    def test_evict_in_use(self):
+        if fcntl is None:
+            raise unittest.SkipTest("no file locks")
+        running = EggCache(self.cachedir)
+        self.addCleanup(running.release)
+        with self.eggfile() as eggfile:
+            path1 = running.get('mybot', eggfile)
+        with self.eggfile('mybot2.egg') as eggfile:
+            path2 = self.cache.get('mybot', eggfile)
+        self.cache.release()
+        os.utime(path1, (0, 0))
+        cache = EggCache(self.cachedir, maxsize=1)
+        self.addCleanup(cache.release)
+        with self.eggfile('mybotunicode.egg') as eggfile:
+            path3 = cache.get('mybotunicode', eggfile)
+        self.assertTrue(os.path.exists(os.path.join(path1, 'mybot',
+                                                    'settings.py')))
+        self.assertFalse(os.path.exists(path2))
+        self.assertTrue(os.path.exists(path3))
+
+        running.release()
+        cache.evict(keep=path3)
+        self.assertFalse(os.path.exists(path1))
+
+    def test_evicted_while_found(self):
+        with self.eggfile() as eggfile:
+            path = self.cache.get('mybot', eggfile)
+        self.cache.release()
+        other = EggCache(self.cachedir)
+        self.addCleanup(other.release)
+        # evicted between the lookup and the lock, extracted again
+        lock = other._lock
+        evicted = []
+        def evict_then_lock(path):
+            if not evicted:
+                evicted.append(path)
+                shutil.rmtree(path)
+            return lock(path)
+        other._lock = evict_then_lock
+        with self.eggfile() as eggfile:
+            self.assertEqual(other.get('mybot', eggfile), path)
+        self.assertTrue(os.path.exists(os.path.join(path, 'mybot',
+                                                    'settings.py')))
@@ -45,3 +45,14 @@ class EnvironmentTest(unittest.TestCase):
         env = environ.get_environment(msg, slot)
         self.failUnless('SCRAPY_FEED_URI' not in env)
         self.failUnless('SCRAPY_LOG_FILE' not in env)
+
+    def test_get_environment_with_janitor(self):
+        added = []
+        class Janitor(object):
+            add = staticmethod(added.append)
+        self.environ.janitor = Janitor()
+        msg = {'_project': 'mybot', '_spider': 'myspider', '_job': 'ID'}
+        env = self.environ.get_environment(msg, 3)
+        self.assertEqual(added, [env['SCRAPY_LOG_FILE']])
+        # the directory is created by the runner
+        self.failIf(os.path.exists(os.path.dirname(env['SCRAPY_LOG_FILE'])))
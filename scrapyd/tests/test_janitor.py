@@ -0,0 +1,87 @@
+import os
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from scrapyd.config import Config
+from scrapyd.janitor import Janitor
+
+
+class JanitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = os.path.join(self.mktemp(), 'mybot', 'myspider')
+        os.makedirs(self.dir)
+        for i in range(7):
+            self._touch('old%d.log' % i, 1000 + i)
+        self.janitor = Janitor(Config(values={'jobs_to_keep': '5'}))
+        self.janitor.startService()
+        self.addCleanup(self.janitor.stopService)
+
+    def _touch(self, name, mtime):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w'):
+            pass
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def _files(self):
+        return sorted(os.listdir(self.dir))
+
+    @defer.inlineCallbacks
+    def test_clean(self):
+        self.janitor.add(os.path.join(self.dir, 'job1.log'))
+        yield self.janitor.cleaning
+        self.assertEqual(self._files(), ['old%d.log' % i for i in range(2, 7)])
+
+        # the directory isn't listed again, files created by others are not
+        # in the index
+        self._touch('job1.log', 2000)
+        self._touch('other.log', 0)
+        self.janitor.add(os.path.join(self.dir, 'job2.log'))
+        yield self.janitor.cleaning
+        self.assertEqual(self._files(), ['job1.log'] +
+                         ['old%d.log' % i for i in range(3, 7)] +
+                         ['other.log'])
+        self.assertEqual(sorted(self.janitor.index[self.dir]),
+                         [os.path.join(self.dir, x) for x in
+                          ['job1.log', 'job2.log'] +
+                          ['old%d.log' % i for i in range(3, 7)]])
+
+    @defer.inlineCallbacks
+    def test_added_while_cleaning(self):
+        for i in range(4):
+            self.janitor.add(os.path.join(self.dir, 'job%d.log' % i))
+        while self.janitor.cleaning is not None:
+            yield self.janitor.cleaning
+        self.assertEqual(self._files(), ['old%d.log' % i for i in range(3, 7)])
+        self.assertEqual(len(self.janitor.index[self.dir]), 8)
+
+    def test_not_running(self):
+        self.janitor.stopService()
+        self.janitor.add(os.path.join(self.dir, 'job1.log'))
+        self.assertIdentical(self.janitor.cleaning, None)
+        self.assertEqual(len(self._files()), 7)
+
+    @defer.inlineCallbacks
+    def test_compress(self):
+        self.janitor.compression = 'gzip'
+        path = os.path.join(self.dir, 'job1.log')
+        self.janitor.add(path)
+        yield self.janitor.cleaning
+        self._touch('job1.log', 2000)
+        self.janitor.compress([path, os.path.join(self.dir, 'gone.log')])
+        while self.janitor.cleaning is not None:
+            yield self.janitor.cleaning
+        self.assertIn('job1.log.gz', self._files())
+        self.assertNotIn('job1.log', self._files())
+        self.assertIn(path + '.gz', self.janitor.index[self.dir])
+        self.assertNotIn(path, self.janitor.index[self.dir])
+
+    def test_compress_disabled(self):
+        self.janitor.compress([os.path.join(self.dir, 'old6.log')])
+        self.assertEqual(self.janitor.finished, [])
+
+    def test_unsupported_compression(self):
+        self.assertRaises(ValueError, Janitor,
+                          Config(values={'compress_files': 'zstd'}))
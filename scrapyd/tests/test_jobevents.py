@@ -0,0 +1,48 @@
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from scrapyd.jobevents import JobEvents
+
+
+class JobEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.events = JobEvents(maxlen=3, clock=self.clock)
+
+    def test_publish_since(self):
+        self.assertEqual(self.events.since(0), [])
+        self.events.publish('pending', 'add', {'id': 'j1'})
+        self.events.publish('pending', 'remove', {'id': 'j1'})
+        self.events.publish('running', 'add', {'id': 'j1'})
+        self.assertEqual(self.events.versions,
+                         {'pending': 2, 'running': 3, 'finished': 0})
+        self.assertEqual([e['seq'] for e in self.events.since(1)], [2, 3])
+        self.assertEqual(self.events.since(0)[0],
+                         {'seq': 1, 'section': 'pending', 'action': 'add',
+                          'job': {'id': 'j1'}})
+        self.assertEqual(self.events.since(3), [])
+        # the oldest changes are dropped
+        self.events.publish('running', 'remove', {'id': 'j1'})
+        self.assertEqual(self.events.since(0), None)
+        self.assertEqual(len(self.events.since(1)), 3)
+
+    def test_wait(self):
+        self.events.publish('pending', 'add', {'id': 'j1'})
+        d = self.events.wait(0, 10)
+        self.assertEqual(len(self.successResultOf(d)), 1)
+
+        d = self.events.wait(1, 10)
+        self.assertNoResult(d)
+        self.events.publish('pending', 'add', {'id': 'j2'})
+        self.assertEqual([e['job']['id'] for e in self.successResultOf(d)],
+                         ['j2'])
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+    def test_wait_timeout(self):
+        d = self.events.wait(0, 10)
+        self.clock.advance(9)
+        self.assertNoResult(d)
+        self.clock.advance(1)
+        self.assertEqual(self.successResultOf(d), [])
+        self.assertEqual(self.events.waiting, [])
@@ -0,0 +1,77 @@
+import gzip
+import os
+from io import BytesIO
+
+from twisted.trial import unittest
+
+from scrapyd.jobfiles import (BLOCK_SIZE, BlockGzipFile, compress_file,
+                              open_compressed, tail_offset)
+
+
+class CompressTest(unittest.TestCase):
+
+    data = b''.join(b'line %d\n' % i for i in range(50000))
+
+    def setUp(self):
+        self.dir = self.mktemp()
+        os.makedirs(self.dir)
+        self.path = os.path.join(self.dir, 'job.log')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        os.utime(self.path, (1000, 1000))
+
+    def test_compress(self):
+        gzpath = compress_file(self.path)
+        self.assertEqual(gzpath, self.path + '.gz')
+        self.assertEqual(os.listdir(self.dir), ['job.log.gz'])
+        self.assertEqual(os.path.getmtime(gzpath), 1000)
+        self.assertLess(os.path.getsize(gzpath), len(self.data) // 3)
+        with gzip.open(gzpath) as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertIdentical(compress_file(self.path), None)
+
+    def test_read(self):
+        with open_compressed(compress_file(self.path)) as f:
+            self.assertIsInstance(f, BlockGzipFile)
+            self.assertEqual(len(f.blocks), len(self.data) // BLOCK_SIZE + 1)
+            self.assertEqual(f.size, len(self.data))
+            for start in (0, 10, BLOCK_SIZE - 3, len(self.data) - 5):
+                f.seek(start)
+                self.assertEqual(f.read(BLOCK_SIZE + 10),
+                                 self.data[start:start + BLOCK_SIZE + 10])
+            self.assertEqual(f.read(), b'')
+            f.seek(-8, 2)
+            self.assertEqual(f.read(), b'e 49999\n')
+
+    def test_read_empty(self):
+        open(self.path, 'wb').close()
+        with open_compressed(compress_file(self.path)) as f:
+            self.assertEqual(f.size, 0)
+            self.assertEqual(f.read(), b'')
+
+    def test_read_gzip(self):
+        gzpath = self.path + '.gz'
+        with gzip.open(gzpath, 'wb') as f:
+            f.write(self.data)
+        f = open_compressed(gzpath)
+        self.addCleanup(f.close)
+        self.assertEqual(f.size, len(self.data))
+        f.seek(100)
+        self.assertEqual(f.read(10), self.data[100:110])
+
+
+class TailOffsetTest(unittest.TestCase):
+
+    def tail(self, data, lines, chunk_size=4):
+        offset = tail_offset(BytesIO(data), len(data), lines, chunk_size)
+        return data[offset:]
+
+    def test_tail(self):
+        data = b'a\nbb\nccc\ndddd\n'
+        self.assertEqual(self.tail(data, 1), b'dddd\n')
+        self.assertEqual(self.tail(data, 2), b'ccc\ndddd\n')
+        self.assertEqual(self.tail(data, 4), data)
+        self.assertEqual(self.tail(data, 10), data)
+        self.assertEqual(self.tail(data, 0), b'')
+        self.assertEqual(self.tail(data[:-1], 1), b'dddd')
+        self.assertEqual(self.tail(b'', 1), b'')
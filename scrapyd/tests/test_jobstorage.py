@@ -0,0 +1,159 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+from twisted.trial import unittest
+
+from zope.interface.verify import verifyObject
+
+from scrapyd.interfaces import IJobStorage
+from scrapyd.jobstorage import SqliteJobStorage
+from scrapyd.sqlite import encode
+
+
+class SqliteJobStorageTest(unittest.TestCase):
+
+    start = datetime(2012, 9, 12, 10, 14, 3, 594664)
+
+    def setUp(self):
+        self.storage = SqliteJobStorage()
+
+    def add_jobs(self, storage, n, project='p1', spider='s1'):
+        for i in range(n):
+            storage.add({'project': project, 'spider': spider,
+                         'job': '%s-%s-%d' % (project, spider, i),
+                         'start_time': self.start + timedelta(minutes=i),
+                         'end_time': self.start + timedelta(minutes=i + 1),
+                         'exit_status': 0, 'msg': {'count': '1'}})
+
+    def test_interface(self):
+        verifyObject(IJobStorage, self.storage)
+
+    def test_add_and_list(self):
+        self.add_jobs(self.storage, 2)
+        self.assertEqual(len(self.storage), 2)
+        job = list(self.storage)[1]
+        self.assertEqual(job['job'], 'p1-s1-1')
+        self.assertEqual(job['start_time'], self.start + timedelta(minutes=1))
+        self.assertEqual(job['end_time'], self.start + timedelta(minutes=2))
+        self.assertEqual(job['exit_status'], 0)
+        self.assertEqual(job['msg'], {'count': '1'})
+
+    def test_filters(self):
+        self.add_jobs(self.storage, 3)
+        self.add_jobs(self.storage, 2, spider='s2')
+        self.add_jobs(self.storage, 1, project='p2')
+        jobs = lambda **kw: [j['job'] for j in self.storage.list(**kw)]
+        self.assertEqual(len(jobs(project='p1')), 5)
+        self.assertEqual(jobs(project='p1', spider='s2'), ['p1-s2-0', 'p1-s2-1'])
+        self.assertEqual(jobs(spider='s1'), ['p1-s1-0', 'p1-s1-1', 'p1-s1-2',
+                                             'p2-s1-0'])
+        self.assertEqual(jobs(spider='s1', since=datetime(2012, 9, 12, 10, 16),
+                              until=self.start + timedelta(minutes=3)),
+                         ['p1-s1-1'])
+
+    def test_pagination(self):
+        self.add_jobs(self.storage, 5)
+        page = self.storage.list(limit=2)
+        self.assertEqual([j['job'] for j in page], ['p1-s1-0', 'p1-s1-1'])
+        page = self.storage.list(limit=2, cursor=page[-1]['id'])
+        self.assertEqual([j['job'] for j in page], ['p1-s1-2', 'p1-s1-3'])
+        page = self.storage.list(limit=2, cursor=page[-1]['id'])
+        self.assertEqual([j['job'] for j in page], ['p1-s1-4'])
+        page = self.storage.list(limit=2, offset=1)
+        self.assertEqual([j['job'] for j in page], ['p1-s1-1', 'p1-s1-2'])
+        page = self.storage.list(offset=3)
+        self.assertEqual([j['job'] for j in page], ['p1-s1-3', 'p1-s1-4'])
+        page = self.storage.list(limit=2, reverse=True)
+        self.assertEqual([j['job'] for j in page], ['p1-s1-4', 'p1-s1-3'])
+        page = self.storage.list(limit=2, reverse=True, cursor=page[-1]['id'])
+        self.assertEqual([j['job'] for j in page], ['p1-s1-2', 'p1-s1-1'])
+
+    def test_count(self):
+        self.add_jobs(self.storage, 3)
+        self.add_jobs(self.storage, 2, spider='s2')
+        self.add_jobs(self.storage, 1, project='p2')
+        self.assertEqual(self.storage.count(), 6)
+        self.assertEqual(len(self.storage), 6)
+        self.assertEqual(self.storage.count(project='p1'), 5)
+        self.assertEqual(self.storage.count(spider='s1'), 4)
+        self.assertEqual(self.storage.count(project='p1', spider='s2'), 2)
+
+    def test_maxlen(self):
+        storage = SqliteJobStorage(maxlen=3)
+        self.add_jobs(storage, 5)
+        self.assertEqual([j['job'] for j in storage],
+                         ['p1-s1-2', 'p1-s1-3', 'p1-s1-4'])
+        self.assertEqual(len(storage), 3)
+
+    def test_max_age(self):
+        storage = SqliteJobStorage(max_age=timedelta(days=30))
+        self.add_jobs(storage, 2)  # in 2012
+        now = datetime.now()
+        storage.add({'project': 'p1', 'spider': 's1', 'job': 'recent',
+                     'start_time': now, 'end_time': now})
+        self.assertEqual([j['job'] for j in storage], ['recent'])
+        self.assertEqual(len(storage), 1)
+
+    def test_len_not_counted(self):
+        database = self.mktemp()
+        storage = SqliteJobStorage(database, maxlen=3)
+        self.add_jobs(storage, 2)
+        self.assertEqual(len(SqliteJobStorage(database)), 2)
+        queries = []
+        storage.conn.set_trace_callback(queries.append)
+        self.addCleanup(storage.conn.set_trace_callback, None)
+        self.assertEqual(len(storage), 2)
+        self.assertEqual(storage.count(), 2)
+        self.assertEqual(queries, [])
+        self.add_jobs(storage, 2, spider='s2')
+        self.assertEqual(len(storage), 3)
+
+    def test_copy_old_jobs(self):
+        database = self.mktemp()
+        conn = sqlite3.connect(database)
+        # the list of finished jobs of the first versions, with blob keys
+        conn.execute("create table finished_job (key blob primary key, "
+                     "value blob)")
+        for i in range(3):
+            conn.execute("insert into finished_job values (?, ?)", (
+                encode(i), encode({
+                    'project': 'p1', 'spider': 's1', 'job': 'j%d' % i,
+                    'pid': 100 + i, 'slot': 1, 'priority': 0.0,
+                    'start_time': self.start,
+                    'end_time': self.start + timedelta(minutes=i),
+                    'msg': {'count': '1'}, 'env': {}})))
+        conn.commit()
+        conn.close()
+        storage = SqliteJobStorage(database)
+        jobs = list(storage)
+        start = self.start.replace(microsecond=594000)  # stored in ms
+        self.assertEqual([j['job'] for j in jobs], ['j0', 'j1', 'j2'])
+        self.assertEqual(jobs[2]['end_time'], start + timedelta(minutes=2))
+        self.assertEqual(jobs[2]['pid'], 102)
+        self.assertEqual(jobs[2]['msg'], {'count': '1'})
+        q = "select name from sqlite_master where name='finished_job'"
+        self.assertEqual(storage.conn.execute(q).fetchall(), [])
+        self.assertEqual(len(SqliteJobStorage(database)), 3)
+
+    def test_usage(self):
+        self.storage.add({'project': 'p1', 'spider': 's1', 'job': 'j1',
+                          'usage': {'cpu_user': 1.5, 'max_rss': 2048}})
+        self.add_jobs(self.storage, 1)
+        jobs = list(self.storage)
+        self.assertEqual(jobs[0]['usage'], {'cpu_user': 1.5, 'max_rss': 2048})
+        self.assertEqual(jobs[1]['usage'], None)
+
+    def test_add_columns(self):
+        database = self.mktemp()
+        conn = sqlite3.connect(database)
+        conn.execute("create table job_history (id integer primary key "
+                     "autoincrement, project text not null, spider text not "
+                     "null, job text not null, pid integer, slot integer, "
+                     "priority real, start_time text, end_time text, "
+                     "exit_status integer, msg blob)")
+        conn.commit()
+        conn.close()
+        storage = SqliteJobStorage(database)
+        self.add_jobs(storage, 1)
+        self.assertEqual(list(storage)[0]['startup_time'], None)
+        self.assertEqual(list(storage)[0]['usage'], None)
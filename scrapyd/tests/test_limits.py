@@ -0,0 +1,43 @@
+from twisted.trial import unittest
+
+from scrapyd.config import Config
+from scrapyd.limits import ConcurrencyLimits
+
+
+class ConcurrencyLimitsTest(unittest.TestCase):
+
+    def setUp(self):
+        config = Config(values={'max_proc_per_project': '3',
+                                'max_proc_per_spider': '2'})
+        config.cp.add_section('max_proc_per_project')
+        config.cp.set('max_proc_per_project', 'MyProject', '1')
+        config.cp.add_section('max_proc_per_spider')
+        config.cp.set('max_proc_per_spider', 'p1.Spider1', '0')
+        config.cp.set('max_proc_per_spider', 'p1.spider2', '5')
+        self.limits = ConcurrencyLimits(config)
+
+    def test_limits(self):
+        self.assertEqual(self.limits.project_limit_for('MyProject'), 1)
+        self.assertEqual(self.limits.project_limit_for('p1'), 3)
+        self.assertEqual(self.limits.spider_limit_for('p1', 'Spider1'), 0)
+        self.assertEqual(self.limits.spider_limit_for('p1', 'spider2'), 5)
+        self.assertEqual(self.limits.spider_limit_for('p2', 'spider2'), 2)
+
+    def test_counts(self):
+        finished = []
+        self.limits.add_listener(finished.append)
+        self.limits.started('MyProject', 's1')
+        self.assertTrue(self.limits.project_full('MyProject'))
+        for spider in ('Spider1', 'Spider1', 'spider2'):
+            self.limits.started('p1', spider)
+        self.assertTrue(self.limits.project_full('p1'))
+        self.assertEqual(self.limits.running_spiders('p1'),
+                         {'Spider1': (2, None), 'spider2': (1, 5)})
+        self.limits.finished('p1', 'spider2')
+        self.assertFalse(self.limits.project_full('p1'))
+        self.assertEqual(self.limits.running_spiders('p1'),
+                         {'Spider1': (2, None)})
+        self.limits.finished('MyProject', 's1')
+        self.assertEqual(self.limits.projects, {'p1': 2})
+        self.assertEqual(self.limits.running_spiders('MyProject'), {})
+        self.assertEqual(finished, ['p1', 'MyProject'])
@@ -0,0 +1,180 @@
+from datetime import datetime
+
+from twisted.trial import unittest
+
+from scrapyd.logstats import read_log_stats, log_stats_row, epoch_millis
+from scrapyd.sqlite import LogStatsSqliteData
+
+LOG = b"""\
+2024-03-01 10:00:00 [scrapy.core.engine] INFO: Closing spider (finished)
+2024-03-01 10:00:00 [scrapy.statscollectors] INFO: Dumping Scrapy stats:
+{'downloader/request_count': 12,
+ 'elapsed_time_seconds': 3.5,
+ 'finish_reason': 'finished',
+ 'finish_time': datetime.datetime(2024, 3, 1, 10, 0, tzinfo=datetime.timezone.utc),
+ 'item_scraped_count': 40,
+ 'log_count/DEBUG': 60,
+ 'log_count/ERROR': 2,
+ 'log_count/INFO': 10,
+ 'log_count/WARNING': 1,
+ 'response_received_count': 11,
+ 'start_time': datetime.datetime(2024, 3, 1, 9, 59, tzinfo=datetime.timezone.utc)}
+2024-03-01 10:00:00 [scrapy.core.engine] INFO: Spider closed (finished)
+"""
+
+
+class LogStatsTest(unittest.TestCase):
+
+    def write_log(self, data):
+        path = self.mktemp()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_read_log_stats(self):
+        stats = read_log_stats(self.write_log(b'x' * 100000 + b'\n' + LOG))
+        self.assertEqual(stats['item_scraped_count'], 40)
+        self.assertEqual(stats['log_count/DEBUG'], 60)
+        self.assertEqual(stats['finish_reason'], 'finished')
+        self.assertFalse('start_time' in stats)
+        self.assertFalse('elapsed_time_seconds' in stats)
+
+    def test_no_stats(self):
+        self.assertEqual(read_log_stats(self.write_log(LOG[:100])), None)
+        self.assertEqual(read_log_stats(self.mktemp()), None)
+
+    def test_row(self):
+        end = datetime(2024, 3, 1, 10, 0)
+        job = {'project': 'p1', 'spider': 's1', 'job': 'j1', 'end_time': end}
+        stats = read_log_stats(self.write_log(LOG))
+        self.assertEqual(log_stats_row(job, stats), {
+            'project': 'p1', 'spider': 's1', 'job': 'j1',
+            'create_time': epoch_millis(end), 'items': 40, 'pages': 11,
+            'log_count': 73, 'errors': 2, 'warnings': 1,
+            'finish_reason': 'finished'})
+
+
+class LogStatsSqliteDataTest(unittest.TestCase):
+
+    def setUp(self):
+        self.data = LogStatsSqliteData()
+        rows = []
+        for i in range(100):
+            rows.append({'project': 'p%d' % (i % 2), 'spider': 's1',
+                         'job': 'j%d' % i, 'create_time': 1000 + i * 10,
+                         'log_count': 5, 'items': i, 'pages': 1,
+                         'errors': 0, 'warnings': 0})
+        self.data.insert_logs(rows)
+
+    def test_get_stats(self):
+        stats = self.data.get_stats(1000, 2000)
+        self.assertEqual(len(stats), 100)
+        self.assertEqual(stats[3], {'time': 1030, 'jobs': 1, 'items': 3,
+                                    'items_min': 3, 'items_max': 3,
+                                    'pages': 1, 'pages_min': 1, 'pages_max': 1,
+                                    'errors': 0, 'errors_min': 0,
+                                    'errors_max': 0, 'log_count': 5,
+                                    'warnings': 0})
+
+    def test_downsampling(self):
+        stats = self.data.get_stats(1000, 2000, points=10)
+        self.assertEqual([p['time'] for p in stats], list(range(1000, 2000, 100)))
+        self.assertEqual([p['jobs'] for p in stats], [10] * 10)
+        self.assertEqual(stats[0]['items'], sum(range(10)))
+        self.assertEqual(sum(p['items'] for p in stats), sum(range(100)))
+
+    def test_filters(self):
+        stats = self.data.get_stats(1000, 1100, project='p1', points=1)
+        self.assertEqual(len(stats), 1)
+        self.assertEqual((stats[0]['jobs'], stats[0]['items'],
+                          stats[0]['items_min'], stats[0]['items_max']),
+                         (5, 25, 1, 9))
+        self.assertEqual(self.data.get_stats(1000, 2000, spider='s2'), [])
+
+    def test_insert_log(self):
+        self.data.insert_log(5000, 's2', 1, 2, 3, project='p1')
+        stats = self.data.get_stats(5000, 5001, spider='s2')
+        self.assertEqual(stats[0]['items'], 3)
+        self.assertEqual(stats[0]['pages'], 2)
+
+
+class LogStatsRollupTest(unittest.TestCase):
+
+    hour = 3600000
+    day = 24 * hour
+
+    def rows(self, n):
+        # a job every 10 minutes over 5 days, from two spiders
+        return [{'project': 'p1', 'spider': 's%d' % (i % 2), 'job': 'j%d' % i,
+                 'create_time': self.day * 100 + i * 600000, 'log_count': 3,
+                 'items': i, 'pages': 2 * i, 'errors': i % 3,
+                 'warnings': 1} for i in range(n)]
+
+    def assertSameStats(self, data, *args, **kwargs):
+        stats = data.get_stats(*args, **kwargs)
+        raw = data.get_stats(use_rollups=False, *args, **kwargs)
+        self.assertEqual(stats, raw)
+        return stats
+
+    def test_rollups(self):
+        data = LogStatsSqliteData()
+        data.insert_logs(self.rows(720))
+        st, et = self.day * 100, self.day * 105
+        stats = self.assertSameStats(data, st, et, points=5)
+        self.assertEqual([p['jobs'] for p in stats], [144] * 5)
+        self.assertEqual(stats[1]['items_min'], 144)
+        self.assertEqual(stats[1]['items_max'], 287)
+        self.assertEqual(stats[1]['errors_max'], 2)
+        self.assertEqual(sum(p['warnings'] for p in stats), 720)
+        stats = self.assertSameStats(data, st, et, points=24 * 5, spider='s1')
+        self.assertEqual([p['jobs'] for p in stats], [3] * 120)
+        data.insert_logs(dict(r, project='p2') for r in self.rows(100))
+        stats = self.assertSameStats(data, st, et, points=5, project='p1')
+        self.assertEqual([p['jobs'] for p in stats], [144] * 5)
+        stats = self.assertSameStats(data, st, et, points=5)
+        self.assertEqual(stats[0]['jobs'], 244)
+
+    def test_rollup_levels(self):
+        data = LogStatsSqliteData()
+        data.insert_logs(self.rows(720))
+        queries = []
+        data.conn.set_trace_callback(queries.append)
+        self.addCleanup(data.conn.set_trace_callback, None)
+        st, et = self.day * 100, self.day * 105
+        data.get_stats(st, et, points=5)
+        data.get_stats(st, et, points=5, project='p1')
+        data.get_stats(st, et, points=5, spider='s1')
+        self.assertEqual([q.split(' from ')[1].split()[0] for q in queries],
+                         ['log_stats_daily_total', 'log_stats_daily_projects',
+                          'log_stats_daily'])
+
+    def test_widened_range(self):
+        data = LogStatsSqliteData()
+        data.insert_logs(self.rows(720))
+        stats = data.get_stats(self.day * 100 + 1, self.day * 101 - 1,
+                               points=1)
+        self.assertEqual(stats[0]['time'], self.day * 100)
+        self.assertEqual(stats[0]['jobs'], 144)
+
+    def test_fill_rollups(self):
+        database = self.mktemp()
+        data = LogStatsSqliteData(database)
+        data.insert_logs(self.rows(300))
+        expected = data.get_stats(self.day * 100, self.day * 103, points=3)
+        for name, _ in data.rollups:
+            for suffix, _ in data.levels:
+                data.conn.execute("drop table log_stats_%s%s" % (name, suffix))
+        data = LogStatsSqliteData(database)
+        stats = self.assertSameStats(data, self.day * 100, self.day * 103,
+                                     points=3)
+        self.assertEqual(stats, expected)
+        # the tables of older versions only had the spider rollups
+        for name, _ in data.rollups:
+            for suffix in ('_projects', '_total'):
+                data.conn.execute("drop table log_stats_%s%s" % (name, suffix))
+        data = LogStatsSqliteData(database)
+        stats = self.assertSameStats(data, self.day * 100, self.day * 103,
+                                     points=3)
+        self.assertEqual(stats, expected)
+        self.assertSameStats(data, self.day * 100, self.day * 103, points=72,
+                             project='p1')
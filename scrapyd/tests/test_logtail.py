@@ -0,0 +1,124 @@
+import os
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+from twisted.web.test.requesthelper import DummyRequest
+
+from scrapyd import logtail
+from scrapyd.logtail import EventStream, LogFollowers
+
+
+class Subscriber(object):
+
+    def __init__(self):
+        self.data = []
+        self.ended = False
+
+    def write(self, offset, data):
+        self.data.append((offset, data))
+
+    def end(self):
+        self.ended = True
+
+
+class LogFollowersTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(self.mktemp(), 'job.log')
+        os.makedirs(os.path.dirname(self.path))
+        self.append(b'line 1\nline 2\n')
+        self.done = False
+        self.clock = task.Clock()
+        self.followers = LogFollowers(clock=self.clock, use_inotify=False)
+        self.addCleanup(self.followers.stop)
+
+    def append(self, data):
+        with open(self.path, 'ab') as f:
+            f.write(data)
+
+    def follow(self, offset=0, backlog=65536):
+        s = Subscriber()
+        self.followers.follow(self.path, s, offset, backlog,
+                              lambda: self.done)
+        return s
+
+    def test_follow(self):
+        s1 = self.follow()
+        self.assertEqual(s1.data, [(0, b'line 1\nline 2\n')])
+        s2 = self.follow(offset=7)
+        self.assertEqual(s2.data, [(7, b'line 2\n')])
+        self.assertEqual(len(self.followers.followers), 1)
+
+        self.append(b'line 3\n')
+        self.clock.advance(1)
+        self.assertEqual(s1.data[1:], [(14, b'line 3\n')])
+        self.assertEqual(s2.data[1:], [(14, b'line 3\n')])
+
+        self.followers.unfollow(self.path, s2)
+        self.append(b'line 4\n')
+        self.done = True
+        self.clock.advance(1)
+        self.assertEqual(s1.data[2:], [(21, b'line 4\n')])
+        self.assertEqual(len(s2.data), 2)
+        self.assertTrue(s1.ended)
+        self.assertFalse(s2.ended)
+        self.assertEqual(self.followers.followers, {})
+        self.assertFalse(self.followers.loop.running)
+
+    def test_backlog(self):
+        s = self.follow(backlog=10)
+        self.assertEqual(s.data, [(7, b'line 2\n')])
+
+    def test_not_created(self):
+        os.remove(self.path)
+        s = self.follow()
+        self.assertEqual(s.data, [])
+        self.append(b'line 1\n')
+        self.clock.advance(1)
+        self.assertEqual(s.data, [(0, b'line 1\n')])
+
+    def test_unfollow_last(self):
+        s = self.follow()
+        self.followers.unfollow(self.path, s)
+        self.assertEqual(self.followers.followers, {})
+        self.assertFalse(s.ended)
+
+
+class InotifyTest(unittest.TestCase):
+
+    if logtail.inotify is None:
+        skip = "inotify is not available"
+
+    @defer.inlineCallbacks
+    def test_notified(self):
+        path = os.path.join(self.mktemp(), 'job.log')
+        os.makedirs(os.path.dirname(path))
+        open(path, 'wb').close()
+        followers = LogFollowers(interval=60)
+        self.addCleanup(followers.stop)
+        s = Subscriber()
+        followers.follow(path, s, 0, 65536, lambda: False)
+        with open(path, 'ab') as f:
+            f.write(b'line 1\n')
+        for i in range(50):
+            if s.data:
+                break
+            yield task.deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(s.data, [(0, b'line 1\n')])
+
+
+class EventStreamTest(unittest.TestCase):
+
+    def test_events(self):
+        request = DummyRequest([b''])
+        stream = EventStream(request)
+        stream.write(10, b'a\r\nb')
+        stream.write(14, b'c\n\xff\nd')
+        stream.end()
+        self.assertEqual(b''.join(request.written),
+                         b'id: 13\ndata: a\n\n'
+                         b'id: 16\ndata: bc\n\n'
+                         b'id: 18\ndata: \xef\xbf\xbd\n\n'
+                         b'id: 19\ndata: d\n\n'
+                         b'event: end\ndata: \n\n')
+        self.assertEqual(request.finished, 1)
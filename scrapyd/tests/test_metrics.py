@@ -0,0 +1,40 @@
+from twisted.trial import unittest
+
+from scrapyd.metrics import Counter, Gauge, Histogram, Registry
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter_and_gauge(self):
+        c = Counter('lookups_total', 'Lookups.', ['result'],
+                    registry=self.registry)
+        g = Gauge('slots', 'Slots.', registry=self.registry)
+        c.inc(('hit',))
+        c.inc(('hit',), 2)
+        c.inc(('mi"ss',))
+        g.set(4)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP lookups_total Lookups.',
+            '# TYPE lookups_total counter',
+            'lookups_total{result="hit"} 3',
+            'lookups_total{result="mi\\"ss"} 1',
+            '# HELP slots Slots.',
+            '# TYPE slots gauge',
+            'slots 4',
+        ]) + '\n')
+
+    def test_histogram(self):
+        h = Histogram('op_seconds', 'Operations.', ['op'], buckets=[0.1, 1],
+                      registry=self.registry)
+        for value in (0.05, 0.1, 0.5, 2):
+            h.observe(value, ('put',))
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+            'op_seconds_bucket{op="put",le="0.1"} 2',
+            'op_seconds_bucket{op="put",le="1"} 3',
+            'op_seconds_bucket{op="put",le="+Inf"} 4',
+            'op_seconds_sum{op="put"} 2.65',
+            'op_seconds_count{op="put"} 4',
+        ])
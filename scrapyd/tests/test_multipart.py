@@ -0,0 +1,59 @@
+from io import BytesIO
+
+from twisted.trial import unittest
+
+from scrapyd.multipart import parse_multipart
+
+BOUNDARY = b'----xyz'
+
+
+def multipart(*parts):
+    body = b''
+    for name, value, filename in parts:
+        disposition = b'form-data; name="' + name + b'"'
+        if filename:
+            disposition += b'; filename="' + filename + b'"'
+        body += b'--' + BOUNDARY + b'\r\n'
+        body += b'Content-Disposition: ' + disposition + b'\r\n'
+        if filename:
+            body += b'Content-Type: application/octet-stream\r\n'
+        body += b'\r\n' + value + b'\r\n'
+    return BytesIO(body + b'--' + BOUNDARY + b'--\r\n')
+
+
+class ParseMultipartTest(unittest.TestCase):
+
+    egg = b'PK\x03\x04' + b'\r\n--' * 1000 + b'egg\x00' * 10000
+
+    def test_parse(self):
+        body = multipart((b'project', b'mybot', None),
+                         (b'egg', self.egg, b'mybot.egg'),
+                         (b'version', b'r1', None))
+        fields, files = parse_multipart(body, BOUNDARY, [b'egg'])
+        self.assertEqual(fields, {b'project': [b'mybot'],
+                                  b'version': [b'r1']})
+        self.assertEqual(files[b'egg'].read(), self.egg)
+
+    def test_small_chunks(self):
+        body = multipart((b'egg', self.egg, b'mybot.egg'),
+                         (b'project', b'mybot', None))
+        fields, files = parse_multipart(body, BOUNDARY, [b'egg'],
+                                        chunk_size=7)
+        self.assertEqual(fields, {b'project': [b'mybot']})
+        egg = files[b'egg']
+        self.assertEqual(egg.read(4), b'PK\x03\x04')
+        egg.seek(0)
+        self.assertEqual(egg.read(), self.egg)
+        self.assertEqual(egg.tell(), len(self.egg))
+
+    def test_large_field(self):
+        body = multipart((b'project', b'x' * 100, None))
+        self.assertRaises(ValueError, parse_multipart, body, BOUNDARY,
+                          max_field_size=10)
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, parse_multipart, BytesIO(b'egg'),
+                          BOUNDARY)
+        body = multipart((b'project', b'mybot', None)).getvalue()
+        self.assertRaises(ValueError, parse_multipart, BytesIO(body[:-20]),
+                          BOUNDARY)
@@ -0,0 +1,112 @@
+import os
+
+from twisted.internet import defer
+from twisted.internet.task import Clock
+from twisted.trial import unittest
+
+from scrapyd.config import Config
+from scrapyd.output import LogOutput, FileOutput
+
+
+class FakeTransport(object):
+
+    def __init__(self):
+        self.paused = []
+
+    def pauseProducing(self):
+        self.paused.append(True)
+
+    def resumeProducing(self):
+        self.paused.append(False)
+
+
+class FakeProcess(object):
+
+    pid = 123
+    job = 'job1'
+
+    def __init__(self, logfile=None):
+        self.logfile = logfile
+        self.transport = FakeTransport()
+
+
+class LogOutputTest(unittest.TestCase):
+
+    def test_rate(self):
+        clock = Clock()
+        output = LogOutput(Config(values={'job_output_rate': '10'}),
+                           FakeProcess(), clock)
+        output.write('stdout', b'12345678\n')
+        output.write('stderr', b'12345678\n')
+        self.assertEqual(output.dropped, 9)
+        clock.advance(1)
+        output.write('stdout', b'1234\n')
+        self.assertEqual(output.stats(), {'stdout_bytes': 14,
+                                          'stderr_bytes': 9,
+                                          'dropped_bytes': 9})
+
+    def test_unlimited(self):
+        output = LogOutput(Config(values={'job_output_rate': '0'}),
+                           FakeProcess(), Clock())
+        for _ in range(100):
+            output.write('stdout', b'x' * 1000)
+        self.assertEqual(output.dropped, 0)
+
+
+class FileOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.logfile = os.path.join(self.mktemp(), 'p', 's', 'job1.log')
+        self.process = FakeProcess(self.logfile)
+        self.output = FileOutput(Config(), self.process, self.clock)
+
+    def read(self):
+        with open(self.logfile, 'rb') as f:
+            return f.read()
+
+    @defer.inlineCallbacks
+    def test_lines(self):
+        self.output.flush_size = 10
+        self.output.write('stdout', b'first line\nsecond')
+        self.assertEqual(self.output.buffered, 6)  # the partial line
+        yield self.output.writing
+        self.assertEqual(self.read(), b'first line\n')
+        self.clock.advance(self.output.flush_delay)
+        self.assertEqual(self.output.writing, None)
+        self.output.write('stderr', b' line')
+        yield self.output.close()
+        self.assertEqual(self.read(), b'first line\nsecond line')
+        self.assertTrue(self.output.file.closed)
+        self.assertEqual(self.output.stats(), {'stdout_bytes': 17,
+                                               'stderr_bytes': 5,
+                                               'dropped_bytes': 0})
+
+    @defer.inlineCallbacks
+    def test_delayed_flush(self):
+        self.output.write('stdout', b'line\n')
+        self.assertEqual(self.output.writing, None)
+        self.clock.advance(self.output.flush_delay)
+        yield self.output.writing
+        self.assertEqual(self.read(), b'line\n')
+
+    @defer.inlineCallbacks
+    def test_backpressure(self):
+        self.output.flush_size = 10
+        self.output.max_buffer = 30
+        for i in range(5):
+            self.output.write('stdout', b'line %04d\n' % i)
+        self.assertEqual(self.process.transport.paused, [True])
+        while self.output.writing is not None:
+            yield self.output.writing
+        self.assertEqual(self.process.transport.paused, [True, False])
+        yield self.output.close()
+        self.assertEqual(self.read(), b''.join(b'line %04d\n' % i
+                                               for i in range(5)))
+
+    @defer.inlineCallbacks
+    def test_no_log_file(self):
+        output = FileOutput(Config(), FakeProcess(), self.clock)
+        output.write('stdout', b'line\n')
+        yield output.close()
+        self.assertEqual(output.stats()['stdout_bytes'], 5)
@@ -1,13 +1,19 @@
+import json
 import os
+import sqlite3
 
 from twisted.trial import unittest
+from twisted.internet import task
 from twisted.internet.defer import Deferred
+from twisted.python import filepath
 
 from zope.interface.verify import verifyObject
 
 from scrapyd.interfaces import IPoller
 from scrapyd.config import Config
-from scrapyd.poller import QueuePoller
+from scrapyd.poller import QueuePoller, QueueWatcher, RoundRobinStrategy, \
+    WeightedFairStrategy, GlobalPriorityStrategy
+from scrapyd.scheduler import SpiderScheduler
 from scrapyd.utils import get_spider_queues
 
 class QueuePollerTest(unittest.TestCase):
@@ -54,4 +60,177 @@ class QueuePollerTest(unittest.TestCase):
         # check that the other project's spider got to run
         self.poller.poll()
         prj, spd = cfg.popitem()
+        self.failUnless(d2.result.pop('_scheduled'))
         self.failUnlessEqual(d2.result, {'_project': prj, '_spider': spd})
+
+    def test_poll_fills_all_slots(self):
+        for i in range(3):
+            self.queues['mybot1'].add('spider%d' % i)
+        self.queues['mybot2'].add('spider3')
+
+        slots = [self.poller.next() for _ in range(5)]
+        self.poller.poll()
+        spiders = sorted(d.result['_spider'] for d in slots if d.called)
+        self.assertEqual(spiders, ['spider0', 'spider1', 'spider2', 'spider3'])
+        self.failIf(slots[-1].called)
+
+    def test_notify_from_scheduler(self):
+        config = self.poller.config
+        scheduler = SpiderScheduler(config)
+        scheduler.add_listener(self.poller.notify)
+
+        d = self.poller.next()
+        self.failIf(d.called)
+        scheduler.schedule('mybot2', 'spider1')
+        self.assertEqual(d.result['_project'], 'mybot2')
+        self.assertEqual(d.result['_spider'], 'spider1')
+
+    def add_from_other_process(self, project, spider):
+        conn = sqlite3.connect(self.queues[project].database)
+        conn.execute("insert into spider_queue (priority, message, key) "
+                     "values (0, ?, ?)", (sqlite3.Binary(json.dumps(
+                         {'name': spider}).encode('ascii')), spider))
+        conn.commit()
+        conn.close()
+
+    def test_poll_skips_unchanged_queues(self):
+        self.poller.poll()
+        peeked = []
+        for project, queue in self.poller.queues.items():
+            peek = queue.peek_priority
+            queue.peek_priority = lambda *a, **kw: peeked.append(1) or peek(*a, **kw)
+        self.poller.poll()
+        self.assertEqual(peeked, [])
+
+        d = self.poller.next()
+        self.add_from_other_process('mybot1', 'spider1')
+        self.poller.poll()
+        self.assertEqual(d.result, {'_project': 'mybot1', '_spider': 'spider1'})
+
+    def test_watcher(self):
+        clock = task.Clock()
+        watcher = QueueWatcher(self.poller, self.poller.config.get('dbs_dir'),
+                               clock=clock)
+        self.poller.poll()
+        d = self.poller.next()
+        self.add_from_other_process('mybot2', 'spider1')
+        for name in ('launcher.db', 'mybot2.db-wal', 'mybot2.db'):
+            path = os.path.join(watcher.dbs_dir, name)
+            watcher._notified(None, filepath.FilePath(path), 0)
+        self.failIf(d.called)
+        self.assertEqual(watcher.changed, set(['launcher.db', 'mybot2.db']))
+        clock.advance(watcher.latency)
+        self.assertEqual(d.result, {'_project': 'mybot2', '_spider': 'spider1'})
+        self.assertEqual(watcher.changed, set())
+
+    def start(self, jobs):
+        """Wait for jobs until none is dispatched, and return the deferred
+        left waiting"""
+        while True:
+            d = self.poller.next()
+            d.addCallback(lambda m: jobs.append((m['_project'], m['_spider'])))
+            if not d.called:
+                return d
+
+    def test_spider_limits(self):
+        self.poller.limits.spider_limit = 1
+        self.poller.limits.spider_limits['mybot1.spider2'] = 2
+        for spider in ('spider1', 'spider1', 'spider2', 'spider2', 'spider2'):
+            self.queues['mybot1'].add(spider)
+        self.queues['mybot1'].add('spider3', _max_running=2)
+        self.queues['mybot1'].add('spider3', _max_running=2)
+        self.poller.poll()
+        jobs = []
+        self.start(jobs)
+        self.assertEqual(sorted(s for p, s in jobs), ['spider1', 'spider2',
+                         'spider2', 'spider3', 'spider3'])
+        # the skipped jobs are left in the queue until a job finishes
+        self.assertEqual(self.queues['mybot1'].count(), 2)
+        self.poller.limits.finished('mybot1', 'spider2')
+        self.assertEqual(jobs[-1], ('mybot1', 'spider2'))
+        self.assertEqual(self.queues['mybot1'].count(), 1)
+
+    def test_project_limits(self):
+        self.poller.limits.project_limits['mybot1'] = 2
+        for i in range(4):
+            self.queues['mybot1'].add('spider%d' % i)
+        self.queues['mybot2'].add('spider1')
+        self.poller.poll()
+        jobs = []
+        d = self.start(jobs)
+        self.assertEqual(sorted(p for p, s in jobs),
+                         ['mybot1', 'mybot1', 'mybot2'])
+        self.assertEqual(self.queues['mybot1'].count(), 2)
+        self.poller.limits.finished('mybot1', jobs[0][1])
+        self.failUnless(d.called)
+        self.assertEqual(jobs[-1][0], 'mybot1')
+        self.assertEqual(self.queues['mybot1'].count(), 1)
+
+
+class StrategyTest(unittest.TestCase):
+
+    def dispatch(self, strategy, pending, n):
+        for p, prio in pending.items():
+            strategy.add(p, prio)
+        out = []
+        for _ in range(n):
+            p = strategy.select()
+            out.append(p)
+            strategy.dispatched(p)
+        return out
+
+    def test_round_robin(self):
+        s = RoundRobinStrategy(Config())
+        out = self.dispatch(s, {'a': 0, 'b': 0, 'c': 0}, 6)
+        self.assertEqual(sorted(out[:3]), ['a', 'b', 'c'])
+        self.assertEqual(out[3:], out[:3])
+        s.remove('b')
+        self.assertEqual(self.dispatch(s, {}, 2), [p for p in out[:3] if p != 'b'])
+        s.remove('a')
+        s.remove('c')
+        self.assertEqual(s.select(), None)
+
+    def test_weighted_fair(self):
+        config = Config()
+        config.cp.add_section('project_weights')
+        config.cp.set('project_weights', 'a', '3')
+        s = WeightedFairStrategy(config)
+        out = self.dispatch(s, {'a': 0, 'b': 0}, 40)
+        self.assertEqual(out.count('a'), 30)
+        self.assertEqual(out.count('b'), 10)
+
+        # an idle project doesn't get credit for the time it had no jobs
+        s.add('c', 0)
+        out = self.dispatch(s, {}, 50)
+        self.assertTrue(9 <= out.count('c') <= 11, out.count('c'))
+
+    def test_global_priority(self):
+        s = GlobalPriorityStrategy(Config())
+        s.add('a', 1)
+        s.add('b', 5)
+        s.add('c', 5)
+        out = self.dispatch(s, {}, 4)
+        self.assertEqual(out, ['b', 'c', 'b', 'c'])
+        s.add('b', 0)
+        s.add('c', 0)
+        self.assertEqual(s.select(), 'a')
+        s.remove('a')
+        self.assertEqual(s.select(), 'b')
+
+    def test_poller_strategy(self):
+        d = self.mktemp()
+        eggs_dir = os.path.join(d, 'eggs')
+        for p in ('mybot1', 'mybot2'):
+            os.makedirs(os.path.join(eggs_dir, p))
+        config = Config(values={
+            'eggs_dir': eggs_dir, 'dbs_dir': os.path.join(d, 'dbs'),
+            'poll_strategy': 'scrapyd.poller.GlobalPriorityStrategy'})
+        poller = QueuePoller(config)
+        poller.queues['mybot1'].add('spider1', 1)
+        poller.queues['mybot2'].add('spider2', 2)
+        poller.queues['mybot1'].add('spider3', 3)
+        poller.notify('mybot1')
+        poller.notify('mybot2')
+        out = [poller.next().result['_spider'] for _ in range(3)]
+        self.assertEqual(out, ['spider3', 'spider2', 'spider1'])
+        self.failIf(poller.next().called)
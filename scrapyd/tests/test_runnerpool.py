@@ -0,0 +1,73 @@
+import os
+from io import BytesIO
+from pkgutil import get_data
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+from scrapyd import get_application
+from scrapyd.config import Config
+from scrapyd.interfaces import IEggStorage
+from scrapyd.launcher import ScrapyProcessProtocol
+from scrapyd.runnerpool import RunnerPool, STATUS_FD
+from scrapyd.tests.test_utils import get_pythonpath_scrapyd
+
+
+class ScrapyProcessProtocolStatusTest(unittest.TestCase):
+
+    def test_startup_time(self):
+        pp = ScrapyProcessProtocol(0, 'p1', 's1', 0.0, 'job', {})
+        pp.spawn_time = 100.0
+        pp.childDataReceived(STATUS_FD, b'{"event": "ready", "time": 90.0}\n'
+                                        b'{"event": "first_req')
+        self.assertEqual(pp.startup_time, None)
+        pp.childDataReceived(STATUS_FD, b'uest", "time": 101.5}\n')
+        self.assertEqual(pp.startup_time, 1.5)
+
+
+class ListProcessProtocol(ScrapyProcessProtocol):
+
+    def __init__(self, env):
+        ScrapyProcessProtocol.__init__(self, 0, 'mybot', 'list', 0.0, 'job', env)
+        self.out = b''
+
+    def outReceived(self, data):
+        self.out += data
+
+
+class RunnerPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        path = os.path.abspath(self.mktemp())
+        os.makedirs(path)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(path)
+        with open('scrapyd.conf', 'w') as f:
+            f.write("[scrapyd]\neggs_dir = eggs\ndbs_dir = dbs\n")
+        self.addCleanup(os.environ.__setitem__, 'PYTHONPATH',
+                        os.environ.get('PYTHONPATH', ''))
+        os.environ['PYTHONPATH'] = get_pythonpath_scrapyd()
+        self.app = get_application()
+        eggstorage = self.app.getComponent(IEggStorage)
+        eggstorage.put(BytesIO(get_data('scrapyd.tests', 'mybot.egg')),
+                       'mybot', 'r1')
+        self.pool = RunnerPool(Config(), self.app, 1)
+        self.addCleanup(self.pool.stop)
+
+    @defer.inlineCallbacks
+    def test_run(self):
+        env = dict(os.environ, SCRAPY_PROJECT='mybot')
+        pp = ListProcessProtocol(env)
+        self.assertFalse(self.pool.run(pp, ['list'], env))
+        self.assertEqual(list(self.pool.idle), [('mybot', 'r1')])
+        warm = self.pool.idle[('mybot', 'r1')]
+        pid = warm.transport.pid
+        pp = ListProcessProtocol(env)
+        self.assertTrue(self.pool.run(pp, ['list'], env))
+        yield pp.deferred
+        self.assertEqual(pp.pid, pid)
+        self.assertEqual(pp.exit_status, 0)
+        self.assertEqual(sorted(pp.out.decode('utf-8').split()),
+                         ['spider1', 'spider2'])
+        # a new warm runner was started for the next job
+        self.assertIsNot(self.pool.idle[('mybot', 'r1')], warm)
@@ -1,4 +1,5 @@
 import os
+import time
 
 from twisted.trial import unittest
 
@@ -43,3 +44,26 @@ class SpiderSchedulerTest(unittest.TestCase):
         self.assertEqual(q2.pop(), {'name': 'myspider3', 'e': 'f'})
         self.assertEqual(q2.pop(), {'name': 'myspider2', 'c': 'd'})
 
+
+    def test_schedule_many(self):
+        q1 = self.queues['mybot1']
+        self.sched.schedule_many('mybot1', [
+            ('myspider1', 2, {'a': 'b'}),
+            ('myspider2', 10, {'c': 'd'}),
+        ])
+        self.assertEqual(q1.count(), 2)
+        # the time is recorded by the queue, not in the spider arguments
+        self.assertFalse(any('_scheduled' in m for m in q1.list()))
+        msg1, msg2 = q1.pop(), q1.pop()
+        scheduled = msg1.pop('_scheduled')
+        self.assertTrue(abs(scheduled - time.time()) < 60)
+        self.assertEqual(msg2.pop('_scheduled'), scheduled)
+        self.assertEqual(msg1, {'name': 'myspider2', 'c': 'd', '_priority': '10'})
+        self.assertEqual(msg2, {'name': 'myspider1', 'a': 'b', '_priority': '2'})
+
+    def test_listeners(self):
+        notified = []
+        self.sched.add_listener(notified.append)
+        self.sched.schedule('mybot1', 'myspider1')
+        self.sched.schedule_many('mybot2', [('myspider2', 0, {})])
+        self.assertEqual(notified, ['mybot1', 'mybot2'])
@@ -1,3 +1,5 @@
+import time
+
 from twisted.internet.defer import inlineCallbacks, maybeDeferred
 from twisted.trial import unittest
 
@@ -37,11 +39,28 @@ class SpiderQueueTest(unittest.TestCase):
         self.assertEqual(c, 1)
 
         m = yield maybeDeferred(self.q.pop)
+        self.assertTrue(abs(m.pop('_scheduled') - time.time()) < 60)
         self.assertEqual(m, self.msg)
 
         c = yield maybeDeferred(self.q.count)
         self.assertEqual(c, 0)
 
+    @inlineCallbacks
+    def test_add_many(self):
+        yield maybeDeferred(self.q.add_many, [
+            (self.name, self.priority, self.args),
+            ('spider2', self.priority + 1, {}),
+        ])
+
+        c = yield maybeDeferred(self.q.count)
+        self.assertEqual(c, 2)
+
+        m1 = yield maybeDeferred(self.q.pop)
+        m2 = yield maybeDeferred(self.q.pop)
+        self.assertEqual(m1.pop('_scheduled'), m2.pop('_scheduled'))
+        self.assertEqual(m1, {'name': 'spider2'})
+        self.assertEqual(m2, self.msg)
+
     @inlineCallbacks
     def test_list(self):
         l = yield maybeDeferred(self.q.list)
@@ -65,3 +84,10 @@ class SpiderQueueTest(unittest.TestCase):
 
         c = yield maybeDeferred(self.q.count)
         self.assertEqual(c, 0)
+
+
+class SharedSpiderQueueTest(SpiderQueueTest):
+
+    def setUp(self):
+        SpiderQueueTest.setUp(self)
+        self.q = spiderqueue.SharedSqliteSpiderQueue(':memory:', 'project1')
@@ -1,9 +1,18 @@
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import time
 import unittest
 from datetime import datetime
 from decimal import Decimal
 
+from twisted.internet.task import Clock
+
 from scrapy.http import Request
-from scrapyd.sqlite import JsonSqlitePriorityQueue, JsonSqliteDict, JsonSqliteList
+from scrapyd.sqlite import JsonSqlitePriorityQueue, JsonSqliteDict, JsonSqliteList, \
+    JsonSqliteSharedPriorityQueue, GroupCommit, get_connection, release_connection, encode
 from scrapyd.launcher import ScrapyProcessProtocol
 
 
@@ -22,6 +31,54 @@ class JsonSqliteListTest(unittest.TestCase):
         del l[:1] 
         self.assertFalse(len(l))
 
+    def test_indexes_and_slices(self):
+        l = self.list_class()
+        l.extend(range(12))
+        self.assertEqual(l[0], 0)
+        self.assertEqual(l[10], 10)
+        self.assertEqual(l[-1], 11)
+        self.assertEqual(l[-12], 0)
+        self.assertRaises(IndexError, l.__getitem__, 12)
+        self.assertRaises(IndexError, l.__getitem__, -13)
+        self.assertEqual(l[8:10], [8, 9])
+        self.assertEqual(l[-3:], [9, 10, 11])
+        self.assertEqual(l[20:], [])
+
+        # integer keys keep their order past 10 items, unlike encoded keys
+        del l[:-3]
+        self.assertEqual(list(l), [9, 10, 11])
+        del l[1]
+        self.assertEqual(list(l), [9, 11])
+        l.append(12)
+        self.assertEqual(list(l), [9, 11, 12])
+
+    def test_maxlen(self):
+        l = self.list_class(maxlen=100)
+        l.extend(range(300000))
+        self.assertEqual(len(l), 100)
+        self.assertEqual(l[0], 299900)
+        self.assertEqual(l[-1], 299999)
+        for i in range(300000, 301000):
+            l.append(i)
+            self.assertEqual(len(l), 100)
+        self.assertEqual(list(l), list(range(300900, 301000)))
+
+    def test_upgrade_blob_keys(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        database = os.path.join(tmpdir, 'test.db')
+        conn = sqlite3.connect(database)
+        conn.execute("create table list (key blob primary key, value blob)")
+        for i in range(12):
+            conn.execute("insert into list values (?,?)",
+                         (encode(i), encode({'n': i})))
+        conn.commit()
+        conn.close()
+        l = self.list_class(database)
+        self.assertEqual([x['n'] for x in l], list(range(12)))
+        l.append({'n': 12})
+        self.assertEqual(l[-1], {'n': 12})
+
 
 class JsonSqliteDictTest(unittest.TestCase):
 
@@ -116,6 +173,83 @@ class JsonSqlitePriorityQueueTest(unittest.TestCase):
         self.failUnlessEqual(self.q.pop(), msg4)
         self.failUnlessEqual(self.q.pop(), msg1)
 
+    def test_put_many(self):
+        self.q.put_many([("message 1", 1.0), ("message 2", 5.0),
+                         ("message 3", 3.0)])
+        self.failUnlessEqual(len(self.q), 3)
+        self.failUnlessEqual(list(self.q),
+            [("message 2", 5.0), ("message 3", 3.0), ("message 1", 1.0)])
+
+    def test_priority_fifo(self):
+        for i in range(5):
+            self.q.put("low %d" % i, priority=1.0)
+            self.q.put("high %d" % i, priority=2.0)
+        out = [self.q.pop() for _ in range(10)]
+        self.failUnlessEqual(out, ["high %d" % i for i in range(5)] +
+                                  ["low %d" % i for i in range(5)])
+        self.failUnless(self.q.pop() is None)
+
+    def test_pop_without_returning(self):
+        self.q.put("message 1", priority=1.0)
+        self.q.put("message 2", priority=2.0)
+        self.q.put("message 3", priority=2.0)
+        self.failUnlessEqual(self.q._pop_immediate()[0], "message 2")
+        self.failUnlessEqual(self.q._pop_immediate()[0], "message 3")
+        self.failUnlessEqual(self.q._pop_immediate()[0], "message 1")
+        self.failUnless(self.q._pop_immediate() is None)
+
+    def test_pop_with_time(self):
+        self.q.put("message 1")
+        self.q.put_many([("message 2", 0.0), ("message 3", 0.0)])
+        msg, inserted = self.q.pop(with_time=True)
+        self.failUnlessEqual(msg, "message 1")
+        self.failUnless(abs(inserted - time.time()) < 60)
+        self.failUnlessEqual(self.q.pop(with_time=True)[1],
+                             self.q.pop(with_time=True)[1])
+        self.failUnless(self.q.pop(with_time=True) is None)
+
+    def test_pop_running(self):
+        self.q.put("a 1", priority=3.0, key="a")
+        self.q.put("b 1", priority=2.0, key="b", max_running=2)
+        self.q.put("c 1", priority=1.0, key="c")
+        self.q.put("a 2", priority=1.0, key="a", max_running=3)
+        running = {"a": (2, 2), "b": (2, None), "c": (5, None)}
+        self.failUnlessEqual(self.q.peek_priority(running), 1.0)
+        self.failUnlessEqual(self.q._pop_immediate(running)[0], "c 1")
+        self.failUnlessEqual(self.q.pop(running), "a 2")
+        self.failUnless(self.q.pop(running) is None)
+        self.failUnless(self.q.peek_priority(running) is None)
+        self.failUnlessEqual(len(self.q), 2)
+        self.failUnlessEqual(self.q.pop({"a": (1, 2)}), "a 1")
+
+    def test_pop_running_matches_next(self):
+        rnd = random.Random(0)
+        for i in range(300):
+            self.q.put("m %d" % i, priority=float(rnd.randint(0, 3)),
+                       key=rnd.choice(["a", "b", "c", None]),
+                       max_running=rnd.choice([None, None, 1, 2, 3]))
+        for _ in range(50):
+            running = dict((k, (rnd.randint(0, 3),
+                                rnd.choice([None, 1, 2, 3])))
+                           for k in rnd.sample(["a", "b", "c", "d"], 2))
+            cte, q, args = self.q._next('priority, id', running)
+            expected = self.q.conn.execute(cte + q, args).fetchone()
+            self.failUnlessEqual(self.q._head(running),
+                                 None if expected is None else tuple(expected))
+
+    def test_pop_running_skips_blocked(self):
+        self.q.put_many([("blocked", 1.0, "a")] * 5000 +
+                        [("blocked", 1.0, "b", 2)] * 5000 +
+                        [("next", 0.0, "c")])
+        steps = []
+        self.q.conn.set_progress_handler(lambda: steps.append(1), 100)
+        running = {"a": (2, 2), "b": (2, None)}
+        self.failUnlessEqual(self.q.peek_priority(running), 0.0)
+        self.q.conn.set_progress_handler(None, 0)
+        # reading the blocked messages would take tens of thousands of steps
+        self.failUnless(len(steps) < 20, len(steps))
+        self.failUnlessEqual(self.q.pop(running), "next")
+
     def test_iter_len_clear(self):
         self.failUnlessEqual(len(self.q), 0)
         self.failUnlessEqual(list(self.q), [])
@@ -134,6 +268,37 @@ class JsonSqlitePriorityQueueTest(unittest.TestCase):
         self.failUnlessEqual(len(self.q), 0)
         self.failUnlessEqual(list(self.q), [])
 
+    def test_slice_count(self):
+        for i in range(6):
+            self.q.put("message %d" % i, priority=i % 2, key="k%d" % (i % 3))
+        self.failUnlessEqual(self.q.slice(), list(self.q))
+        self.failUnlessEqual(self.q.slice(2, 2),
+                             [("message 5", 1), ("message 0", 0)])
+        self.failUnlessEqual(self.q.slice(key="k1"),
+                             [("message 1", 1), ("message 4", 0)])
+        self.failUnlessEqual(self.q.slice(1, key="k2"), [("message 2", 0)])
+        self.failUnlessEqual(self.q.count(), 6)
+        self.failUnlessEqual(self.q.count("k0"), 2)
+        self.failUnlessEqual(self.q.count("k3"), 0)
+
+    def test_iterate(self):
+        for i in range(7):
+            self.q.put("message %d" % i, priority=i % 2, key="k%d" % (i % 3))
+        for page_size in (1, 2, 3, 7, 10):
+            self.failUnlessEqual(list(self.q.iterate(page_size=page_size)),
+                                 self.q.slice())
+            self.failUnlessEqual(list(self.q.iterate("k0", page_size)),
+                                 self.q.slice(key="k0"))
+        # the messages popped while iterating are not listed again
+        it = self.q.iterate(page_size=2)
+        self.failUnlessEqual([next(it), next(it)],
+                             [("message 1", 1), ("message 3", 1)])
+        self.q.pop()
+        self.q.pop()
+        self.failUnlessEqual([m for m, p in it],
+                             ["message 5", "message 0", "message 2",
+                              "message 4", "message 6"])
+
     def test_remove(self):
         self.failUnlessEqual(len(self.q), 0)
         self.failUnlessEqual(list(self.q), [])
@@ -152,3 +317,117 @@ class JsonSqlitePriorityQueueTest(unittest.TestCase):
         for x in self.supported_values:
             self.q.put(x)
             self.failUnlessEqual(self.q.pop(), x)
+
+
+    def test_add_key_columns(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        database = os.path.join(tmpdir, 'queue.db')
+        conn = sqlite3.connect(database)
+        conn.execute("create table queue (id integer primary key, "
+                     "priority real key, message blob)")
+        conn.execute("insert into queue (priority, message) values (?, ?)",
+                     (1.0, sqlite3.Binary(b'{"name": "spider1"}')))
+        conn.commit()
+        conn.close()
+        q = JsonSqlitePriorityQueue(database)
+        self.failUnless(q.pop({"spider1": (1, 1)}) is None)
+        self.failUnlessEqual(q.pop(with_time=True), ({"name": "spider1"}, None))
+
+
+class JsonSqliteSharedPriorityQueueTest(JsonSqlitePriorityQueueTest):
+
+    queue_class = JsonSqliteSharedPriorityQueue
+
+    def test_shared_table(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        database = os.path.join(tmpdir, 'queue.db')
+        q1 = self.queue_class(database, queue='q1')
+        q2 = self.queue_class(database, queue='q2')
+        self.assertTrue(q1.conn is q2.conn)
+        self.assertTrue(q1.conn is get_connection(database))
+
+        q1.put("message 1", priority=1.0)
+        q2.put("message 2", priority=2.0)
+        q2.put("message 3", priority=3.0)
+        self.failUnlessEqual(len(q1), 1)
+        self.failUnlessEqual(list(q2), [("message 3", 3.0), ("message 2", 2.0)])
+        self.failUnlessEqual(q1.peek_priority(), 1.0)
+        self.failUnlessEqual(q1.pop(), "message 1")
+        self.failUnless(q1.pop() is None)
+        self.failUnlessEqual(q2.remove(lambda x: x.endswith("2")), 1)
+        q1.clear()
+        self.failUnlessEqual(list(q2), [("message 3", 3.0)])
+        q1.put("message 4", priority=4.0, key="k")
+        self.failUnlessEqual(q2.count("k"), 0)
+        self.failUnlessEqual(q2.slice(key="k"), [])
+        self.failUnlessEqual(q1.slice(key="k"), [("message 4", 4.0)])
+
+
+class SqliteConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.database = os.path.join(self.tmpdir, 'test.db')
+
+    def test_pragmas(self):
+        pragmas = {'journal_mode': 'wal', 'synchronous': 'normal',
+                   'cache_size': -4000}
+        d = JsonSqliteDict(self.database, pragmas=pragmas)
+        self.assertEqual(d.conn.execute("pragma journal_mode").fetchone()[0], 'wal')
+        self.assertEqual(d.conn.execute("pragma synchronous").fetchone()[0], 1)
+        self.assertEqual(d.conn.execute("pragma cache_size").fetchone()[0], -4000)
+        # connections are shared
+        l = JsonSqliteList(self.database)
+        self.assertTrue(l.conn is d.conn)
+
+    def test_conflicting_pragmas(self):
+        d = JsonSqliteDict(self.database, pragmas={'synchronous': 'normal'})
+        self.assertTrue(get_connection(self.database, {}) is d.conn)
+        self.assertRaises(ValueError, get_connection, self.database,
+                          {'synchronous': 'full'})
+
+    def test_release_connection(self):
+        q1 = JsonSqlitePriorityQueue(self.database)
+        q2 = JsonSqlitePriorityQueue(self.database)
+        q1.close()
+        q2.put("message")
+        self.assertEqual(len(q2), 1)
+        q2.close()
+        self.assertRaises(sqlite3.ProgrammingError, len, q2)
+        q3 = JsonSqlitePriorityQueue(self.database)
+        self.assertFalse(q3.conn is q2.conn)
+        self.assertEqual(len(q3), 1)
+        release_connection(q3.conn)
+
+    def test_group_commit(self):
+        d = JsonSqliteDict(self.database, group_commit=True)
+        clock = d.commit.clock = Clock()
+        other = sqlite3.connect(self.database)
+
+        def committed():
+            q = "select count(*) from %s" % d.table
+            return other.execute(q).fetchone()[0]
+
+        d['a'] = 1
+        d['b'] = 2
+        del d['a']
+        self.assertEqual(list(d.items()), [('b', 2)])
+        self.assertEqual(committed(), 0)
+        self.assertEqual(len(clock.getDelayedCalls()), 1)
+        clock.advance(0)
+        self.assertEqual(committed(), 1)
+        self.assertFalse(clock.getDelayedCalls())
+
+    def test_group_commit_flush(self):
+        conn = get_connection(self.database)
+        conn.execute("create table t (x)")
+        commit = GroupCommit(conn, clock=Clock())
+        conn.execute("insert into t values (1)")
+        commit()
+        self.assertTrue(conn.in_transaction)
+        commit.flush()
+        self.assertFalse(conn.in_transaction)
+        self.assertFalse(commit.clock.getDelayedCalls())
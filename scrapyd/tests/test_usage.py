@@ -0,0 +1,46 @@
+import json
+import os
+
+from twisted.trial import unittest
+
+from scrapyd.launcher import ScrapyProcessProtocol
+from scrapyd.runnerpool import STATUS_FD
+from scrapyd.usage import get_rusage, read_proc_usage, merge_usage, resource
+
+
+class UsageTest(unittest.TestCase):
+
+    def test_get_rusage(self):
+        if resource is None:
+            raise unittest.SkipTest("no resource module")
+        usage = get_rusage()
+        self.assertTrue(usage['max_rss'] > 1024 * 1024)
+        self.assertTrue(usage['cpu_user'] > 0)
+        usage = get_rusage(usage)
+        self.assertTrue(0 <= usage['cpu_user'] < 1)
+
+    def test_read_proc_usage(self):
+        if not os.path.exists('/proc/self/stat'):
+            raise unittest.SkipTest("no /proc")
+        usage = read_proc_usage(os.getpid())
+        self.assertTrue(usage['rss'] > 1024 * 1024)
+        self.assertTrue(usage['cpu_user'] > 0)
+        self.assertEqual(read_proc_usage(0, proc=self.mktemp()), None)
+
+    def test_merge_usage(self):
+        usage = merge_usage({}, {'cpu_user': 1.0, 'rss': 100})
+        usage = merge_usage(usage, {'cpu_user': 2.0, 'rss': 50})
+        self.assertEqual(usage, {'cpu_user': 2.0, 'max_rss': 100})
+        usage = merge_usage(usage, {'cpu_user': 2.5, 'max_rss': 80,
+                                    'block_in': 3})
+        self.assertEqual(usage, {'cpu_user': 2.5, 'max_rss': 100,
+                                 'block_in': 3})
+
+    def test_status_event(self):
+        pp = ScrapyProcessProtocol(0, 'p', 's', 0, 'job', {})
+        event = {'event': 'usage', 'time': 0, 'usage': {'cpu_user': 1.5,
+                                                         'max_rss': 2048}}
+        data = json.dumps(event).encode('ascii') + b'\n'
+        pp.childDataReceived(STATUS_FD, data[:10])
+        pp.childDataReceived(STATUS_FD, data[10:])
+        self.assertEqual(pp.usage, {'cpu_user': 1.5, 'max_rss': 2048})
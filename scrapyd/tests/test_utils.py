@@ -6,13 +6,25 @@ try:
 except ImportError:
     from io import BytesIO
 
+import json
+import shutil
+import sqlite3
+
 import six
 
+from twisted.internet.defer import Deferred, DeferredList, inlineCallbacks
 from twisted.trial import unittest
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
 
 from scrapy.utils.test import get_pythonpath
 from scrapyd.interfaces import IEggStorage
-from scrapyd.utils import get_crawl_args, get_spider_list, UtilsCache
+from scrapyd.utils import get_crawl_args, get_spider_list, get_spider_queues, \
+    get_spider_list_async, get_sqlite_pragmas, iterencode_json, JsonProducer, \
+    JsonResource, SpiderListIndex, UtilsCache
+from scrapyd.config import Config
+from scrapyd.eggstorage import ContentAddressedEggStorage
+from scrapyd.spiderqueue import SqliteSpiderQueue, SharedSqliteSpiderQueue
 from scrapyd import get_application
 
 def get_pythonpath_scrapyd():
@@ -36,6 +48,90 @@ class UtilsTest(unittest.TestCase):
         self.assertEqual(cargs, ['lala', '-a', 'arg1=val1', '-s', 'ONE=two'])
         assert all(isinstance(x, str) for x in cargs), cargs
 
+    def test_get_sqlite_pragmas(self):
+        self.assertEqual(get_sqlite_pragmas(Config(values={})), {})
+        config = Config(values={'sqlite_journal_mode': 'WAL',
+                                'sqlite_synchronous': 'normal',
+                                'sqlite_mmap_size': '268435456',
+                                'sqlite_cache_size': ''})
+        self.assertEqual(get_sqlite_pragmas(config), {
+            'journal_mode': 'wal', 'synchronous': 'normal',
+            'mmap_size': 268435456})
+        config = Config(values={'sqlite_journal_mode': 'wal; drop table x'})
+        self.assertRaises(ValueError, get_sqlite_pragmas, config)
+
+    def _queues_config(self, **values):
+        d = self.mktemp()
+        values['eggs_dir'] = os.path.join(d, 'eggs')
+        values['dbs_dir'] = os.path.join(d, 'dbs')
+        os.makedirs(os.path.join(values['eggs_dir'], 'mybot1'))
+        return Config(values=values)
+
+    def test_get_spider_queues(self):
+        config = self._queues_config()
+        queues = get_spider_queues(config)
+        self.assertEqual(list(queues), ['mybot1'])
+        self.assertTrue(isinstance(queues['mybot1'], SqliteSpiderQueue))
+
+        os.makedirs(os.path.join(config.get('eggs_dir'), 'mybot2'))
+        updated = get_spider_queues(config, queues)
+        self.assertEqual(sorted(updated), ['mybot1', 'mybot2'])
+        self.assertTrue(updated['mybot1'] is queues['mybot1'])
+
+        shutil.rmtree(os.path.join(config.get('eggs_dir'), 'mybot2'))
+        conn = updated['mybot2'].q.conn
+        self.assertEqual(list(get_spider_queues(config, updated)), ['mybot1'])
+        self.assertRaises(sqlite3.ProgrammingError, conn.execute, "select 1")
+
+    def test_get_shared_spider_queues(self):
+        config = self._queues_config(
+            spiderqueue='scrapyd.spiderqueue.SharedSqliteSpiderQueue')
+        os.makedirs(os.path.join(config.get('eggs_dir'), 'mybot2'))
+        queues = get_spider_queues(config)
+        q1, q2 = queues['mybot1'], queues['mybot2']
+        self.assertTrue(isinstance(q1, SharedSqliteSpiderQueue))
+        self.assertTrue(q1.q.conn is q2.q.conn)
+        self.assertEqual(os.listdir(config.get('dbs_dir')), ['spider_queue.db'])
+        q1.add('spider1')
+        self.assertEqual(q1.count(), 1)
+        self.assertEqual(q2.count(), 0)
+
+class JsonStreamingTest(unittest.TestCase):
+
+    obj = {'status': 'ok', 'jobs': [{'id': i, 'name': u'ara\xf1a'}
+                                    for i in range(5)]}
+
+    def test_iterencode_json(self):
+        text = ''.join(iterencode_json(self.obj))
+        self.assertTrue(text.endswith('\n'))
+        self.assertEqual(json.loads(text), self.obj)
+
+    def test_iterencode_json_iterators(self):
+        obj = {'jobs': (j for j in self.obj['jobs']), 'nested': iter([iter([1])])}
+        self.assertEqual(json.loads(''.join(iterencode_json(obj))),
+                         {'jobs': self.obj['jobs'], 'nested': [[1]]})
+
+    def test_producer(self):
+        request = DummyRequest([b''])
+        producer = JsonProducer(request, iterencode_json(self.obj))
+        producer.bufsize = 10
+        producer.start()
+        self.assertTrue(request.finished)
+        self.assertGreater(len(request.written), 1)
+        self.assertEqual(json.loads(b''.join(request.written).decode('utf-8')),
+                         self.obj)
+
+    def test_streaming_resource(self):
+        class Resource(JsonResource):
+            streaming = True
+            def render_GET(self, txrequest):
+                return {'jobs': iter(range(3))}
+        request = DummyRequest([b''])
+        self.assertEqual(Resource().render(request), NOT_DONE_YET)
+        self.assertEqual(json.loads(b''.join(request.written).decode('utf-8')),
+                         {'jobs': [0, 1, 2]})
+
+
 class GetSpiderListTest(unittest.TestCase):
     def setUp(self):
         path = os.path.abspath(self.mktemp())
@@ -46,6 +142,7 @@ class GetSpiderListTest(unittest.TestCase):
         os.makedirs(dbs_dir)
         logs_dir = j(path, 'logs')
         os.makedirs(logs_dir)
+        self.addCleanup(os.chdir, os.getcwd())
         os.chdir(path)
         with open('scrapyd.conf', 'w') as f:
             f.write("[scrapyd]\n")
@@ -98,6 +195,62 @@ class GetSpiderListTest(unittest.TestCase):
         spiders = get_spider_list('mybotunicode', pythonpath=get_pythonpath_scrapyd())
         self.assertEqual(sorted(spiders), [u'araña1', u'araña2'])
 
+    @inlineCallbacks
+    def test_get_spider_list_async(self):
+        self.add_test_version('mybot.egg', 'mybot', 'r1')
+        spiders = yield get_spider_list_async(
+            'mybot', pythonpath=get_pythonpath_scrapyd())
+        self.assertEqual(sorted(spiders), ['spider1', 'spider2'])
+
+    @inlineCallbacks
+    def test_spider_list_index(self):
+        config = Config()
+        eggstorage = self.app.getComponent(IEggStorage)
+        index = SpiderListIndex(config, eggstorage, get_pythonpath_scrapyd())
+        self.add_test_version('mybot.egg', 'mybot', 'r1')
+        spiders = yield index.add_version('mybot', 'r1')
+        self.assertEqual(sorted(spiders), ['spider1', 'spider2'])
+        self.add_test_version('mybot2.egg', 'mybot', 'r2')
+        spiders = yield index.add_version('mybot', 'r2')
+        self.assertEqual(sorted(spiders), ['spider1', 'spider2', 'spider3'])
+        # the same egg deployed as another version is not listed again
+        self.add_test_version('mybot.egg', 'mybot', 'r3')
+        index = SpiderListIndex(config, eggstorage)  # restart
+        index._list = lambda project, version: self.fail("egg listed twice")
+        spiders = yield index.add_version('mybot', 'r3')
+        self.assertEqual(sorted(spiders), ['spider1', 'spider2'])
+        spiders = yield index.get('mybot', 'r2')
+        self.assertEqual(sorted(spiders), ['spider1', 'spider2', 'spider3'])
+        # a known version is looked up without opening its egg
+        eggstorage.get = lambda *a: self.fail("egg opened")
+        spiders = yield index.get('mybot')
+        self.assertEqual(sorted(spiders), ['spider1', 'spider2'])
+
+    @inlineCallbacks
+    def test_spider_list_index_shared_lookup(self):
+        config = Config(values={'eggs_dir': self.mktemp(),
+                                'dbs_dir': self.mktemp()})
+        os.makedirs(config.get('dbs_dir'))
+        eggstorage = ContentAddressedEggStorage(config)
+        with open(os.path.join(os.path.dirname(__file__), 'mybot.egg'),
+                  'rb') as f:
+            eggstorage.put(f, 'mybot', 'r1')
+        index = SpiderListIndex(config, eggstorage)
+        # the hash computed by the egg storage is reused
+        eggstorage.get = lambda *a: self.fail("egg opened")
+        listed = []
+        def list_spiders(project, version):
+            listed.append(version)
+            return d
+        d = Deferred()
+        index._list = list_spiders
+        d1, d2 = index.get('mybot'), index.add_version('mybot', 'r1')
+        self.assertEqual(listed, ['r1'])
+        d.callback(['spider1'])
+        spiders = yield DeferredList([d1, d2])
+        self.assertEqual(spiders, [(True, ['spider1']), (True, ['spider1'])])
+        self.assertEqual(index.listing, {})
+
     def test_failed_spider_list(self):
         self.add_test_version('mybot3.egg', 'mybot3', 'r1')
         pypath = get_pythonpath_scrapyd()
@@ -0,0 +1,308 @@
+import json
+import os
+from io import BytesIO
+from datetime import datetime, timedelta
+
+from twisted.internet import defer, task
+from twisted.internet.error import ConnectionDone
+from twisted.python.failure import Failure
+from twisted.trial import unittest
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
+
+from scrapyd.app import application
+from scrapyd.config import Config
+from scrapyd.jobfiles import compress_file
+from scrapyd.logtail import LogFollowers
+from scrapyd.webservice import (DaemonStatus, ListJobs, LogTail, Metrics,
+                                ScheduleBatch, WatchJobs)
+from scrapyd.website import Root
+
+
+def request(**args):
+    r = DummyRequest([b''])
+    r.args = dict((k.encode('ascii'), [str(v).encode('ascii')])
+                  for k, v in args.items())
+    return r
+
+
+class ScheduleBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        d = os.path.abspath(self.mktemp())
+        for project in ('p1', 'p2'):
+            os.makedirs(os.path.join(d, 'eggs', project))
+        config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                                'dbs_dir': os.path.join(d, 'dbs'),
+                                'logs_dir': '', 'items_dir': '',
+                                'runner': 'scrapyd.runner'})
+        self.root = Root(config, application(config))
+        self.root.spiderlists.get = lambda project, version='': \
+            defer.succeed(['s1', 's2'])
+        self.batch = ScheduleBatch(self.root)
+
+    def post(self, specs):
+        r = DummyRequest([b''])
+        r.content = BytesIO(json.dumps(specs).encode('utf-8'))
+        return self.batch.render_POST(r)
+
+    @defer.inlineCallbacks
+    def test_schedule(self):
+        r = yield self.post([
+            {'project': 'p1', 'spider': 's1', 'arg': 1},
+            {'project': 'p2', 'spider': 's2', 'priority': 2,
+             'settings': {'DOWNLOAD_DELAY': 2}}])
+        self.assertEqual(r['status'], 'ok')
+        self.assertEqual(len(r['jobids']), 2)
+        msg = self.root.scheduler.queues['p1'].pop()
+        self.assertEqual((msg['name'], msg['arg'], msg['_job']),
+                         ('s1', '1', r['jobids'][0]))
+        msg = self.root.scheduler.queues['p2'].pop()
+        self.assertEqual(msg['settings'], {'DOWNLOAD_DELAY': '2'})
+
+    @defer.inlineCallbacks
+    def test_invalid(self):
+        valid = {'project': 'p1', 'spider': 's1'}
+        for spec, message in [
+                (['p1', 's1'], "job 1: not a JSON object"),
+                ({'project': 'p1'}, "job 1: missing 'spider'"),
+                ({'spider': 's1'}, "job 1: missing 'project'"),
+                ({'project': 'p3', 'spider': 's1'},
+                 "job 1: project 'p3' not found"),
+                ({'project': 'p1', 'spider': 's3'},
+                 "job 1: spider 's3' not found"),
+                (dict(valid, priority='high'),
+                 "job 1: invalid priority 'high'"),
+                (dict(valid, settings=['A=1']),
+                 "job 1: 'settings' is not a JSON object")]:
+            r = yield self.post([valid, spec])
+            self.assertEqual(r, {'node_name': self.root.nodename,
+                                 'status': 'error', 'message': message})
+        # nothing was scheduled
+        self.assertEqual(self.root.scheduler.queues['p1'].count(), 0)
+
+
+class WatchJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        d = os.path.abspath(self.mktemp())
+        for project in ('p1', 'p2'):
+            os.makedirs(os.path.join(d, 'eggs', project))
+        config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                                'dbs_dir': os.path.join(d, 'dbs'),
+                                'logs_dir': os.path.join(d, 'logs'),
+                                'items_dir': '', 'runner': 'scrapyd.runner'})
+        self.root = Root(config, application(config))
+        self.watch = WatchJobs(self.root)
+
+    @defer.inlineCallbacks
+    def test_watch(self):
+        r = yield self.watch.render_GET(request())
+        self.assertEqual((r['seq'], r['events']), (0, []))
+
+        self.root.scheduler.schedule('p1', 's1', _job='j1')
+        r = yield self.watch.render_GET(request(since=0))
+        self.assertEqual(r['seq'], 1)
+        self.assertEqual(r['events'], [{
+            'seq': 1, 'section': 'pending', 'action': 'add',
+            'job': {'project': 'p1', 'spider': 's1', 'id': 'j1'}}])
+
+        # waits for the changes of the project
+        d = self.watch.render_GET(request(since=1, project='p2'))
+        self.root.scheduler.schedule('p1', 's1', _job='j2')
+        self.assertNoResult(d)
+        self.root.scheduler.schedule('p2', 's1', _job='j3')
+        r = yield d
+        self.assertEqual(r['seq'], 3)
+        self.assertEqual([e['job']['id'] for e in r['events']], ['j3'])
+
+        r = yield self.watch.render_GET(request(since=3, timeout=0))
+        self.assertEqual((r['seq'], r['events']), (3, []))
+
+    @defer.inlineCallbacks
+    def test_reset(self):
+        self.root.poller.events.events.clear()
+        self.root.scheduler.schedule('p1', 's1', _job='j1')
+        self.root.scheduler.schedule('p1', 's1', _job='j2')
+        self.root.poller.events.events.popleft()
+        r = yield self.watch.render_GET(request(since=0))
+        self.assertTrue(r['reset'])
+        self.assertEqual(r['seq'], 2)
+
+
+class ListJobsTest(unittest.TestCase):
+
+    start = datetime(2012, 9, 12, 10, 14, 3)
+
+    def setUp(self):
+        d = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(d, 'eggs', 'p1'))
+        config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                                'dbs_dir': os.path.join(d, 'dbs'),
+                                'logs_dir': os.path.join(d, 'logs'),
+                                'items_dir': '', 'runner': 'scrapyd.runner',
+                                'finished_days_to_keep': '0'})
+        self.root = Root(config, application(config))
+        self.listjobs = ListJobs(self.root)
+        self.listjobs.finished_limit = 3
+        for i in range(5):
+            self.root.launcher.finished.add({
+                'project': 'p1', 'spider': 's1', 'job': 'j%d' % i,
+                'start_time': self.start,
+                'end_time': self.start + timedelta(hours=i)})
+
+    def finished(self, **args):
+        r = self.listjobs.render_GET(request(project='p1', **args))
+        return [j['id'] for j in r['finished']], r.get('next_cursor')
+
+    def test_finished(self):
+        self.assertEqual(self.finished(), (['j2', 'j3', 'j4'], None))
+        jobs, cursor = self.finished(limit=2)
+        self.assertEqual(jobs, ['j0', 'j1'])
+        self.assertEqual(self.finished(cursor=cursor), (['j2', 'j3', 'j4'], 5))
+        self.assertEqual(self.finished(since='2012-09-12 11:00',
+                                       until='2012-09-12T13:14:03'),
+                         (['j1', 'j2'], None))
+        self.assertEqual(self.finished(since='2012-09-13'), ([], None))
+
+    def test_pending(self):
+        self.root.scheduler.schedule_many('p1', [
+            ('s%d' % (i % 2), 0, {'_job': 'p%d' % i}) for i in range(5)])
+        r = self.listjobs.render_GET(request(spider='s1'))
+        self.assertNotIsInstance(r['pending'], list)
+        self.assertEqual([j['id'] for j in r['pending']], ['p1', 'p3'])
+
+    def test_bad_time(self):
+        for since in ('yesterday', '2012-13-01', '12/09/2012'):
+            r = request(since=since)
+            body = self.listjobs.render_GET(r)
+            self.assertEqual(r.responseCode, 400)
+            self.assertEqual(body['status'], 'error')
+
+
+class FakeProcess(object):
+
+    def __init__(self, project, job, logfile):
+        self.project = project
+        self.job = job
+        self.logfile = logfile
+        self.end_time = None
+        self.output_closed = defer.Deferred()
+
+
+class LogTailTest(unittest.TestCase):
+
+    def setUp(self):
+        d = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(d, 'eggs', 'p1'))
+        self.logs = os.path.join(d, 'logs', 'p1', 's1')
+        os.makedirs(self.logs)
+        config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                                'dbs_dir': os.path.join(d, 'dbs'),
+                                'logs_dir': os.path.join(d, 'logs'),
+                                'items_dir': '', 'runner': 'scrapyd.runner'})
+        self.root = Root(config, application(config))
+        self.tail = LogTail(self.root)
+        self.clock = task.Clock()
+        self.tail.followers = LogFollowers(clock=self.clock, use_inotify=False)
+        self.addCleanup(self.tail.followers.stop)
+        self.data = b''.join(b'line %d\n' % i for i in range(1000))
+        for job in ('j1', 'j2'):
+            with open(os.path.join(self.logs, job + '.log'), 'wb') as f:
+                f.write(self.data)
+        compress_file(os.path.join(self.logs, 'j2.log'))
+
+    def events(self, **args):
+        r = request(**args)
+        r.requestHeaders.setRawHeaders(b'accept', [b'text/event-stream'])
+        self.assertEqual(self.tail.render(r), NOT_DONE_YET)
+        return r
+
+    def test_json(self):
+        for job in ('j1', 'j2'):
+            r = self.tail.render_GET(request(project='p1', job=job, limit=15))
+            self.assertEqual(r['lines'], ['line 999'])
+            self.assertEqual(r['offset'], len(self.data) - 9)
+            self.assertEqual(r['next'], len(self.data))
+            self.assertEqual(r['size'], len(self.data))
+            self.assertFalse(r['running'])
+
+            r = self.tail.render_GET(request(project='p1', job=job,
+                                             offset=7, limit=15))
+            self.assertEqual(r['lines'], ['line 1', 'line 2'])
+            self.assertEqual(r['next'], 21)
+        self.assertRaises(ValueError, self.tail.render_GET,
+                          request(project='p1', job='j3'))
+        self.assertRaises(ValueError, self.tail.render_GET,
+                          request(project='p1', job='../s1/j1'))
+        # glob patterns are matched literally
+        for job in ('j?', 'j[12]', '*'):
+            self.assertRaises(ValueError, self.tail.render_GET,
+                              request(project='p1', job=job))
+        self.assertRaises(ValueError, self.tail.render_GET,
+                          request(project='p1', spider='s?', job='j1'))
+        r = self.tail.render_GET(request(project='p1', spider='s1', job='j1'))
+        self.assertEqual(r['size'], len(self.data))
+
+    def test_events_finished(self):
+        r = self.events(project='p1', job='j2', offset=len(self.data) - 9)
+        self.assertEqual(b''.join(r.written),
+                         b'id: %d\ndata: line 999\n\nevent: end\ndata: \n\n'
+                         % len(self.data))
+        self.assertEqual(r.finished, 1)
+
+    def test_events_running(self):
+        path = os.path.join(self.logs, 'j1.log')
+        process = FakeProcess('p1', 'j1', path)
+        self.root.launcher.processes[0] = process
+        self.addCleanup(self.root.launcher.processes.clear)
+        r1 = self.events(project='p1', job='j1', offset=len(self.data) - 9)
+        r2 = self.events(project='p1', job='j1')
+        self.assertEqual(len(self.tail.followers.followers), 1)
+        self.assertEqual(len(b''.join(r2.written).split(b'\n\n')), 1001)
+        r2.processingFailed(Failure(ConnectionDone()))
+        self.assertEqual(len(self.tail.followers.followers[path].subscribers), 1)
+
+        with open(path, 'ab') as f:
+            f.write(b'line 1000\n')
+        process.end_time = 1
+        self.clock.advance(1)
+        self.assertEqual(r1.finished, 0)  # the output is being written
+        process.output_closed.callback(None)
+        self.clock.advance(1)
+        self.assertEqual(b''.join(r1.written),
+                         b'id: %d\ndata: line 999\n\n' % len(self.data) +
+                         b'id: %d\ndata: line 1000\n\n' % (len(self.data) + 10) +
+                         b'event: end\ndata: \n\n')
+        self.assertEqual(r1.finished, 1)
+        self.assertEqual(self.tail.followers.followers, {})
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        d = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(d, 'eggs', 'p1'))
+        config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                                'dbs_dir': os.path.join(d, 'dbs'),
+                                'logs_dir': os.path.join(d, 'logs'),
+                                'items_dir': '', 'runner': 'scrapyd.runner',
+                                'max_proc': '4'})
+        self.root = Root(config, application(config))
+
+    def test_metrics(self):
+        self.root.scheduler.schedule('p1', 's1', _job='j1')
+        self.root.poller.queues['p1'].pop()
+        DaemonStatus(self.root).render(request())
+        r = request()
+        body = Metrics(self.root).render(r).decode('utf-8')
+        self.assertEqual(r.responseHeaders.getRawHeaders(b'content-type'),
+                         [b'text/plain; version=0.0.4'])
+        lines = body.splitlines()
+        self.assertIn('scrapyd_slots_max 4', lines)
+        self.assertIn('scrapyd_slots{state="running"} 0', lines)
+        for sample in ('scrapyd_queue_operation_seconds_count{operation="put"}',
+                       'scrapyd_queue_operation_seconds_count{operation="pop"}',
+                       'scrapyd_request_seconds_count{endpoint="DaemonStatus"}'):
+            self.assertTrue([x for x in lines if x.startswith(sample + ' ')],
+                            sample)
@@ -0,0 +1,159 @@
+import gzip
+import os
+import re
+import sqlite3
+from io import BytesIO
+
+from twisted.trial import unittest
+from twisted.web.resource import getChildForRequest
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
+
+from scrapyd.app import application
+from scrapyd.config import Config
+from scrapyd.jobfiles import compress_file
+from scrapyd.website import JobFile, Root
+
+
+def get(resource, **args):
+    request = DummyRequest([b''])
+    request.args = dict((k.encode('ascii'), [str(v).encode('ascii')])
+                        for k, v in args.items())
+    body = resource.render(request)
+    return request.responseCode or 200, body.decode('utf-8')
+
+
+class JobsTest(unittest.TestCase):
+
+    def setUp(self):
+        d = os.path.abspath(self.mktemp())
+        for project in ('p1', 'p2'):
+            os.makedirs(os.path.join(d, 'eggs', project))
+        config = Config(values={'eggs_dir': os.path.join(d, 'eggs'),
+                                'dbs_dir': os.path.join(d, 'dbs'),
+                                'logs_dir': os.path.join(d, 'logs'),
+                                'items_dir': '', 'runner': 'scrapyd.runner'})
+        self.root = Root(config, application(config))
+        self.jobs = self.root.children[b'jobs']
+        self.jobs.page_size = 10
+        for project in ('p1', 'p2'):
+            self.root.scheduler.schedule_many(project, [
+                ('s%d' % (i % 2), 0, {'_job': '%s-%d' % (project, i)})
+                for i in range(12)])
+
+    def job_ids(self, body):
+        return re.findall(r'name="job" value="([^"]+)"', body)
+
+    def test_pages(self):
+        code, body = get(self.jobs)
+        self.assertEqual(code, 200)
+        self.assertIn('Pending (24)', body)
+        self.assertEqual(self.job_ids(body), ['p1-%d' % i for i in range(10)])
+        self.assertIn('1-10 of 24 <a href="/jobs?pending=10">Next</a>', body)
+
+        code, body = get(self.jobs, section='pending', pending=10)
+        self.assertTrue(body.startswith('<tbody id="pending">'))
+        self.assertEqual(self.job_ids(body),
+                         ['p1-10', 'p1-11'] + ['p2-%d' % i for i in range(8)])
+
+        code, body = get(self.jobs, section='pending', project='p2',
+                         spider='s1', limit=4, pending=4)
+        self.assertEqual(self.job_ids(body), ['p2-9', 'p2-11'])
+        self.assertIn('5-6 of 6 <a href="/jobs?project=p2&amp;spider=s1&amp;'
+                      'limit=4">Previous</a>', body)
+
+    def test_cache(self):
+        get(self.jobs)
+        queue = self.root.poller.queues['p1']
+        # a cached page doesn't query the queues
+        queue.count = lambda spider=None: self.fail("queue counted")
+        self.assertIn('p1-0', get(self.jobs)[1])
+        del queue.count
+        # changed by another process, the queue version tells
+        conn = sqlite3.connect(queue.database)
+        conn.execute("delete from spider_queue where id = "
+                     "(select min(id) from spider_queue)")
+        conn.commit()
+        conn.close()
+        self.assertNotIn('p1-0', get(self.jobs)[1])
+        self.root.scheduler.schedule('p1', 's0', _job='p1-12')
+        self.assertIn('Pending (24)', get(self.jobs)[1])
+        self.assertIn('p1-12', get(self.jobs, section='pending', pending=10)[1])
+        self.assertTrue(len(self.jobs.cache) <= self.jobs.cache_size)
+
+    def test_bad_arguments(self):
+        self.assertEqual(get(self.jobs, section='other')[0], 400)
+        self.assertEqual(get(self.jobs, limit='x')[0], 400)
+        self.assertEqual(get(self.jobs, limit=0)[0], 400)
+
+    def test_bad_arguments_not_html(self):
+        request = DummyRequest([b''])
+        request.args = {b'section': [b'<script>alert(1)</script>']}
+        self.jobs.render(request)
+        self.assertEqual(request.responseCode, 400)
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'content-type'),
+                         [b'text/plain; charset=utf-8'])
+
+
+class JobFileTest(unittest.TestCase):
+
+    data = b''.join(b'line %d\n' % i for i in range(20000))
+
+    def setUp(self):
+        self.dir = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(self.dir, 'p', 's'))
+        for job in ('running', 'finished'):
+            with open(os.path.join(self.dir, 'p', 's', job + '.log'), 'wb') as f:
+                f.write(self.data)
+        compress_file(os.path.join(self.dir, 'p', 's', 'finished.log'))
+        self.resource = JobFile(self.dir)
+
+    def get(self, job, headers={}, **args):
+        request = DummyRequest([b'p', b's', job.encode('ascii') + b'.log'])
+        request.args = dict((k.encode('ascii'), [str(v).encode('ascii')])
+                            for k, v in args.items())
+        for name, value in headers.items():
+            request.requestHeaders.setRawHeaders(name, [value])
+        child = getChildForRequest(self.resource, request)
+        result = child.render(request)
+        if result != NOT_DONE_YET:
+            request.write(result)
+        return request, b''.join(request.written)
+
+    def header(self, request, name):
+        return request.responseHeaders.getRawHeaders(name, [None])[0]
+
+    def test_plain(self):
+        request, body = self.get('running')
+        self.assertEqual(body, self.data)
+        self.assertIdentical(self.header(request, b'content-encoding'), None)
+        request, body = self.get('running', tail=2)
+        self.assertEqual(body, b'line 19998\nline 19999\n')
+
+    def test_passthrough(self):
+        request, body = self.get('finished', {b'accept-encoding': b'gzip, deflate'})
+        self.assertEqual(self.header(request, b'content-encoding'), b'gzip')
+        self.assertEqual(self.header(request, b'vary'), b'Accept-Encoding')
+        self.assertEqual(gzip.GzipFile(fileobj=BytesIO(body)).read(), self.data)
+
+    def test_decompress(self):
+        request, body = self.get('finished', {b'accept-encoding': b'gzip;q=0'})
+        self.assertIdentical(self.header(request, b'content-encoding'), None)
+        self.assertEqual(self.header(request, b'content-type'), b'text/plain')
+        self.assertEqual(self.header(request, b'content-length'),
+                         str(len(self.data)).encode('ascii'))
+        self.assertEqual(body, self.data)
+
+    def test_range(self):
+        request, body = self.get('finished', {b'accept-encoding': b'gzip',
+                                              b'range': b'bytes=100000-100009'})
+        self.assertEqual(request.responseCode, 206)
+        self.assertEqual(self.header(request, b'content-range'),
+                         b'bytes 100000-100009/%d' % len(self.data))
+        self.assertEqual(body, self.data[100000:100010])
+
+    def test_tail(self):
+        request, body = self.get('finished', {b'accept-encoding': b'gzip'},
+                                 tail=3)
+        self.assertEqual(body, b'line 19997\nline 19998\nline 19999\n')
+        self.assertEqual(self.get('finished', tail='x')[0].responseCode, 400)
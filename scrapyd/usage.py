@@ -0,0 +1,75 @@
+"""Resources used by the job processes: the rusage reported by the runner
+when it exits, and the samples the launcher reads from /proc while it runs.
+"""
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+RUSAGE_FIELDS = [
+    ('cpu_user', 'ru_utime'),
+    ('cpu_system', 'ru_stime'),
+    ('block_in', 'ru_inblock'),
+    ('block_out', 'ru_oublock'),
+    ('ctx_voluntary', 'ru_nvcsw'),
+    ('ctx_involuntary', 'ru_nivcsw'),
+]
+
+
+def get_rusage(base=None):
+    """Return the resources used by this process and its waited for children,
+    minus those of `base`, a dict returned by a previous call, if given. The
+    max_rss field is the peak resident set size in bytes. Return None if
+    unknown."""
+    if resource is None:
+        return None
+    usage = {}
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        ru = resource.getrusage(who)
+        for name, attr in RUSAGE_FIELDS:
+            usage[name] = usage.get(name, 0) + getattr(ru, attr)
+        # kilobytes on Linux, bytes on macOS
+        max_rss = ru.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+        usage['max_rss'] = max(usage.get('max_rss', 0), max_rss)
+    for name, _ in RUSAGE_FIELDS:
+        usage[name] -= (base or {}).get(name, 0)
+    return usage
+
+
+def read_proc_usage(pid, proc='/proc'):
+    """Return the cpu time, resident set size and I/O bytes of a running
+    process from /proc, or None if unknown"""
+    usage = {}
+    try:
+        with open(os.path.join(proc, str(pid), 'stat')) as f:
+            # the command name may contain spaces, the fields follow it
+            fields = f.read().rsplit(')', 1)[1].split()
+        ticks = float(os.sysconf('SC_CLK_TCK'))
+        usage['cpu_user'] = int(fields[11]) / ticks
+        usage['cpu_system'] = int(fields[12]) / ticks
+        usage['rss'] = int(fields[21]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, IndexError, ValueError):
+        return None
+    try:
+        with open(os.path.join(proc, str(pid), 'io')) as f:
+            io = dict(line.split(':', 1) for line in f)
+        usage['read_bytes'] = int(io['read_bytes'])
+        usage['write_bytes'] = int(io['write_bytes'])
+    except (IOError, OSError, KeyError, ValueError):
+        pass  # needs the same user and I/O accounting in the kernel
+    return usage
+
+
+def merge_usage(usage, update):
+    """Merge the `update` rusage or /proc sample into the `usage` of a job,
+    keeping the peak resident set size"""
+    update = dict(update)
+    max_rss = max(usage.get('max_rss', 0), update.pop('rss', 0),
+                  update.get('max_rss', 0))
+    usage.update(update)
+    if max_rss:
+        usage['max_rss'] = max_rss
+    return usage
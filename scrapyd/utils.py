@@ -1,34 +1,144 @@
 import sys
 import os
-from .sqlite import JsonSqliteDict
+from .sqlite import JsonSqliteDict, JOURNAL_MODES, SYNCHRONOUS
 from subprocess import Popen, PIPE
 import six
 from six import iteritems
 from six.moves.configparser import NoSectionError
+import hashlib
 import json
-from twisted.web import resource
+import types
+from itertools import islice
+from zope.interface import implementer
+from twisted.internet import threads
+from twisted.internet.defer import Deferred, succeed
+from twisted.internet.interfaces import IPullProducer
+from twisted.internet.utils import getProcessOutputAndValue
+from twisted.python import log
+from twisted.web import resource, server
+
+from scrapy.utils.misc import load_object
 
-from scrapyd.spiderqueue import SqliteSpiderQueue
 from scrapyd.config import Config
+from scrapyd.metrics import SPIDER_LIST_LOOKUPS, SPIDER_LIST_SECONDS, now
 
 
 class JsonResource(resource.Resource):
+    """Resource rendering the objects returned by its render_* methods as
+    JSON. If `streaming` is true, the JSON document is written in chunks
+    with chunked transfer encoding instead of being built in memory."""
 
     json_encoder = json.JSONEncoder()
+    streaming = False
 
     def render(self, txrequest):
         r = resource.Resource.render(self, txrequest)
         return self.render_object(r, txrequest)
 
     def render_object(self, obj, txrequest):
-        r = self.json_encoder.encode(obj) + "\n"
         txrequest.setHeader('Content-Type', 'application/json')
         txrequest.setHeader('Access-Control-Allow-Origin', '*')
         txrequest.setHeader('Access-Control-Allow-Methods', 'GET, POST, PATCH, PUT, DELETE')
         txrequest.setHeader('Access-Control-Allow-Headers',' X-Requested-With')
+        if self.streaming:
+            chunks = iterencode_json(obj, self.json_encoder)
+            JsonProducer(txrequest, chunks).start()
+            return server.NOT_DONE_YET
+        r = (self.json_encoder.encode(obj) + "\n").encode('utf-8')
         txrequest.setHeader('Content-Length', str(len(r)))
         return r
 
+
+def _is_iterator(obj):
+    return isinstance(obj, types.GeneratorType) or \
+        (hasattr(obj, '__next__' if six.PY3 else 'next') and
+         not isinstance(obj, (six.string_types, bytes)))
+
+
+def iterencode_json(obj, encoder=JsonResource.json_encoder):
+    """Encode `obj` as JSON in small chunks, followed by a newline.
+
+    The dicts are written a member at a time and the arrays a few members at
+    a time, and generators or other iterators are encoded as arrays,
+    consuming them lazily. Other objects are encoded in one go.
+    """
+    for chunk in _iterencode(obj, encoder):
+        yield chunk
+    yield "\n"
+
+
+def _iterencode(obj, encoder):
+    if isinstance(obj, dict):
+        yield '{'
+        for i, (key, value) in enumerate(iteritems(obj)):
+            yield '%s%s: ' % (', ' if i else '', encoder.encode(key))
+            for chunk in _iterencode(value, encoder):
+                yield chunk
+        yield '}'
+    elif isinstance(obj, (list, tuple)) or _is_iterator(obj):
+        yield '['
+        it, sep = iter(obj), ''
+        while True:
+            # Encode the members in batches to limit the per-call overhead
+            batch = list(islice(it, 256))
+            if not batch:
+                break
+            if any(_is_iterator(item) for item in batch):
+                for item in batch:
+                    yield sep
+                    sep = ', '
+                    for chunk in _iterencode(item, encoder):
+                        yield chunk
+            else:
+                yield sep + encoder.encode(batch)[1:-1]
+                sep = ', '
+        yield ']'
+    else:
+        yield encoder.encode(obj)
+
+
+@implementer(IPullProducer)
+class JsonProducer(object):
+    """Pull producer writing the text chunks of `chunks` to a request,
+    grouped in writes of about `bufsize` characters, and then finishing it.
+    """
+
+    bufsize = 2 ** 16
+
+    def __init__(self, request, chunks):
+        self.request = request
+        self.chunks = iter(chunks)
+
+    def start(self):
+        self.request.registerProducer(self, False)
+
+    def resumeProducing(self):
+        if self.request is None:
+            return
+        buf, size, done = [], 0, True
+        try:
+            for chunk in self.chunks:
+                buf.append(chunk)
+                size += len(chunk)
+                if size >= self.bufsize:
+                    done = False
+                    break
+        except Exception:
+            log.err(None, "Error while streaming a JSON response")
+            request, self.request = self.request, None
+            request.unregisterProducer()
+            request.loseConnection()
+            return
+        if buf:
+            self.request.write(''.join(buf).encode('utf-8'))
+        if done:
+            request, self.request = self.request, None
+            request.unregisterProducer()
+            request.finish()
+
+    def stopProducing(self):
+        self.request = None
+
 class UtilsCache:
     # array of project name that need to be invalided
     invalid_cached_projects = []
@@ -51,17 +161,47 @@ class UtilsCache:
     def __setitem__(self, key, value):
         self.cache_manager[key] = value
 
-def get_spider_queues(config):
-    """Return a dict of Spider Queues keyed by project name"""
+def get_spider_queues(config, queues=None):
+    """Return a dict of Spider Queues keyed by project name. The queues found
+    in `queues` (a dict returned by a previous call) are reused, and those of
+    the projects that no longer exist are closed"""
     dbsdir = config.get('dbs_dir', 'dbs')
     if not os.path.exists(dbsdir):
         os.makedirs(dbsdir)
+    queuecls = load_object(config.get('spiderqueue',
+                                      'scrapyd.spiderqueue.SqliteSpiderQueue'))
+    queues = queues or {}
     d = {}
     for project in get_project_list(config):
-        dbpath = os.path.join(dbsdir, '%s.db' % project)
-        d[project] = SqliteSpiderQueue(dbpath)
+        if project in queues:
+            d[project] = queues[project]
+        else:
+            d[project] = queuecls.from_config(config, project)
+    for project, queue in queues.items():
+        if project not in d and hasattr(queue, 'close'):
+            queue.close()
     return d
 
+def get_sqlite_pragmas(config):
+    """Return the PRAGMA statements to run on the SQLite connections, from the
+    sqlite_* options of the config"""
+    pragmas = {}
+    journal_mode = config.get('sqlite_journal_mode', '').lower()
+    if journal_mode:
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError("Invalid sqlite_journal_mode: %r" % journal_mode)
+        pragmas['journal_mode'] = journal_mode
+    synchronous = config.get('sqlite_synchronous', '').lower()
+    if synchronous:
+        if synchronous not in SYNCHRONOUS:
+            raise ValueError("Invalid sqlite_synchronous: %r" % synchronous)
+        pragmas['synchronous'] = synchronous
+    for option in ('mmap_size', 'cache_size'):
+        value = config.get('sqlite_%s' % option, '')
+        if value:
+            pragmas[option] = int(value)
+    return pragmas
+
 def get_project_list(config):
     """Get list of projects by inspecting the eggs dir and the ones defined in
     the scrapyd.conf [settings] section
@@ -70,7 +210,8 @@ def get_project_list(config):
     projects = []
     if os.path.exists(eggs_dir):
         projects.extend(d for d in os.listdir(eggs_dir)
-                        if os.path.isdir('%s/%s' % (eggs_dir, d)))
+                        if not d.startswith('.')
+                        and os.path.isdir('%s/%s' % (eggs_dir, d)))
     projects.extend(x[0] for x in config.items('settings', default=[]))
     return projects
 
@@ -113,9 +254,34 @@ def get_spider_list(project, runner=None, pythonpath=None, version=''):
     if "cache" not in get_spider_list.__dict__:
         get_spider_list.cache = UtilsCache()
     try:
-        return get_spider_list.cache[project][version]
+        spiders = get_spider_list.cache[project][version]
+        SPIDER_LIST_LOOKUPS.inc(('hit',))
+        return spiders
     except KeyError:
-        pass
+        SPIDER_LIST_LOOKUPS.inc(('miss',))
+    pargs, env = _spider_list_command(project, runner, pythonpath, version)
+    start = now()
+    proc = Popen(pargs, stdout=PIPE, stderr=PIPE, env=env)
+    out, err = proc.communicate()
+    SPIDER_LIST_SECONDS.time(start)
+    tmp = _parse_spider_list(out, err, proc.returncode)
+    try:
+        project_cache = get_spider_list.cache[project]
+        project_cache[version] = tmp
+    except KeyError:
+        project_cache = {version: tmp}
+    get_spider_list.cache[project] = project_cache
+    return tmp
+
+def get_spider_list_async(project, runner=None, pythonpath=None, version=''):
+    """Like get_spider_list, but return a Deferred instead of blocking until
+    the runner exits, and don't cache the result"""
+    pargs, env = _spider_list_command(project, runner, pythonpath, version)
+    d = getProcessOutputAndValue(pargs[0], pargs[1:], env=env)
+    d.addCallback(lambda r: _parse_spider_list(*r))
+    return d
+
+def _spider_list_command(project, runner, pythonpath, version):
     if runner is None:
         runner = Config().get('runner')
     env = os.environ.copy()
@@ -125,23 +291,144 @@ def get_spider_list(project, runner=None, pythonpath=None, version=''):
         env['PYTHONPATH'] = pythonpath
     if version:
         env['SCRAPY_EGG_VERSION'] = version
-    pargs = [sys.executable, '-m', runner, 'list']
-    proc = Popen(pargs, stdout=PIPE, stderr=PIPE, env=env)
-    out, err = proc.communicate()
-    if proc.returncode:
-        msg = err or out or ''
+    return [sys.executable, '-m', runner, 'list'], env
+
+def _parse_spider_list(out, err, returncode):
+    if returncode:
+        msg = err or out or b''
         msg = msg.decode('utf8')
         raise RuntimeError(msg.encode('unicode_escape') if six.PY2 else msg)
     # FIXME: can we reliably decode as UTF-8?
     # scrapy list does `print(list)`
-    tmp = out.decode('utf-8').splitlines();
+    return out.decode('utf-8').splitlines()
+
+
+class SpiderListIndex(object):
+    """Persistent index of the spider lists of the deployed eggs.
+
+    The spider lists are stored in ``dbs_dir`` keyed by the SHA-256 of the
+    egg they were listed from, so they are computed once per egg and survive
+    restarts, along with the hash of every project version. The hash is
+    taken from the egg storage if it has a digest() method, like
+    ContentAddressedEggStorage, or else computed in a thread. Lists that are
+    missing are computed by the runner in a subprocess without blocking, once
+    for all the requests waiting for them. Projects without eggs are only
+    cached in memory.
+    """
+
+    def __init__(self, config, eggstorage, pythonpath=None):
+        dbpath = os.path.join(config.get('dbs_dir', 'dbs'), 'spider_index.db')
+        pragmas = get_sqlite_pragmas(config)
+        self.spiders = JsonSqliteDict(dbpath, 'spider_lists', pragmas)
+        self.eggs = JsonSqliteDict(dbpath, 'egg_hashes', pragmas)
+        self.eggstorage = eggstorage
+        self.runner = config.get('runner', 'scrapyd.runner')
+        self.pythonpath = pythonpath
+        self.uncached = {}
+        self.listing = {}  # key -> Deferreds waiting for the list
+
+    def get(self, project, version=''):
+        """Return a Deferred firing the spider list of the given project
+        version, or of its latest version"""
+        d = self._egg_key(project, version or None)
+        d.addCallback(self._get, project)
+        return d
+
+    def _get(self, version_key, project):
+        version, key = version_key
+        if key is None:
+            version = version or ''
+            key, cache = (project, version), self.uncached
+        else:
+            cache = self.spiders
+        if key in cache:
+            SPIDER_LIST_LOOKUPS.inc(('hit',))
+            return cache[key]
+        if key in self.listing:
+            d = Deferred()
+            self.listing[key].append(d)
+            return d
+        self.listing[key] = []
+        d = self._list(project, version)
+        d.addCallback(self._cache, cache, key)
+        d.addBoth(self._listed, key)
+        return d
+
+    def add_version(self, project, version):
+        """Index a version that has just been added, return a Deferred firing
+        its spider list"""
+        self.invalidate(project, version)
+        return self.get(project, version)
+
+    def invalidate(self, project, version=None):
+        """Forget the eggs of the given project version, or of all its
+        versions"""
+        for p, v in list(self.eggs):
+            if p == project and version in (None, v):
+                del self.eggs[(p, v)]
+        for p, v in list(self.uncached):
+            if p == project:
+                del self.uncached[(p, v)]
+
+    def _egg_key(self, project, version):
+        """Return a Deferred firing the (version, hash) of the egg of the
+        given project version, or of its latest version. The egg is only read
+        if its hash is not known yet."""
+        if version is None:
+            versions = self.eggstorage.list(project)
+            if not versions:
+                return succeed((None, None))
+            version = versions[-1]
+        if (project, version) in self.eggs:
+            return succeed((version, self.eggs[(project, version)]))
+        digest = getattr(self.eggstorage, 'digest', None)
+        key = digest(project, version) if digest is not None else None
+        if key is not None:
+            self.eggs[(project, version)] = key
+            return succeed((version, key))
+        version, eggfile = self.eggstorage.get(project, version)
+        if eggfile is None:
+            return succeed((version, None))
+        d = threads.deferToThread(_sha256_file, eggfile)
+        d.addCallback(self._hashed, project, version)
+        return d
+
+    def _hashed(self, key, project, version):
+        self.eggs[(project, version)] = key
+        return version, key
+
+    def _listed(self, result, key):
+        for d in self.listing.pop(key):
+            d.callback(result)
+        return result
+
+    def _list(self, project, version):
+        SPIDER_LIST_LOOKUPS.inc(('miss',))
+        start = now()
+        d = get_spider_list_async(project, runner=self.runner,
+                                  pythonpath=self.pythonpath, version=version)
+        d.addBoth(_timed, SPIDER_LIST_SECONDS, start)
+        return d
+
+    def _cache(self, spiders, cache, key):
+        cache[key] = spiders
+        return spiders
+
+
+def _sha256_file(f):
+    """Return the SHA-256 of the file, and close it"""
     try:
-        project_cache = get_spider_list.cache[project]
-        project_cache[version] = tmp
-    except KeyError:
-        project_cache = {version: tmp}
-    get_spider_list.cache[project] = project_cache
-    return tmp
+        h = hashlib.sha256()
+        for chunk in iter(lambda: f.read(2 ** 16), b''):
+            h.update(chunk)
+        return h.hexdigest()
+    finally:
+        f.close()
+
+
+def _timed(result, histogram, start):
+    histogram.time(start)
+    return result
 
 
 def _to_native_str(text, encoding='utf-8', errors='strict'):
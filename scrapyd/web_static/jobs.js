@@ -0,0 +1,49 @@
+// Reload the sections of the jobs page whose jobs changed, waiting for the
+// changes with watchjobs.json instead of fetching the whole page again
+
+(function() {
+  var query = window.location.search.replace(/^\?/, '');
+  var filters = query.split('&').filter(function(arg) {
+    return /^(project|spider)=./.test(arg);
+  }).join('&');
+
+  function get(url, callback, error) {
+    var xhr = new XMLHttpRequest();
+    xhr.open('GET', url);
+    xhr.onload = function() {
+      if (xhr.status == 200) {
+        callback(xhr.responseText);
+      } else {
+        error();
+      }
+    };
+    xhr.onerror = error;
+    xhr.send();
+  }
+
+  function reload(section) {
+    var url = '/jobs?section=' + section + (query ? '&' + query : '');
+    get(url, function(html) {
+      document.getElementById(section).outerHTML = html;
+    }, function() {});
+  }
+
+  function watch(seq) {
+    var url = '/watchjobs.json?since=' + seq + (filters ? '&' + filters : '');
+    get(url, function(text) {
+      var r = JSON.parse(text);
+      if (r.reset) {  // too many changes missed
+        window.location.reload();
+        return;
+      }
+      var sections = {};
+      r.events.forEach(function(e) { sections[e.section] = true; });
+      Object.keys(sections).forEach(reload);
+      watch(r.seq);
+    }, function() {
+      setTimeout(function() { watch(seq); }, 5000);
+    });
+  }
+
+  watch(document.getElementById('jobs').getAttribute('data-seq'));
+})();
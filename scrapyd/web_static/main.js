@@ -7,22 +7,24 @@ $(function() {
 });
 
 function createGraph() {
-    d3.json('/logstats_data?n=1000', function(data) {
+    d3.json('/logstats_data' + window.location.search, function(data) {
         nv.addGraph(function() {
             chart = nv.models.lineChart().options({
                 duration: 300,
                 useInteractiveGuideline: true
             });
 
-            chart.xAxis.axisLabel("Time (s)")
-                        .tickFormat(d3.format(",.1f"))
+            chart.xAxis.axisLabel("Job end time")
+                        .tickFormat(function(d) {
+                            return d3.time.format('%Y-%m-%d %H:%M')(new Date(d));
+                        })
                         .staggerLabels(true);
-            chart.yAxis.axisLabel("Voltage (V)")
+            chart.yAxis.axisLabel("Count")
                 .tickFormat(function(d) {
                     if (d == null) {
                         return 'N/A';
                     }
-                    return d3.format(',.2f')(d);
+                    return d3.format(',d')(d);
                 });
             d3.select('#chart1').append('svg')
                 .datum(data)
@@ -1,14 +1,24 @@
 from copy import copy
-import traceback
+from datetime import datetime
+import json
+import os
+import time
 import uuid
-try:
-    from cStringIO import StringIO as BytesIO
-except ImportError:
-    from io import BytesIO
 
+import six
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
 from twisted.python import log
+from twisted.python.failure import Failure
+from twisted.web import resource
+from twisted.web.server import NOT_DONE_YET
 
-from .utils import get_spider_list, JsonResource, UtilsCache, native_stringify_dict
+from .utils import JsonResource, UtilsCache, native_stringify_dict
+from .multipart import read_form
+from .jobevents import pending_job, running_job, finished_job
+from .interfaces import IEnvironment
+from .jobfiles import open_compressed
+from .logtail import EventStream, LogFollowers
+from . import metrics
 
 class WsResource(JsonResource):
 
@@ -17,14 +27,43 @@ class WsResource(JsonResource):
         self.root = root
 
     def render(self, txrequest):
+        start = metrics.now()
+        endpoint = txrequest.prepath[-1].decode('utf-8', 'replace') \
+            if txrequest.prepath else type(self).__name__
         try:
-            return JsonResource.render(self, txrequest).encode('utf-8')
-        except Exception as e:
-            if self.root.debug:
-                return traceback.format_exc().encode('utf-8')
-            log.err()
-            r = {"node_name": self.root.nodename, "status": "error", "message": str(e)}
-            return self.render_object(r, txrequest).encode('utf-8')
+            r = resource.Resource.render(self, txrequest)
+        except Exception:
+            body = self.render_error(Failure(), txrequest)
+            metrics.REQUEST_SECONDS.time(start, (endpoint,))
+            return body
+        if isinstance(r, Deferred):
+            finished = []
+            txrequest.notifyFinish().addBoth(finished.append)
+            r.addCallbacks(self._render_deferred, self._render_deferred,
+                           callbackArgs=(self.render_object, txrequest, finished),
+                           errbackArgs=(self.render_error, txrequest, finished))
+            r.addErrback(log.err)
+            r.addBoth(lambda _: metrics.REQUEST_SECONDS.time(start, (endpoint,)))
+            return NOT_DONE_YET
+        body = self.render_object(r, txrequest)
+        metrics.REQUEST_SECONDS.time(start, (endpoint,))
+        return body
+
+    def render_error(self, failure, txrequest):
+        if self.root.debug:
+            return failure.getTraceback().encode('utf-8')
+        log.err(failure)
+        r = {"node_name": self.root.nodename, "status": "error",
+             "message": str(failure.value)}
+        return self.render_object(r, txrequest)
+
+    def _render_deferred(self, result, render, txrequest, finished):
+        if finished:  # the connection was lost
+            return
+        body = render(result, txrequest)
+        if body is not NOT_DONE_YET:
+            txrequest.write(body)
+            txrequest.finish()
 
 class DaemonStatus(WsResource):
 
@@ -32,8 +71,11 @@ class DaemonStatus(WsResource):
         pending = sum(q.count() for q in self.root.poller.queues.values())
         running = len(self.root.launcher.processes)
         finished = len(self.root.launcher.finished)
+        startup_time = dict((k, total / jobs if jobs else None) for k, (jobs, total)
+                            in self.root.launcher.startup_times.items())
 
-        return {"node_name": self.root.nodename, "status":"ok", "pending": pending, "running": running, "finished": finished}
+        return {"node_name": self.root.nodename, "status":"ok", "pending": pending, "running": running, "finished": finished,
+                "startup_time": startup_time}
 
 
 class Schedule(WsResource):
@@ -47,23 +89,103 @@ class Schedule(WsResource):
         spider = args.pop('spider')
         version = args.get('_version', '')
         priority = float(args.pop('priority', 0))
-        spiders = get_spider_list(project, version=version)
+        d = self.root.spiderlists.get(project, version)
+        d.addCallback(self._schedule, project, spider, priority, args, settings)
+        return d
+
+    def _schedule(self, spiders, project, spider, priority, args, settings):
         if not spider in spiders:
             return {"status": "error", "message": "spider '%s' not found" % spider}
-        args['settings'] = settings
-        jobid = args.pop('jobid', uuid.uuid1().hex)
-        args['_job'] = jobid
-        count = 0
-        try:
-            count = int(args.get('count', 0))
-        except:
-            pass
-        if count == 0: count = 1
-        args['count'] = str(count)
-
+        jobid = _prepare_job_args(args, settings)
         self.root.scheduler.schedule(project, spider, priority=priority, **args)
         return {"node_name": self.root.nodename, "status": "ok", "jobid": jobid, "priority": priority, "args": args}
 
+class ScheduleBatch(WsResource):
+
+    @inlineCallbacks
+    def render_POST(self, txrequest):
+        specs = json.loads(txrequest.content.read().decode('utf-8'))
+        if not isinstance(specs, list):
+            raise ValueError("request body must be a JSON list of jobs")
+        jobs = []
+        projects = self.root.scheduler.list_projects()
+        for i, spec in enumerate(specs):
+            error = self._invalid(spec, projects)
+            if error:
+                returnValue(self._error("job %d: %s" % (i, error)))
+            args = dict((k, _to_text(v)) for k, v in spec.items()
+                        if k != 'settings')
+            settings = dict((k, _to_text(v)) for k, v in
+                            spec.get('settings', {}).items())
+            project = args.pop('project')
+            spider = args.pop('spider')
+            priority = float(args.pop('priority', 0))
+            jobs.append((project, spider, priority, args, settings))
+
+        # validate all spiders before scheduling anything
+        spiders = {}
+        for i, (project, spider, priority, args, settings) in enumerate(jobs):
+            key = (project, args.get('_version', ''))
+            if key not in spiders:
+                spiders[key] = yield self.root.spiderlists.get(*key)
+            if spider not in spiders[key]:
+                returnValue(self._error("job %d: spider '%s' not found"
+                                        % (i, spider)))
+
+        jobids = []
+        per_project = {}
+        for project, spider, priority, args, settings in jobs:
+            jobids.append(_prepare_job_args(args, settings))
+            per_project.setdefault(project, []).append((spider, priority, args))
+        for project, project_jobs in per_project.items():
+            self.root.scheduler.schedule_many(project, project_jobs)
+        returnValue({"node_name": self.root.nodename, "status": "ok",
+                     "jobids": jobids})
+
+    def _invalid(self, spec, projects):
+        """Return why the job spec is invalid, or None"""
+        if not isinstance(spec, dict):
+            return "not a JSON object"
+        for key in ('project', 'spider'):
+            if key not in spec:
+                return "missing '%s'" % key
+        if not isinstance(spec.get('settings', {}), dict):
+            return "'settings' is not a JSON object"
+        try:
+            float(spec.get('priority', 0))
+        except (TypeError, ValueError):
+            return "invalid priority %r" % (spec['priority'],)
+        if _to_text(spec['project']) not in projects:
+            return "project '%s' not found" % spec['project']
+
+    def _error(self, message):
+        return {"node_name": self.root.nodename, "status": "error",
+                "message": message}
+
+def _prepare_job_args(args, settings):
+    """Fill in the job id, settings and run count of a job about to be
+    scheduled and return its job id"""
+    args['settings'] = settings
+    if '_weight' in args and float(args['_weight']) <= 0:
+        raise ValueError("_weight must be positive")
+    if '_max_running' in args and int(args['_max_running']) < 1:
+        raise ValueError("_max_running must be a positive integer")
+    jobid = args.pop('jobid', uuid.uuid1().hex)
+    args['_job'] = jobid
+    count = 0
+    try:
+        count = int(args.get('count', 0))
+    except:
+        pass
+    if count == 0: count = 1
+    args['count'] = str(count)
+    return jobid
+
+def _to_text(value):
+    if isinstance(value, six.string_types):
+        return value
+    return json.dumps(value)
+
 class Cancel(WsResource):
 
     def render_POST(self, txrequest):
@@ -78,6 +200,8 @@ class Cancel(WsResource):
         c = queue.remove(lambda x: x["_job"] == jobid)
         if c:
             prevstate = "pending"
+            self.root.poller.events.publish(
+                'pending', 'remove', {"project": project, "id": jobid})
         spiders = self.root.launcher.processes.values()
         for s in spiders:
             if s.project == project and s.job == jobid:
@@ -88,12 +212,17 @@ class Cancel(WsResource):
 class AddVersion(WsResource):
 
     def render_POST(self, txrequest):
-        eggf = BytesIO(txrequest.args.pop(b'egg')[0])
-        args = native_stringify_dict(copy(txrequest.args), keys_only=False)
+        args, files = read_form(txrequest, [b'egg'])
+        eggf = files[b'egg']
+        args = native_stringify_dict(args, keys_only=False)
         project = args['project'][0]
         version = args['version'][0]
         self.root.eggstorage.put(eggf, project, version)
-        spiders = get_spider_list(project, version=version)
+        d = self.root.spiderlists.add_version(project, version)
+        d.addCallback(self._added, project, version)
+        return d
+
+    def _added(self, spiders, project, version):
         self.root.update_projects()
         UtilsCache.invalid_cache(project)
         return {"node_name": self.root.nodename, "status": "ok", "project": project, "version": version, \
@@ -115,44 +244,285 @@ class ListVersions(WsResource):
 
 class ListSpiders(WsResource):
 
+    streaming = True
+
     def render_GET(self, txrequest):
         args = native_stringify_dict(copy(txrequest.args), keys_only=False)
         project = args['project'][0]
         version = args.get('_version', [''])[0]
-        spiders = get_spider_list(project, runner=self.root.runner, version=version)
-        return {"node_name": self.root.nodename, "status": "ok", "spiders": spiders}
+        d = self.root.spiderlists.get(project, version)
+        d.addCallback(lambda spiders: {"node_name": self.root.nodename,
+                                       "status": "ok", "spiders": spiders})
+        return d
 
 class ListJobs(WsResource):
+    """The pending, running and finished jobs. The finished jobs are listed
+    in pages of `limit` jobs, `finished_limit` by default, from the `cursor`
+    of the previous page. Without both, the last ones are listed."""
+
+    streaming = True
+    finished_limit = 100
+    time_formats = ('%Y-%m-%d %H:%M:%S.%f', '%Y-%m-%d %H:%M:%S',
+                    '%Y-%m-%d %H:%M', '%Y-%m-%d')
 
     def render_GET(self, txrequest):
         args = native_stringify_dict(copy(txrequest.args), keys_only=False)
         project = args.get('project', [None])[0]
+        spider = args.get('spider', [None])[0]
         spiders = self.root.launcher.processes.values()
         queues = self.root.poller.queues
-        pending = [
-            {"project": qname, "spider": x["name"], "id": x["_job"]}
-            for qname in (queues if project is None else [project])
-            for x in queues[qname].list()
-        ]
+        pending = (
+            pending_job(qname, x)
+            for qname, queue in [(p, queues[p]) for p in
+                                 (list(queues) if project is None else [project])]
+            for x in _iter_queue(queue, spider)
+        )
         running = [
-            {
-                "project": s.project,
-                "spider": s.spider,
-                "id": s.job, "pid": s.pid,
-                "start_time": str(s.start_time),
-            } for s in spiders if project is None or s.project == project
-        ]
-        finished = [
-            {
-                "project": s.project,
-                "spider": s.spider, "id": s.job,
-                "start_time": str(s.start_time),
-                "end_time": str(s.end_time)
-            } for s in self.root.launcher.finished
-            if project is None or s.project == project
+            running_job(s) for s in spiders
+            if (project is None or s.project == project)
+            and (spider is None or s.spider == spider)
         ]
-        return {"node_name": self.root.nodename, "status": "ok",
-                "pending": pending, "running": running, "finished": finished}
+        limit = args.get('limit', [None])[0]
+        cursor = args.get('cursor', [None])[0]
+        try:
+            since, until = [self._parse_time(args.get(k, [None])[0])
+                            for k in ('since', 'until')]
+            cursor = None if cursor is None else int(cursor)
+            limit = None if limit is None else int(limit)
+        except ValueError as e:
+            txrequest.setResponseCode(400)
+            return {"node_name": self.root.nodename, "status": "error",
+                    "message": str(e)}
+        filters = dict(project=project, spider=spider, since=since,
+                       until=until)
+        if limit is None and cursor is None:
+            jobs = self.root.launcher.finished.list(
+                limit=self.finished_limit, reverse=True, **filters)[::-1]
+        else:
+            limit = limit or self.finished_limit
+            jobs = self.root.launcher.finished.list(
+                cursor=cursor, limit=limit, **filters)
+        finished = [finished_job(s) for s in jobs]
+        r = {"node_name": self.root.nodename, "status": "ok",
+             "pending": pending, "running": running, "finished": finished}
+        if cursor is not None or limit is not None:
+            if len(jobs) == limit:
+                r["next_cursor"] = jobs[-1]['id']
+        return r
+
+    def _parse_time(self, value):
+        if value is None:
+            return None
+        value = value.strip().replace('T', ' ')
+        for fmt in self.time_formats:
+            try:
+                return datetime.strptime(value, fmt)
+            except ValueError:
+                pass
+        raise ValueError("Invalid time %r, expected YYYY-MM-DD[ HH:MM[:SS[.ffffff]]]"
+                         % value)
+
+class WatchJobs(WsResource):
+    """Changes of the pending, running and finished jobs after the `since`
+    sequence number, waiting up to `timeout` seconds for some"""
+
+    max_timeout = 60
+
+    @inlineCallbacks
+    def render_GET(self, txrequest):
+        args = dict((k, v[0]) for k, v in native_stringify_dict(
+            copy(txrequest.args), keys_only=False).items())
+        project = args.get('project')
+        spider = args.get('spider')
+        events = self.root.poller.events
+        if 'since' not in args:
+            returnValue({"node_name": self.root.nodename, "status": "ok",
+                         "seq": events.seq, "events": []})
+        seq = int(args['since'])
+        timeout = min(float(args.get('timeout', 30)), self.max_timeout)
+        deadline = time.time() + timeout
+        while True:
+            changes = yield events.wait(seq, max(0, deadline - time.time()))
+            if changes is None:  # older than the kept changes
+                returnValue({"node_name": self.root.nodename, "status": "ok",
+                             "seq": events.seq, "events": [], "reset": True})
+            if changes:
+                seq = changes[-1]['seq']
+            changes = [e for e in changes
+                       if (project is None or e['job']['project'] == project)
+                       and (spider is None
+                            or e['job'].get('spider') in (None, spider))]
+            if changes or time.time() >= deadline:
+                break
+        returnValue({"node_name": self.root.nodename, "status": "ok",
+                     "seq": seq, "events": changes})
+
+class LogTail(WsResource):
+    """The lines of the log of a job after the `offset` byte.
+
+    As JSON, at most `limit` bytes of complete lines are returned, with the
+    offset to ask for next, or the last lines if there is no `offset`. To
+    clients accepting server-sent events, the lines are sent as events, at
+    most the last `backlog` bytes of them, followed by the lines appended to
+    the log of a running job until it finishes. The offset can also be given
+    by the Last-Event-ID header of reconnecting clients. All the clients
+    following the log of a job share a single reader.
+    """
+
+    backlog = 65536
+    max_limit = 1048576
+
+    def __init__(self, root):
+        WsResource.__init__(self, root)
+        self.followers = LogFollowers()
+
+    def render_GET(self, txrequest):
+        args = dict((k, v[0]) for k, v in native_stringify_dict(
+            copy(txrequest.args), keys_only=False).items())
+        project = args['project']
+        job = args['job']
+        spider = args.get('spider')
+        process = None
+        for p in self.root.launcher.processes.values():
+            if p.project == project and p.job == job:
+                process = p
+        if process is not None:
+            path = process.logfile
+        else:
+            path = self._finished_log(project, spider, job)
+        if not path:
+            raise ValueError("No log for job %s of project %s" % (job, project))
+        offset = args.get('offset')
+        accept = txrequest.getHeader(b'accept') or b''
+        if b'text/event-stream' in accept:
+            if offset is None:
+                offset = txrequest.getHeader(b'last-event-id') or 0
+            return self._stream(txrequest, path, process, int(offset))
+        limit = min(int(args.get('limit', 65536)), self.max_limit)
+        r = self._read(path, None if offset is None else int(offset), limit)
+        r.update({"node_name": self.root.nodename, "status": "ok",
+                  "running": process is not None})
+        return r
+
+    def render_object(self, obj, txrequest):
+        if obj is NOT_DONE_YET:
+            return obj
+        return WsResource.render_object(self, obj, txrequest)
+
+    def _finished_log(self, project, spider, job):
+        logs_dir = self.root.app.getComponent(IEnvironment).logs_dir
+        names = [project, job] + ([spider] if spider else [])
+        if not logs_dir or any(os.path.basename(x) != x or x in ('', '.', '..')
+                               for x in names):
+            return None
+        projectdir = os.path.join(logs_dir, project)
+        if spider:
+            spiders = [spider]
+        else:
+            try:
+                spiders = sorted(os.listdir(projectdir))
+            except OSError:
+                return None
+        for name in (job + '.log', job + '.log.gz'):
+            for spider in spiders:
+                path = os.path.join(projectdir, spider, name)
+                if os.path.isfile(path):
+                    return path
+        return None
+
+    def _read(self, path, offset, limit):
+        """Return the complete lines of the log from `offset`, or the last
+        ones, in at most `limit` bytes, and the offset of the next line"""
+        size, start, data = _read_log(path, offset, limit)
+        end = data.rfind(b'\n') + 1
+        if end or len(data) == limit:  # a line longer than limit is cut
+            data = data[:end or limit]
+        lines = data.decode('utf-8', 'replace').splitlines()
+        return {"offset": start, "next": start + len(data), "size": size,
+                "lines": lines}
+
+    def _stream(self, txrequest, path, process, offset):
+        txrequest.setHeader('Content-Type', 'text/event-stream')
+        txrequest.setHeader('Cache-Control', 'no-cache')
+        txrequest.setHeader('Access-Control-Allow-Origin', '*')
+        stream = EventStream(txrequest)
+        if process is None:
+            size, start, data = _read_log(path, offset, self.backlog,
+                                          from_end=True)
+            if data:
+                stream.write(start, data)
+            stream.end()
+            return NOT_DONE_YET
+        done = lambda: process.end_time is not None and \
+            process.output_closed.called
+        self.followers.follow(path, stream, offset, self.backlog, done)
+        txrequest.notifyFinish().addErrback(
+            lambda _: self.followers.unfollow(path, stream))
+        return NOT_DONE_YET
+
+
+def _iter_queue(queue, spider=None):
+    """Iterate over the messages of the spider queue, a page at a time if it
+    supports it"""
+    iterate = getattr(queue, 'iterate', None)
+    if iterate is not None:
+        return iterate(spider)
+    return iter(queue.list(spider=spider))
+
+
+def _read_log(path, offset, limit, from_end=False):
+    """Return the size of the log, compressed or not, and at most `limit`
+    bytes of it from `offset` with their offset. Without `offset`, or if
+    `from_end` is true and there are more than `limit` bytes after it, the
+    last lines in `limit` bytes are read instead."""
+    if not os.path.exists(path) and os.path.exists(path + '.gz'):
+        path += '.gz'  # compressed since found
+    try:
+        if path.endswith('.gz'):
+            f = open_compressed(path)
+            size = f.size
+        else:
+            f = open(path, 'rb')
+            size = os.fstat(f.fileno()).st_size
+    except (IOError, OSError):
+        if os.path.exists(path):
+            raise
+        return 0, 0, b''  # not created yet
+    with f:
+        start = offset
+        if offset is None or (from_end and size - offset > limit):
+            start = max(0, size - limit)
+        f.seek(start)
+        data = f.read(limit)
+    if start > (offset or 0):  # skip the line cut
+        i = data.find(b'\n') + 1
+        start, data = start + i, data[i:]
+    return size, start, data
+
+
+class Metrics(resource.Resource):
+    """The metrics of Scrapyd in the Prometheus text format, see
+    scrapyd.metrics"""
+
+    def __init__(self, root, registry=metrics.REGISTRY):
+        resource.Resource.__init__(self)
+        self.root = root
+        self.registry = registry
+
+    def render_GET(self, txrequest):
+        launcher = self.root.launcher
+        metrics.SLOTS.set(len(launcher.processes), ('running',))
+        metrics.SLOTS.set(len(launcher.waiting), ('waiting',))
+        metrics.SLOTS.set(len(launcher.parked), ('parked',))
+        metrics.MAX_SLOTS.set(launcher.max_proc)
+        t = time.time()
+        busy = launcher.busy_time + sum(t - p.spawn_time
+                                        for p in launcher.processes.values())
+        metrics.SLOT_BUSY_SECONDS.set(busy)
+        body = self.registry.render().encode('utf-8')
+        txrequest.setHeader('Content-Type', 'text/plain; version=0.0.4')
+        txrequest.setHeader('Content-Length', str(len(body)))
+        return body
 
 class DeleteProject(WsResource):
 
@@ -160,6 +530,7 @@ class DeleteProject(WsResource):
         args = native_stringify_dict(copy(txrequest.args), keys_only=False)
         project = args['project'][0]
         self._delete_version(project)
+        self.root.spiderlists.invalidate(project)
         UtilsCache.invalid_cache(project)
         return {"node_name": self.root.nodename, "status": "ok"}
 
@@ -174,5 +545,6 @@ class DeleteVersion(DeleteProject):
         project = args['project'][0]
         version = args['version'][0]
         self._delete_version(project, version)
+        self.root.spiderlists.invalidate(project, version)
         UtilsCache.invalid_cache(project)
         return {"node_name": self.root.nodename, "status": "ok"}
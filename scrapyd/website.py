@@ -1,17 +1,25 @@
 from datetime import datetime, timedelta
 
+import os
+import re
 import socket
 
-from twisted.web import resource, static
+from twisted.web import http, resource, server, static
 from twisted.application.service import IServiceCollection
 
 from scrapy.utils.misc import load_object
 
 from .interfaces import IPoller, IEggStorage, ISpiderScheduler
+from .utils import SpiderListIndex, JsonResource
+from .logstats import epoch_millis
+from .jobevents import SECTIONS
+from .jobfiles import open_compressed, tail_offset
 from datetime import datetime
+from collections import OrderedDict
+from xml.sax.saxutils import escape, quoteattr
 import time
 
-from six.moves.urllib.parse import urlparse
+from six.moves.urllib.parse import urlencode, urlparse
 import jinja2
 
 jenv = jinja2.Environment(loader=jinja2.FileSystemLoader("scrapyd/web_templates"))
@@ -27,14 +35,16 @@ class Root(resource.Resource):
         local_items = itemsdir and (urlparse(itemsdir).scheme.lower() in ['', 'file'])
         self.app = app
         self.nodename = config.get('node_name', socket.gethostname())
+        self.spiderlists = SpiderListIndex(config, self.eggstorage)
         self.putChild(b"main.js", static.File(b"scrapyd/web_static/main.js", "text/javascript"))
         self.putChild(b"main.css", static.File(b"scrapyd/web_static/main.css", "text/css"))
+        self.putChild(b"jobs.js", static.File(b"scrapyd/web_static/jobs.js", "text/javascript"))
         self.putChild(b"logstats_data", LogStatsData(self))
         self.putChild(b'', Home(self, local_items))
         if logsdir:
-            self.putChild(b'logs', static.File(logsdir.encode('ascii', 'ignore'), 'text/plain'))
+            self.putChild(b'logs', JobFile(logsdir.encode('ascii', 'ignore')))
         if local_items:
-            self.putChild(b'items', static.File(itemsdir, 'text/plain'))
+            self.putChild(b'items', JobFile(itemsdir))
         self.putChild(b'jobs', Jobs(self, local_items))
         self.putChild(b'logstats', LogStats(self))
         services = config.items('services', ())
@@ -93,45 +103,122 @@ class LogStats(resource.Resource):
         s = jenv.get_template("logstats.html").render(t_vars)
         return s.encode('utf-8')
 
-class LogStatsData(resource.Resource):
+class LogStatsData(JsonResource):
+    """Stats of the jobs that ended between the `sd` and `ed` days
+    (``YYYYMMDD``, the last 30 days by default), optionally of the `p`
+    project and `s` spider, summed over at most `n` intervals, as series of
+    points for the charts of the logstats page"""
+
+    series = [('items', 'Items', '#2222ff'),
+              ('pages', 'Pages', '#22aa22'),
+              ('errors', 'Errors', '#ff2222')]
 
     def __init__(self, root):
-        resource.Resource.__init__(self)
+        JsonResource.__init__(self)
         self.root = root
 
     def render_GET(self, txrequest):
-        args = txrequest.args
-        txrequest.responseHeaders.addRawHeader(b"content-type", b"application/json")
+        args = dict((k.decode('utf-8'), v[0].decode('utf-8'))
+                    for k, v in txrequest.args.items())
         try:
-            sd = args.get(b'sd')
-            ed = args.get(b'ed')
-            project = args.get(b'p')
-            spider = args.get(b's')
-            sdt = datetime.strptime(sd, "%Y%m%d")
-            edt = datetime.strptime(ed, "%Y%m%d")
-            sd_mil = int(sdt.timestamp()*1000)
-            ed_mil = int(edt.timestamp()*1000)
-
-            if n:
-                n = int(n[0])
-            else:
-                n = 100
-        except:
-            n = 100
-        rand = []
-        import random
-        for i in range(n):
-            rand.append({'x': i, 'y': random.random()})
-
-        rs = [
-            {
-                'values': rand,
-                'key': "random points",
-                'color': "#2222ff"
-            }
-        ]
-        import json
-        return json.dumps(rs).encode('utf8')
+            ed = datetime.strptime(args['ed'], "%Y%m%d") + timedelta(days=1) \
+                if 'ed' in args else datetime.now()
+            sd = datetime.strptime(args['sd'], "%Y%m%d") \
+                if 'sd' in args else ed - timedelta(days=30)
+            n = int(args.get('n', 100))
+        except ValueError as e:
+            txrequest.setResponseCode(400)
+            return {"status": "error", "message": str(e)}
+        stats = self.root.launcher.logstats.get_stats(
+            epoch_millis(sd), epoch_millis(ed), spider=args.get('s'),
+            project=args.get('p'), points=max(1, n))
+        return [{'key': label, 'color': color,
+                 'values': [{'x': p['time'], 'y': p[key]} for p in stats]}
+                for key, label, color in self.series]
+
+
+_accept_gzip = re.compile(br'(?:^|,)\s*(?:x-)?gzip\s*(?:;\s*q=([0-9.]+))?', re.I)
+
+
+def accepts_gzip(request):
+    """Return whether the client accepts gzip content encoding"""
+    header = b','.join(request.requestHeaders.getRawHeaders(b'accept-encoding', []))
+    m = _accept_gzip.search(header)
+    try:
+        return m is not None and float(m.group(1) or 1) > 0
+    except ValueError:
+        return False
+
+
+class JobFile(static.File):
+    """The log and items files of the jobs, or their directories.
+
+    The files compressed once their job finished (see compress_files) are
+    served at the URL of the original file, as they are if the client
+    accepts gzip, and decompressed otherwise. Ranges of compressed files are
+    read by decompressing only the blocks they span. With a `tail` argument,
+    only the last `tail` lines of the file are sent, read from its end.
+    """
+
+    def __init__(self, path, defaultType='text/plain', ignoredExts=('.gz',),
+                 registry=None):
+        static.File.__init__(self, path, defaultType, ignoredExts, registry)
+        self.compressed = os.path.splitext(self.path)[1] in ('.gz', b'.gz')
+        self.decompress = False
+        self.reader = None  # over the decompressed content
+
+    def render_GET(self, request):
+        tail = request.args.get(b'tail')
+        if tail is not None:
+            try:
+                tail = int(tail[0])
+            except ValueError:
+                request.setResponseCode(http.BAD_REQUEST)
+                return b'Invalid tail argument'
+        if self.compressed:
+            request.setHeader(b'vary', b'Accept-Encoding')
+            if tail is not None or request.getHeader(b'range') is not None \
+                    or not accepts_gzip(request):
+                self.type, _ = static.getTypeAndEncoding(
+                    self.basename(), self.contentTypes,
+                    self.contentEncodings, self.defaultType)
+                self.encoding = None
+                self.decompress = True
+        if tail is None:
+            return static.File.render_GET(self, request)
+        return self._render_tail(request, tail)
+
+    render_HEAD = render_GET
+
+    def _render_tail(self, request, lines):
+        self.restat(False)
+        if not self.exists() or self.isdir():
+            return self.childNotFound.render(request)
+        if self.type is None:
+            self.type, self.encoding = static.getTypeAndEncoding(
+                self.basename(), self.contentTypes, self.contentEncodings,
+                self.defaultType)
+        f = self.openForReading()
+        size = self.getFileSize()
+        offset = tail_offset(f, size, lines)
+        self._setContentHeaders(request, size - offset)
+        if request.method == b'HEAD':
+            f.close()
+            return b''
+        static.SingleRangeStaticProducer(request, f, offset,
+                                         size - offset).start()
+        return server.NOT_DONE_YET
+
+    def openForReading(self):
+        if self.decompress:
+            self.reader = open_compressed(self.path)
+            return self.reader
+        return static.File.openForReading(self)
+
+    def getFileSize(self):
+        if self.reader is not None:
+            return self.reader.size
+        return static.File.getFileSize(self)
 
 
 def microsec_trunc(timelike):
@@ -142,12 +229,35 @@ def microsec_trunc(timelike):
     return timelike - timedelta(microseconds=ms)
 
 
+def cpu_time(usage):
+    if usage and 'cpu_user' in usage:
+        return '%.1fs' % (usage['cpu_user'] + usage['cpu_system'])
+
+
+def peak_memory(usage):
+    if usage and 'max_rss' in usage:
+        return '%.1f MB' % (usage['max_rss'] / 1048576.0)
+
+
 class Jobs(resource.Resource):
+    """The pending, running and finished jobs, optionally of the `project`
+    and `spider` given as arguments, a page of `limit` jobs of each section
+    at a time, starting at the `pending`, `running` and `finished` offsets.
+
+    With a `section` argument only the rows of that section are rendered,
+    which the page uses to reload the sections whose jobs changed, waiting
+    for the changes with watchjobs.json. The rows of the pending and finished
+    sections are cached until their jobs change.
+    """
+
+    page_size = 100
+    cache_size = 64
 
     def __init__(self, root, local_items):
         resource.Resource.__init__(self)
         self.root = root
         self.local_items = local_items
+        self.cache = OrderedDict()  # key -> (version, rows)
 
     cancel_button = """
     <form method="post" action="/cancel.json">
@@ -161,6 +271,7 @@ class Jobs(resource.Resource):
         'Project', 'Spider',
         'Job', 'PID', 'Count',
         'Start', 'Runtime', 'Finish',
+        'CPU', 'Memory',
         'Log', 'Items',
         'Cancel',
     ]
@@ -186,7 +297,10 @@ class Jobs(resource.Resource):
         cells = ['<td>%s</td>' % ('' if c is None else c) for c in cells]
         return '<tr>%s</tr>' % ''.join(cells)
 
-    def prep_doc(self):
+    def prep_doc(self, view):
+        script = ''
+        if b'watchjobs.json' in self.root.children:
+            script = '<script src="/jobs.js"></script>'
         return (
             '<html>'
             '<head>'
@@ -195,71 +309,201 @@ class Jobs(resource.Resource):
             '</head>'
             '<body><h1>Jobs</h1>'
             '<p><a href="..">Go up</a></p>'
-            + self.prep_table() +
+            + self.prep_filters(view)
+            + self.prep_table(view)
+            + script +
             '</body>'
             '</html>'
         )
 
-    def prep_table(self):
+    def prep_filters(self, view):
         return (
-            '<table id="jobs" border="1">'
+            '<form method="get" action="/jobs"><p>'
+            'Project <input name="project" value=%s/> '
+            'Spider <input name="spider" value=%s/> '
+            '<input type="submit" value="Filter"/>'
+            '</p></form>' % (quoteattr(view['project'] or ''),
+                             quoteattr(view['spider'] or ''))
+        )
+
+    def prep_table(self, view):
+        # read before the rows, so the page misses no change after them
+        events = getattr(self.root.poller, 'events', None)
+        seq = events.seq if events is not None else 0
+        return (
+            '<table id="jobs" border="1" data-seq="%d">' % seq +
             '<thead>' + self.prep_row(self.header_cols) + '</thead>'
-            '<tbody>'
-            + '<tr><th colspan="%d">Pending</th></tr>' % len(self.header_cols)
-            + self.prep_tab_pending() +
-            '</tbody>'
-            '<tbody>'
-            + '<tr><th colspan="%d">Running</th></tr>' % len(self.header_cols)
-            + self.prep_tab_running() +
-            '</tbody>'
-            '<tbody>'
-            + '<tr><th colspan="%d">Finished</th></tr>' % len(self.header_cols)
-            + self.prep_tab_finished() +
-            '</tbody>'
+            + ''.join(self.prep_section(section, view)
+                      for section in SECTIONS) +
             '</table>'
         )
 
-    def prep_tab_pending(self):
-        return '\n'.join(
-            self.prep_row(dict(
-                Project=project, Spider=m['name'], Job=m['_job'],
-                Count=int(m.get('count', 1)),
-                Cancel=self.cancel_button(project=project, jobid=m['_job'])
-            ))
-            for project, queue in self.root.poller.queues.items()
-            for m in queue.list()
+    def prep_section(self, section, view):
+        offset, limit = view[section], view['limit']
+        total, rows = getattr(self, 'prep_tab_' + section)(view, offset, limit)
+        return (
+            '<tbody id="%s">' % section
+            + '<tr><th colspan="%d">%s (%d)</th></tr>' % (
+                len(self.header_cols), section.capitalize(), total)
+            + rows
+            + self.prep_pager(section, view, total) +
+            '</tbody>'
         )
 
-    def prep_tab_running(self):
-        return '\n'.join(
+    def prep_pager(self, section, view, total):
+        offset, limit = view[section], view['limit']
+        if offset == 0 and total <= limit:
+            return ''
+        if offset < total:
+            links = ['%d-%d of %d' % (offset + 1, min(offset + limit, total),
+                                      total)]
+        else:
+            links = ['none of %d' % total]
+        if offset > 0:
+            links.append('<a href="%s">Previous</a>' % self.page_url(
+                view, section, max(0, min(offset, total) - limit)))
+        if offset + limit < total:
+            links.append('<a href="%s">Next</a>' % self.page_url(
+                view, section, offset + limit))
+        return '<tr><td colspan="%d">%s</td></tr>' % (len(self.header_cols),
+                                                      ' '.join(links))
+
+    def page_url(self, view, section, offset):
+        args = [(k, view[k]) for k in ('project', 'spider')
+                if view[k] is not None]
+        if view['limit'] != self.page_size:
+            args.append(('limit', view['limit']))
+        args.extend((s, offset if s == section else view[s])
+                    for s in SECTIONS
+                    if (offset if s == section else view[s]))
+        return escape('/jobs?' + urlencode(args))
+
+    def prep_tab_pending(self, view, offset, limit):
+        queues = self.root.poller.queues
+        project, spider = view['project'], view['spider']
+        projects = sorted(queues) if project is None else \
+            [project] if project in queues else []
+        # the queues also change when other processes write them
+        versions = tuple(queues[p].version() if hasattr(queues[p], 'version')
+                         else queues[p].count(spider) for p in projects)
+
+        def render():
+            counts = tuple((p, queues[p].count(spider)) for p in projects)
+            return sum(n for _, n in counts), '\n'.join(
+                self.prep_row(dict(
+                    Project=project, Spider=m['name'], Job=m['_job'],
+                    Count=int(m.get('count', 1)),
+                    Cancel=self.cancel_button(project=project,
+                                              jobid=m['_job'])
+                ))
+                for project, m in self._pending(counts, spider, offset, limit)
+            )
+        key = ('pending', project, spider, offset, limit)
+        return self._cached(key, 'pending', render, versions)
+
+    def _pending(self, counts, spider, offset, limit):
+        """Return the (project, message) pairs of the page of pending jobs,
+        reading only its messages from the queues"""
+        queues = self.root.poller.queues
+        pending = []
+        for project, n in counts:
+            if offset >= n:
+                offset -= n
+                continue
+            messages = queues[project].list(offset=offset,
+                                            limit=limit - len(pending),
+                                            spider=spider)
+            pending.extend((project, m) for m in messages)
+            offset = 0
+            if len(pending) >= limit:
+                break
+        return pending
+
+    def prep_tab_running(self, view, offset, limit):
+        processes = [p for p in self.root.launcher.processes.values()
+                     if view['project'] in (None, p.project)
+                     and view['spider'] in (None, p.spider)]
+        return len(processes), '\n'.join(
             self.prep_row(dict(
                 Project=p.project, Spider=p.spider,
                 Job=p.job, PID=p.pid, Count=int(p.msg.get('count', 1)),
                 Start=microsec_trunc(p.start_time),
                 Runtime=microsec_trunc(datetime.now() - p.start_time),
+                CPU=cpu_time(p.usage), Memory=peak_memory(p.usage),
                 Log='<a href="/logs/%s/%s/%s.log">Log</a>' % (p.project, p.spider, p.job),
                 Items='<a href="/items/%s/%s/%s.jl">Items</a>' % (p.project, p.spider, p.job),
                 Cancel=self.cancel_button(project=p.project, jobid=p.job)
             ))
-            for p in self.root.launcher.processes.values()
+            for p in processes[offset:offset + limit]
         )
 
-    def prep_tab_finished(self):
-        return '\n'.join(
-            self.prep_row(dict(
-                Project=p['project'], Spider=p['spider'],
-                Job=p['job'], Count=int(p['msg'].get('count', 1)),
-                Start=microsec_trunc(p['start_time']),
-                Runtime=microsec_trunc(p['end_time'] - p['start_time']),
-                Finish=microsec_trunc(p['end_time']),
-                Log='<a href="/logs/%s/%s/%s.log">Log</a>' % (p['project'], p['spider'], p['job']),
-                Items='<a href="/items/%s/%s/%s.jl">Items</a>' % (p['project'], p['spider'], p['job']),
-            ))
-            for p in self.root.launcher.finished
-        )
+    def prep_tab_finished(self, view, offset, limit):
+        finished = self.root.launcher.finished
+        project, spider = view['project'], view['spider']
+
+        def render():
+            return finished.count(project=project, spider=spider), '\n'.join(
+                self.prep_row(dict(
+                    Project=p['project'], Spider=p['spider'],
+                    Job=p['job'], Count=int(p['msg'].get('count', 1)),
+                    Start=microsec_trunc(p['start_time']),
+                    Runtime=microsec_trunc(p['end_time'] - p['start_time']),
+                    Finish=microsec_trunc(p['end_time']),
+                    CPU=cpu_time(p['usage']), Memory=peak_memory(p['usage']),
+                    Log='<a href="/logs/%s/%s/%s.log">Log</a>' % (p['project'], p['spider'], p['job']),
+                    Items='<a href="/items/%s/%s/%s.jl">Items</a>' % (p['project'], p['spider'], p['job']),
+                ))
+                for p in finished.list(project=project, spider=spider,
+                                       offset=offset, limit=limit)
+            )
+        # the finished jobs are only added by the launcher of this process
+        key = ('finished', project, spider, offset, limit)
+        return self._cached(key, 'finished', render)
+
+    def _cached(self, key, section, render, version=None):
+        """Return the total and rows returned by render(), cached until the
+        jobs of the section, or the given `version`, change"""
+        events = getattr(self.root.poller, 'events', None)
+        if events is None:
+            return render()
+        version = events.versions[section], version
+        cached = self.cache.pop(key, None)
+        if cached is None or cached[0] != version:
+            cached = version, render()
+        self.cache[key] = cached
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return cached[1]
+
+    def get_view(self, txrequest):
+        args = dict((k.decode('utf-8'), v[0].decode('utf-8'))
+                    for k, v in txrequest.args.items())
+        view = {'project': args.get('project') or None,
+                'spider': args.get('spider') or None,
+                'limit': int(args.get('limit', self.page_size))}
+        for section in SECTIONS:
+            view[section] = max(0, int(args.get(section, 0)))
+        if view['limit'] < 1:
+            raise ValueError("limit must be at least 1")
+        return view, args.get('section')
 
     def render(self, txrequest):
-        doc = self.prep_doc()
-        txrequest.setHeader('Content-Type', 'text/html; charset=utf-8')
+        try:
+            view, section = self.get_view(txrequest)
+            if section not in (None,) + SECTIONS:
+                raise ValueError("unknown section %r" % section)
+        except ValueError as e:
+            # the message may contain the arguments, so not sent as HTML
+            txrequest.setResponseCode(400)
+            doc = str(e)
+            content_type = 'text/plain; charset=utf-8'
+        else:
+            if section is None:
+                doc = self.prep_doc(view)
+            else:
+                doc = self.prep_section(section, view)
+            content_type = 'text/html; charset=utf-8'
+        doc = doc.encode('utf-8')
+        txrequest.setHeader('Content-Type', content_type)
         txrequest.setHeader('Content-Length', str(len(doc)))
-        return doc.encode('utf-8')
+        return doc